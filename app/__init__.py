@@ -12,9 +12,100 @@ def create_app(env="development"):
     app = Flask(__name__)
     app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL") or "sqlite:///dev.db"
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # DB_POOL_SIZE / DB_MAX_OVERFLOW / DB_POOL_TIMEOUT / DB_POOL_RECYCLE / DB_POOL_PRE_PING
+    from .pool import engine_options
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
     app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev-key")
+    app.config["IDEMPOTENCY_CACHE_SIZE"] = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 10000))
+    app.config["IDEMPOTENCY_CACHE_TTL"] = float(os.getenv("IDEMPOTENCY_CACHE_TTL", 300))
+    app.config["CARD_CACHE_SIZE"] = int(os.getenv("CARD_CACHE_SIZE", 50000))
+    app.config["CARD_CACHE_TTL"] = float(os.getenv("CARD_CACHE_TTL", 600))
+    app.config["CARD_CACHE_GENERATION_FILE"] = os.getenv("CARD_CACHE_GENERATION_FILE")
+    # 0 disables the wallet balance cache
+    app.config["BALANCE_CACHE_SIZE"] = int(os.getenv("BALANCE_CACHE_SIZE", 100000))
+    app.config["BALANCE_CACHE_TTL"] = float(os.getenv("BALANCE_CACHE_TTL", 60))
+    app.config["BALANCE_CACHE_VERSION_FILE"] = os.getenv("BALANCE_CACHE_VERSION_FILE")
+    # "balance": currency_balances rows are authoritative, the journal is an audit trail
+    # "journal": balances are snapshot + journal tail, credits only append
+    app.config["LEDGER_MODE"] = os.getenv("LEDGER_MODE", "balance")
+    # rows per (user, month, currency, type, direction) in monthly_statements;
+    # raise it when a few accounts take most of the traffic
+    app.config["STATEMENT_SHARDS"] = int(os.getenv("STATEMENT_SHARDS", 1))
+    # cover a short/missing card-currency balance from the other currency
+    app.config["AUTH_CROSS_CURRENCY"] = os.getenv("AUTH_CROSS_CURRENCY", "0") == "1"
+    # exported months of transactions / card_auth_requests (flask archive)
+    app.config["ARCHIVE_DIR"] = os.getenv("ARCHIVE_DIR", "archive")
+    app.config["ARCHIVE_KEEP_DETACHED"] = os.getenv("ARCHIVE_KEEP_DETACHED", "0") == "1"
     db.init_app(app)
 
+    # orjson-backed app.json when installed; JSON_PROVIDER=stdlib keeps Flask's
+    from . import json_provider
+    json_provider.init_app(app, os.getenv("JSON_PROVIDER", "fast"))
+
+    # checkout wait / hold time per request (Server-Timing) and GET /internal/pool
+    from . import pool
+    pool.init_app(app)
+
+    # GET /metrics: latency per route, DB statements per request, auth outcomes
+    from . import metrics
+    metrics.init_app(app)
+
+    # ADMISSION_LIMIT>0: slots reserved for authorize, reads/bulk shed first with 503
+    from . import admission
+    admission.init_app(app)
+
+    # SQL_PROFILE=1: per-request statement logs, N+1 warnings, slow-query plans
+    from . import profiler
+    profiler.init_app(app)
+
+    # password hashing on a bounded thread pool (PASSWORD_SCHEME / PASSWORD_ROUNDS)
+    from . import passwords
+    app.extensions["password_hasher"] = passwords.from_env()
+
+    # card_auth_requests retention purge and compact response storage
+    from . import idempotency
+    idempotency.init_app(app)
+
+    # REPLICA_DATABASE_URL: history/wallet reads from a replica unless it lags or the client just wrote
+    from . import replica
+    replica.init_app(app)
+
+    # AUTH_GROUP_COMMIT=1: concurrent authorizations share one transaction
+    from . import group_commit
+    group_commit.init_app(app)
+
+    # recent authorization responses by idempotency_key, in front of card_auth_requests
+    from .cache import TTLCache
+    app.extensions["idempotency_cache"] = TTLCache(app.config["IDEMPOTENCY_CACHE_SIZE"], app.config["IDEMPOTENCY_CACHE_TTL"])
+
+    # cards by masked PAN; invalidated on commit, across workers via a shared file
+    from . import card_cache
+    card_cache.install_listeners()
+    app.extensions["card_cache"] = card_cache.CardCache(
+        app.config["CARD_CACHE_SIZE"],
+        app.config["CARD_CACHE_TTL"],
+        app.config["CARD_CACHE_GENERATION_FILE"] or card_cache.default_generation_file(app.config["SQLALCHEMY_DATABASE_URI"]),
+    )
+
+    # wallet balances by user; version-stamped, invalidated on commit across workers
+    from . import balance_cache
+    balance_cache.install_listeners()
+    app.extensions["balance_cache"] = None
+    if app.config["BALANCE_CACHE_SIZE"]:
+        app.extensions["balance_cache"] = balance_cache.BalanceCache(
+            app.config["BALANCE_CACHE_SIZE"],
+            app.config["BALANCE_CACHE_TTL"],
+            app.config["BALANCE_CACHE_VERSION_FILE"] or balance_cache.default_version_file(app.config["SQLALCHEMY_DATABASE_URI"]),
+        )
+
+    # USD/LBP rate snapshot, refreshed in the background (see app/fx.py)
+    from . import fx
+    app.extensions["rates"] = fx.RateBook(
+        app,
+        float(os.getenv("EXCHANGE_RATE_REFRESH", 5)),
+        float(os.getenv("EXCHANGE_RATE_MAX_AGE", 60)),
+    )
+
     # register blueprints
     from .routes.auth import bp as auth_bp
     from .routes.transfer import bp as transfer_bp
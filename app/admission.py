@@ -0,0 +1,193 @@
+"""
+Priority-aware admission control (ADMISSION_LIMIT > 0).
+
+Every request is classed by endpoint:
+
+    critical  ADMISSION_CRITICAL (webhook.authorize)
+    low       ADMISSION_LOW (history, wallet and bulk reads, rates, bulk transfers)
+    normal    everything else; /metrics and /internal/* are never limited
+
+and admitted against a per-process limit on requests in flight. Critical
+requests may fill all ADMISSION_LIMIT slots, normal ones stop short of the
+ADMISSION_RESERVED slots kept for authorizations (default a quarter of
+them), and low ones only get ADMISSION_LOW_SHARE of what normal may use. A
+class that is over its share waits in line for at most its
+ADMISSION_QUEUE_MS budget (critical:1000, normal:500, low:100 by default),
+behind every waiting request of a higher class. Time
+already spent upstream, from an `X-Request-Start: t=<epoch>` header set by
+the proxy, counts against the same budget. Low requests are also shed
+outright while the connection pool is at least ADMISSION_SHED_SATURATION
+full.
+
+Whatever is not admitted gets 503 with Retry-After: ADMISSION_RETRY_AFTER
+seconds. Rejections, time in the queue and the in-flight / waiting counts
+are on /metrics.
+"""
+
+import os
+import threading
+import time
+
+from flask import g, jsonify, request
+
+from . import db, metrics, pool
+
+CLASSES = ("critical", "normal", "low")
+DEFAULT_CRITICAL = "webhook.authorize"
+DEFAULT_LOW = (
+    "payments.payment_history,payments.get_wallets,payments.get_wallets_bulk,payments.wallet_summary,"
+    "transfer.rates,transfer.transfer_batch"
+)
+DEFAULT_QUEUE_MS = "critical:1000,normal:500,low:100"
+EXEMPT = frozenset({"metrics", "pool_status", "replica_status", "static"})
+
+
+def parse_queue_ms(value):
+    """'critical:1000,normal:500' -> {class: seconds}; unlisted classes don't wait."""
+    budgets = dict.fromkeys(CLASSES, 0.0)
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        cls, _, ms = item.partition(":")
+        if cls.strip() not in budgets:
+            raise ValueError(f"unknown admission class {cls.strip()!r}")
+        budgets[cls.strip()] = float(ms) / 1000.0
+    return budgets
+
+
+def upstream_wait(header, now=None):
+    """Seconds since the proxy's X-Request-Start (t= seconds, ms or us), 0 when absent or bad."""
+    if not header:
+        return 0.0
+    try:
+        start = float(header.strip().removeprefix("t="))
+    except ValueError:
+        return 0.0
+    if start > 1e14:
+        start /= 1e6
+    elif start > 1e11:
+        start /= 1e3
+    return max(0.0, (now or time.time()) - start)
+
+
+class Limiter:
+    def __init__(self, limit, reserved, low_share=0.5):
+        if limit < 1:
+            raise ValueError("ADMISSION_LIMIT must be >= 1")
+        reserved = min(max(reserved, 0), limit - 1)
+        self.limit = limit
+        self.caps = {
+            "critical": limit,
+            "normal": limit - reserved,
+            "low": max(1, int((limit - reserved) * low_share)),
+        }
+        self.in_flight = 0
+        self.waiting = dict.fromkeys(CLASSES, 0)
+        self._cond = threading.Condition()
+
+    def _may_enter(self, cls):
+        if self.in_flight >= self.caps[cls]:
+            return False
+        # anyone of a higher class already in line goes first
+        for higher in CLASSES[:CLASSES.index(cls)]:
+            if self.waiting[higher]:
+                return False
+        return True
+
+    def acquire(self, cls, timeout):
+        """Take a slot for `cls`, waiting up to `timeout` seconds. Returns the seconds waited, or None."""
+        with self._cond:
+            if self._may_enter(cls):
+                self.in_flight += 1
+                return 0.0
+            if timeout <= 0:
+                return None
+            started = time.monotonic()
+            deadline = started + timeout
+            self.waiting[cls] += 1
+            try:
+                while not self._may_enter(cls):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+                return time.monotonic() - started
+            finally:
+                self.waiting[cls] -= 1
+                # lower classes may have been held back by this waiter
+                self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def gauges(self, labels=()):
+        with self._cond:
+            waiting = [(tuple(labels) + (("class", cls),), self.waiting[cls]) for cls in CLASSES]
+            in_flight = self.in_flight
+        return [
+            ("admission_in_flight", "Requests admitted and not yet finished.", [(tuple(labels), in_flight)]),
+            ("admission_waiting", "Requests queued for admission, by class.", waiting),
+            ("admission_limit", "Slots a class may fill (ADMISSION_LIMIT less reservations).",
+             [(tuple(labels) + (("class", cls),), self.caps[cls]) for cls in CLASSES]),
+        ]
+
+
+def _endpoints(value):
+    return frozenset(e.strip() for e in value.split(",") if e.strip())
+
+
+def init_app(app):
+    app.config.setdefault("ADMISSION_LIMIT", int(os.getenv("ADMISSION_LIMIT", 0)))
+    app.config.setdefault("ADMISSION_RESERVED", int(os.getenv("ADMISSION_RESERVED", 0)))
+    app.config.setdefault("ADMISSION_LOW_SHARE", float(os.getenv("ADMISSION_LOW_SHARE", 0.5)))
+    app.config.setdefault("ADMISSION_QUEUE_MS", os.getenv("ADMISSION_QUEUE_MS", DEFAULT_QUEUE_MS))
+    app.config.setdefault("ADMISSION_RETRY_AFTER", int(os.getenv("ADMISSION_RETRY_AFTER", 2)))
+    app.config.setdefault("ADMISSION_SHED_SATURATION", float(os.getenv("ADMISSION_SHED_SATURATION", 0.9)))
+    app.config.setdefault("ADMISSION_CRITICAL", os.getenv("ADMISSION_CRITICAL", DEFAULT_CRITICAL))
+    app.config.setdefault("ADMISSION_LOW", os.getenv("ADMISSION_LOW", DEFAULT_LOW))
+    limit = app.config["ADMISSION_LIMIT"]
+    if not limit:
+        return
+
+    reserved = app.config["ADMISSION_RESERVED"] or max(1, limit // 4)
+    limiter = app.extensions["admission"] = Limiter(limit, reserved, app.config["ADMISSION_LOW_SHARE"])
+    budgets = parse_queue_ms(app.config["ADMISSION_QUEUE_MS"])
+    critical = _endpoints(app.config["ADMISSION_CRITICAL"])
+    low = _endpoints(app.config["ADMISSION_LOW"])
+    retry_after = str(app.config["ADMISSION_RETRY_AFTER"])
+    shed_at = app.config["ADMISSION_SHED_SATURATION"]
+
+    def reject(cls, reason):
+        metrics.inc("admission_rejected_total", (("class", cls), ("reason", reason)))
+        resp = jsonify({"error": "overloaded, retry later"})
+        resp.status_code = 503
+        resp.headers["Retry-After"] = retry_after
+        return resp
+
+    @app.before_request
+    def admit():
+        endpoint = request.endpoint
+        if endpoint is None or endpoint in EXEMPT:
+            return None
+        cls = "critical" if endpoint in critical else "low" if endpoint in low else "normal"
+        budget = budgets[cls] - upstream_wait(request.headers.get("X-Request-Start"))
+        if budget < 0:
+            return reject(cls, "queue_time")
+        if cls == "low" and shed_at:
+            sat = pool.saturation(db.engine)
+            if sat is not None and sat["saturation"] >= shed_at:
+                return reject(cls, "pool_saturated")
+        waited = limiter.acquire(cls, budget)
+        if waited is None:
+            return reject(cls, "queue_timeout" if budget > 0 else "capacity")
+        g.admitted = True
+        metrics.observe("admission_queue_seconds", (("class", cls),), waited)
+        return None
+
+    @app.teardown_request
+    def release(exc):
+        if g.pop("admitted", False):
+            limiter.release()
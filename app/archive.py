@@ -0,0 +1,332 @@
+"""
+Monthly partitions and cold archive for transactions and card_auth_requests.
+
+On Postgres `transactions` is range-partitioned by month (migration
+e4b8a1c7f902); `ensure_partitions()` creates the months ahead. `archive()`
+exports every whole month before a cutoff to ARCHIVE_DIR, one compressed
+file per table and month (Parquet/zstd when pyarrow is installed, gzipped
+NDJSON otherwise), records it in ARCHIVE_DIR/manifest.json and only then
+detaches (and drops) the month's partition. Months without a partition of
+their own, and SQLite, are deleted in batches instead.
+
+Each file is written in blocks of up to EXPORT_BATCH rows (a Parquet row
+group, or a gzip member of its own), and a transactions file gets an index
+next to it, `<file>.idx.json`: where each block starts and which rows every
+user appears in. `history()` reads a user's archived transactions newest
+first, for `GET /api/payments/payments/history/<user_id>?archive=1`, from
+the index: only months the user has rows in, and in them only the blocks
+holding those rows, until the page is full. Files archived before there
+were indexes are scanned.
+"""
+
+import gzip
+import json
+import os
+from bisect import bisect_right
+from datetime import datetime
+from functools import lru_cache
+
+from flask import current_app
+from sqlalchemy import delete, select, text, tuple_
+
+from . import db
+from .models import CardAuthRequest, Transaction
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:  # optional: fall back to gzipped NDJSON
+    pyarrow = None
+
+MONTHS_AHEAD = 2
+EXPORT_BATCH = 5000
+
+TABLES = {
+    "transactions": (Transaction, Transaction.created_at),
+    "card_auth_requests": (CardAuthRequest, CardAuthRequest.processed_at),
+}
+# the user columns history() looks rows up by
+INDEX_COLUMNS = {"transactions": ("from_user_id", "to_user_id")}
+JSON_COLUMNS = {"details", "request_payload", "response_payload"}
+TIME_COLUMNS = {"created_at", "processed_at"}
+
+
+def month_start(d):
+    return d.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(d):
+    return d.replace(year=d.year + 1, month=1) if d.month == 12 else d.replace(month=d.month + 1)
+
+
+def partition_name(month):
+    return "transactions_p" + month.strftime("%Y%m")
+
+
+def _postgres():
+    return db.session.get_bind().dialect.name == "postgresql"
+
+
+def ensure_partitions(months_ahead=MONTHS_AHEAD, now=None):
+    """Create missing monthly partitions through `months_ahead`; returns their names."""
+    if not _postgres():
+        return []
+    month = month_start(now or datetime.utcnow())
+    created = []
+    for _ in range(months_ahead + 1):
+        name = partition_name(month)
+        exists = db.session.execute(text("SELECT to_regclass(:n)"), {"n": name}).scalar()
+        if exists is None:
+            db.session.execute(text(
+                "CREATE TABLE %s PARTITION OF transactions FOR VALUES FROM ('%s') TO ('%s')"
+                % (name, month.isoformat(), next_month(month).isoformat())
+            ))
+            created.append(name)
+        month = next_month(month)
+    db.session.commit()
+    return created
+
+
+# -- files -------------------------------------------------------------------------
+
+def _encode(row):
+    out = {}
+    for key, value in row.items():
+        if key in JSON_COLUMNS:
+            value = json.dumps(value)
+        elif key in TIME_COLUMNS and value is not None:
+            value = value.isoformat()
+        out[key] = value
+    return out
+
+
+def _decode(row):
+    for key in JSON_COLUMNS & row.keys():
+        if row[key] is not None:
+            row[key] = json.loads(row[key])
+    for key in TIME_COLUMNS & row.keys():
+        if row[key] is not None:
+            row[key] = datetime.fromisoformat(row[key])
+    return row
+
+
+class _Writer:
+    """
+    Batches of encoded rows into one Parquet or .jsonl.gz file, one block
+    (row group / gzip member) per batch, plus the user index when
+    `index_columns` are given.
+    """
+
+    def __init__(self, base, index_columns=()):
+        self.rows = 0
+        self.index_path = None
+        self._index_columns = index_columns
+        self._blocks = []
+        self._users = {}
+        self._parquet = None
+        if pyarrow is not None:
+            self.path = base + ".parquet"
+        else:
+            self.path = base + ".jsonl.gz"
+            self._gz = open(self.path + ".tmp", "wb")
+
+    def write(self, rows):
+        if not rows:
+            return
+        block = {"row": self.rows}
+        for n, row in enumerate(rows, self.rows):
+            for column in self._index_columns:
+                if row[column] is None:
+                    continue
+                seen = self._users.setdefault(row[column], [])
+                if not seen or seen[-1] != n:  # a self-transfer is one row
+                    seen.append(n)
+        self.rows += len(rows)
+        if pyarrow is None:
+            data = gzip.compress("".join(json.dumps(row) + "\n" for row in rows).encode("utf-8"))
+            block.update(offset=self._gz.tell(), length=len(data))
+            self._gz.write(data)
+        else:
+            batch = pyarrow.Table.from_pylist(rows)
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(self.path + ".tmp", batch.schema, compression="zstd")
+            self._parquet.write_table(batch.cast(self._parquet.schema), row_group_size=len(rows))
+        self._blocks.append(block)
+
+    def close(self):
+        if pyarrow is None:
+            self._gz.close()
+            if not self.rows:
+                os.unlink(self.path + ".tmp")
+                return
+        elif self._parquet is not None:
+            self._parquet.close()
+        else:
+            return  # nothing written
+        if self._index_columns:
+            # the index goes first: a listed file always has one
+            self.index_path = self.path + ".idx.json"
+            with open(self.index_path + ".tmp", "w") as f:
+                json.dump({"blocks": self._blocks, "users": self._users}, f, separators=(",", ":"))
+            os.replace(self.index_path + ".tmp", self.index_path)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def read_file(path):
+    """Yield the decoded rows of an archive file."""
+    if path.endswith(".parquet"):
+        if pyarrow is None:
+            raise RuntimeError("pyarrow is required to read " + path)
+        for batch in pq.ParquetFile(path).iter_batches(EXPORT_BATCH):
+            for row in batch.to_pylist():
+                yield _decode(row)
+        return
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield _decode(json.loads(line))
+
+
+@lru_cache(maxsize=64)
+def _load_index(path, mtime_ns):
+    with open(path) as f:
+        index = json.load(f)
+    return [b["row"] for b in index["blocks"]], index["blocks"], index["users"]
+
+
+def _read_rows(path, block, number, offsets):
+    """The rows at `offsets` (ascending, within the block) of one block, decoded."""
+    if path.endswith(".parquet"):
+        if pyarrow is None:
+            raise RuntimeError("pyarrow is required to read " + path)
+        table = pq.ParquetFile(path).read_row_group(number)
+        return [_decode(row) for row in table.take(offsets).to_pylist()]
+    with open(path, "rb") as f:
+        f.seek(block["offset"])
+        lines = gzip.decompress(f.read(block["length"])).decode("utf-8").splitlines()
+    return [_decode(json.loads(lines[n])) for n in offsets]
+
+
+def _user_rows(directory, entry, user_id):
+    """Yield the user's rows of one archived month, newest first."""
+    path = os.path.join(directory, entry["file"])
+    if "index" not in entry:
+        rows = [r for r in read_file(path) if user_id in (r["from_user_id"], r["to_user_id"])]
+        rows.sort(key=lambda r: (r["created_at"], r["id"]), reverse=True)
+        yield from rows
+        return
+    index_path = os.path.join(directory, entry["index"])
+    starts, blocks, users = _load_index(index_path, os.stat(index_path).st_mtime_ns)
+    by_block = {}
+    for n in users.get(user_id, ()):
+        number = bisect_right(starts, n) - 1
+        by_block.setdefault(number, []).append(n - starts[number])
+    # rows were written oldest first, so walk the blocks and rows backwards
+    for number in sorted(by_block, reverse=True):
+        yield from reversed(_read_rows(path, blocks[number], number, by_block[number]))
+
+
+def load_manifest(directory):
+    try:
+        with open(os.path.join(directory, "manifest.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {name: [] for name in TABLES}
+
+
+def _save_manifest(directory, manifest):
+    path = os.path.join(directory, "manifest.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+# -- archive -----------------------------------------------------------------------
+
+def _export_month(table, month, directory):
+    model, column = TABLES[table]
+    upper = next_month(month)
+    writer = _Writer(os.path.join(directory, "%s-%s" % (table, month.strftime("%Y-%m"))), INDEX_COLUMNS.get(table, ()))
+    columns = [c.name for c in model.__table__.columns]
+    after = None
+    while True:
+        q = select(model.__table__).where(column >= month, column < upper)
+        if after is not None:
+            q = q.where(tuple_(column, model.id) > after)
+        rows = [dict(r._mapping) for r in db.session.execute(q.order_by(column, model.id).limit(EXPORT_BATCH))]
+        if not rows:
+            break
+        writer.write([_encode({c: r[c] for c in columns}) for r in rows])
+        after = (rows[-1][column.name], rows[-1]["id"])
+    writer.close()
+    return writer
+
+
+def _remove_month(table, month):
+    model, column = TABLES[table]
+    upper = next_month(month)
+    if table == "transactions" and _postgres():
+        name = partition_name(month)
+        if db.session.execute(text("SELECT to_regclass(:n)"), {"n": name}).scalar() is not None:
+            db.session.execute(text("ALTER TABLE transactions DETACH PARTITION %s" % name))
+            if not current_app.config.get("ARCHIVE_KEEP_DETACHED"):
+                db.session.execute(text("DROP TABLE %s" % name))
+            return
+    while True:
+        ids = select(model.id).where(column >= month, column < upper).limit(EXPORT_BATCH).scalar_subquery()
+        if db.session.execute(delete(model).where(model.id.in_(ids))).rowcount == 0:
+            break
+
+
+def archive(before, directory=None, tables=tuple(TABLES)):
+    """
+    Export and remove every whole month before `before`, oldest first, one
+    commit per month. Returns [(table, "YYYY-MM", rows)].
+    """
+    directory = directory or current_app.config["ARCHIVE_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    cutoff = month_start(before)
+    manifest = load_manifest(directory)
+    done = []
+    for table in tables:
+        model, column = TABLES[table]
+        oldest = db.session.execute(select(db.func.min(column)).where(column < cutoff)).scalar()
+        month = month_start(oldest) if oldest is not None else cutoff
+        while month < cutoff:
+            writer = _export_month(table, month, directory)
+            if writer.rows:
+                entries = [e for e in manifest.setdefault(table, []) if e["month"] != month.strftime("%Y-%m")]
+                entry = {"month": month.strftime("%Y-%m"), "file": os.path.basename(writer.path), "rows": writer.rows}
+                if writer.index_path:
+                    entry["index"] = os.path.basename(writer.index_path)
+                entries.append(entry)
+                manifest[table] = sorted(entries, key=lambda e: e["month"])
+                _save_manifest(directory, manifest)  # the file is listed before its rows go
+            _remove_month(table, month)
+            db.session.commit()
+            if writer.rows:
+                done.append((table, month.strftime("%Y-%m"), writer.rows))
+            month = next_month(month)
+    return done
+
+
+def history(user_id, before=None, limit=50, directory=None):
+    """
+    Archived transactions of `user_id`, newest first, strictly older than the
+    (created_at, id) pair `before`. At most `limit` row dicts.
+    """
+    directory = directory or current_app.config["ARCHIVE_DIR"]
+    found = []
+    if limit <= 0:
+        return found
+    # months are disjoint and each yields newest first, so the first
+    # `limit` rows found are the page
+    for entry in reversed(load_manifest(directory).get("transactions", [])):
+        if before is not None and entry["month"] > before[0].strftime("%Y-%m"):
+            continue
+        for row in _user_rows(directory, entry, user_id):
+            if before is not None and (row["created_at"], row["id"]) >= before:
+                continue
+            found.append(row)
+            if len(found) >= limit:
+                return found
+    return found
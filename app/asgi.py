@@ -0,0 +1,112 @@
+"""
+ASGI serving mode for the authorization webhook.
+
+    uvicorn --factory app.asgi:create_asgi_app --workers 1
+
+Serves POST /api/webhook/webhook/authorize only. The flow is the same
+`process_authorization()` the Flask view uses (same prechecks, ledger calls
+and `build_response_template`), run inside `AsyncSession.run_sync()` on an
+async engine, so every database round trip awaits on the event loop instead
+of holding a worker thread.
+
+The async URL comes from ASYNC_DATABASE_URL, or is derived from DATABASE_URL
+(psycopg2 -> asyncpg, sqlite -> aiosqlite). ASYNC_POOL_SIZE and
+ASYNC_MAX_OVERFLOW size the connection pool.
+"""
+
+import os
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from . import create_app, sessions
+from .routes.webhook import process_authorization
+
+AUTHORIZE_PATH = "/api/webhook/webhook/authorize"
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def async_database_url(url):
+    scheme, sep, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+
+class AuthorizeApp:
+    def __init__(self, flask_app, database_url):
+        self.flask_app = flask_app
+        options = {}
+        if not database_url.startswith("sqlite"):
+            options = {
+                "pool_size": int(os.getenv("ASYNC_POOL_SIZE", 20)),
+                "max_overflow": int(os.getenv("ASYNC_MAX_OVERFLOW", 10)),
+                "pool_pre_ping": True,
+            }
+        self.engine = create_async_engine(database_url, **options)
+        self.sessionmaker = async_sessionmaker(self.engine)
+        provider = flask_app.json
+        self.dumps = getattr(provider, "dumps_bytes", None) or (lambda obj: provider.dumps(obj).encode())
+
+    def _run(self, session, req):
+        # runs in a greenlet; each DB call inside yields to the event loop
+        with self.flask_app.app_context(), sessions.using(session):
+            return process_authorization(req)
+
+    async def authorize(self, req):
+        async with self.sessionmaker() as session:
+            try:
+                return await session.run_sync(self._run, req)
+            except Exception:
+                await session.rollback()
+                raise
+
+    async def aclose(self):
+        await self.engine.dispose()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await self.aclose()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+
+        if scope["method"] == "POST" and scope["path"] == AUTHORIZE_PATH:
+            body = b""
+            more = True
+            while more:
+                message = await receive()
+                body += message.get("body", b"")
+                more = message.get("more_body", False)
+            try:
+                req = self.flask_app.json.loads(body or b"{}")
+            except ValueError:
+                req = None
+            if isinstance(req, dict):
+                payload, status = await self.authorize(req)
+            else:
+                payload, status = {"error": "invalid JSON body"}, 400
+        else:
+            payload, status = {"error": "not found"}, 404
+
+        data = self.dumps(payload)
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(data)).encode())],
+        })
+        await send({"type": "http.response.body", "body": data})
+
+
+def create_asgi_app(flask_app=None):
+    flask_app = flask_app or create_app(os.getenv("FLASK_ENV") or "production")
+    url = os.getenv("ASYNC_DATABASE_URL") or async_database_url(flask_app.config["SQLALCHEMY_DATABASE_URI"])
+    return AuthorizeApp(flask_app, url)
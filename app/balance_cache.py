@@ -0,0 +1,151 @@
+"""
+Cache of each user's wallet balances for GET /wallets and bulk lookups.
+
+Every worker keeps {user_id: {currency: amount}} in a TTLCache, tagged with
+the user's version stamp. The stamps live in a small file that all workers
+on the host map into memory (BALANCE_CACHE_SLOTS cells of 8 bytes, a user
+hashed to one cell); an entry is served only while its tag still matches
+the cell.
+
+Nothing writes values into the cache. Every path that moves money posts
+through `ledger.post()` / `post_many()`, which marks the users on the
+session, and ORM changes to CurrencyBalance rows are caught by mapper
+events. Once the transaction commits each marked user gets a new random
+stamp, so every worker's copy goes stale at once. A reader takes the stamp
+before it loads and only stores if it hasn't moved since, so a value read
+before a commit never replaces one read after it. Values read from the
+replica are never stored.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import db, sessions
+from .cache import TTLCache
+
+SLOTS = 1 << 16
+DIRTY = "balance_cache_dirty"
+_CELL = struct.Struct("<Q")
+
+
+def default_version_file(database_uri):
+    digest = hashlib.sha1(database_uri.encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"flaskwallet-balances-{digest}.ver")
+
+
+class VersionTable:
+    """
+    Version stamps shared by the processes mapping `path`. Stamps are random
+    rather than counters: two workers bumping the same cell at once can't
+    both land on a value a reader already holds.
+    """
+
+    def __init__(self, path, slots=SLOTS):
+        self.slots = slots
+        size = slots * _CELL.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def _offset(self, user_id):
+        return zlib.crc32(str(user_id).encode()) % self.slots * _CELL.size
+
+    def get(self, user_id):
+        return _CELL.unpack_from(self._map, self._offset(user_id))[0]
+
+    def bump(self, user_ids):
+        for user_id in user_ids:
+            offset = self._offset(user_id)
+            self._map[offset:offset + _CELL.size] = os.urandom(_CELL.size)
+
+
+class BalanceCache:
+    def __init__(self, maxsize, ttl, version_file, slots=SLOTS):
+        self._cache = TTLCache(maxsize, ttl)
+        self._versions = VersionTable(version_file, slots)
+        self.stale = 0
+
+    def get_many(self, user_ids, load_many):
+        """
+        {user_id: {currency: amount}} for every id in `user_ids`, calling
+        `load_many(ids)` (-> the same shape) once for the ones not cached.
+        The dicts are shared with the cache; don't modify them.
+        """
+        out, missing = {}, {}
+        for user_id in user_ids:
+            version = self._versions.get(user_id)
+            item = self._cache.get(user_id)
+            if item is not None and item[0] == version:
+                out[user_id] = item[1]
+                continue
+            if item is not None:
+                self.stale += 1
+            missing[user_id] = version
+        if missing:
+            loaded = load_many(list(missing))
+            # the replica may lag the stamps; only primary reads are kept
+            keep = sessions.current() is db.session
+            for user_id, version in missing.items():
+                balances = out[user_id] = loaded.get(user_id, {})
+                if keep and self._versions.get(user_id) == version:
+                    self._cache.set(user_id, (version, balances))
+        return out
+
+    def invalidate(self, user_ids):
+        self._versions.bump(user_ids)
+        for user_id in user_ids:
+            self._cache.invalidate(user_id)
+
+    def stats(self):
+        return dict(self._cache.stats(), stale=self.stale)
+
+
+def touch(session, user_ids):
+    """Invalidate `user_ids` once `session` commits."""
+    session.info.setdefault(DIRTY, set()).update(u for u in user_ids if u)
+
+
+def _mark_row(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        touch(session, (target.user_id,))
+
+
+def _after_commit(session):
+    dirty = session.info.pop(DIRTY, None)
+    if not dirty or not has_app_context():
+        return
+    cache = current_app.extensions.get("balance_cache")
+    if cache is not None:
+        cache.invalidate(dirty)
+
+
+def _after_rollback(session):
+    session.info.pop(DIRTY, None)
+
+
+_installed = False
+
+
+def install_listeners():
+    global _installed
+    if _installed:
+        return
+    from .models import CurrencyBalance
+    for name in ("after_insert", "after_update", "after_delete"):
+        event.listen(CurrencyBalance, name, _mark_row)
+    event.listen(Session, "after_commit", _after_commit)
+    event.listen(Session, "after_rollback", _after_rollback)
+    _installed = True
@@ -0,0 +1,300 @@
+"""
+Bulk import of users, their USD/LBP balances and optional cards from CSV or
+NDJSON (one JSON object per line). Columns / keys:
+
+    email (required), password | password_hash, first_name, last_name,
+    usd, lbp (opening balances, decimal strings),
+    pan_masked, card_type, card_status, expiry (a card, when pan_masked is set)
+
+The file is streamed and written in chunks, one transaction per chunk:
+users, balances and cards go in with COPY on Postgres (psycopg2) and one
+executemany per table elsewhere. Opening balances are booked as "topup"
+transactions through `ledger.post_many`, so the journal still sums to zero.
+After each commit the number of records consumed is saved to a state file;
+running again with the same state file resumes after the last committed
+chunk. Rejected records are appended to an NDJSON file with their record
+number and reason.
+"""
+
+import csv
+import io
+import json
+import os
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+
+from . import db, ledger, passwords
+from .money import InvalidAmount, to_minor
+from .models import Card, CurrencyBalance, User
+
+CURRENCIES = ("USD", "LBP")
+CARD_TYPES = ("physical", "virtual")
+CARD_STATUSES = ("active", "frozen", "canceled")
+UNUSABLE_PASSWORD = "!"  # imported without a password: cannot log in until reset
+MAX_MINOR = 2 ** 63 - 1  # BigInteger
+# optional text fields and their column lengths (None: no column to fit)
+TEXT_FIELDS = {
+    "first_name": 120, "last_name": 120, "password": None, "password_hash": 255,
+    "pan_masked": 32, "expiry": 6,
+}
+
+
+class Rejected(ValueError):
+    pass
+
+
+class ImportResult:
+    def __init__(self, resumed_from=0):
+        self.resumed_from = resumed_from
+        self.records = resumed_from
+        self.users = 0
+        self.cards = 0
+        self.chunks = 0
+        self.rejected = Counter()
+
+    def summary(self):
+        lines = [
+            f"records read: {self.records} (resumed after {self.resumed_from})",
+            f"imported: {self.users} users, {self.cards} cards in {self.chunks} chunk(s)",
+            f"rejected: {sum(self.rejected.values())}",
+        ]
+        lines += [f"  {n:>8}  {reason}" for reason, n in self.rejected.most_common()]
+        return "\n".join(lines)
+
+
+def read_records(path, fmt=None):
+    """Yield (record number, dict or Rejected) from a CSV or NDJSON file."""
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "ndjson")
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            for n, row in enumerate(csv.DictReader(f), 1):
+                yield n, {k: v for k, v in row.items() if k and v not in (None, "")}
+            return
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                yield n, Rejected("malformed JSON")
+                continue
+            yield n, obj if isinstance(obj, dict) else Rejected("not a JSON object")
+
+
+def parse_minor(value, currency):
+    try:
+        minor = to_minor(value, currency)
+    except InvalidAmount as e:
+        raise Rejected(str(e))
+    if minor < 0:
+        raise Rejected("negative amount")
+    if minor > MAX_MINOR:
+        raise Rejected("amount out of range")
+    return minor
+
+
+def _text(rec, key):
+    # NDJSON values can be any JSON type; only strings that fit go in
+    value = rec.get(key)
+    if value is None:
+        return None
+    limit = TEXT_FIELDS[key]
+    if not isinstance(value, str) or (limit is not None and len(value) > limit):
+        raise Rejected(f"invalid {key}")
+    return value
+
+
+def validate(rec):
+    """Normalised record, or raises Rejected."""
+    email = str(rec.get("email") or "").strip()
+    if not email:
+        raise Rejected("missing email")
+    if "@" not in email or len(email) > 255:
+        raise Rejected("invalid email")
+    out = {
+        "email": email,
+        "first_name": _text(rec, "first_name"),
+        "last_name": _text(rec, "last_name"),
+        "password": _text(rec, "password"),
+        "password_hash": _text(rec, "password_hash"),
+        "balances": {cur: parse_minor(rec[cur.lower()], cur) for cur in CURRENCIES if rec.get(cur.lower()) not in (None, "")},
+        "card": None,
+    }
+    if out["password_hash"] and not out["password_hash"].startswith(passwords.WERKZEUG_PREFIXES) \
+            and passwords.current().context.identify(out["password_hash"]) is None:
+        raise Rejected("unrecognised password_hash")
+    if rec.get("pan_masked"):
+        card = {
+            "pan_masked": _text(rec, "pan_masked"),
+            "card_type": rec.get("card_type", "virtual"),
+            "status": rec.get("card_status", "active"),
+            "expiry": _text(rec, "expiry"),
+        }
+        if card["card_type"] not in CARD_TYPES:
+            raise Rejected("invalid card_type")
+        if card["status"] not in CARD_STATUSES:
+            raise Rejected("invalid card_status")
+        out["card"] = card
+    return out
+
+
+def _copy(session, table, rows):
+    """COPY `rows` (dicts with the same keys) into `table` on the session's connection."""
+    columns = list(rows[0])
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow(["\\N" if row[c] is None else row[c] for c in columns])
+    buf.seek(0)
+    cursor = session.connection().connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(
+            "COPY %s (%s) FROM STDIN WITH (FORMAT csv, NULL '\\N')" % (table.name, ", ".join(columns)), buf
+        )
+    finally:
+        cursor.close()
+
+
+def _insert(session, table, rows, use_copy):
+    if not rows:
+        return
+    if use_copy:
+        _copy(session, table, rows)
+    else:
+        session.execute(table.insert(), rows)
+
+
+def write_chunk(session, chunk, use_copy):
+    """Insert one chunk of validated records; returns (users, cards)."""
+    now = datetime.now(timezone.utc)
+    plain = [r["password"] for r in chunk if not r["password_hash"] and r["password"]]
+    hashed = iter(passwords.current().hash_many(plain))
+
+    users, balances, cards, topups = [], [], [], []
+    for r in chunk:
+        user_id = str(uuid.uuid4())
+        if r["password_hash"]:
+            password_hash = r["password_hash"]
+        elif r["password"]:
+            password_hash = next(hashed)
+        else:
+            password_hash = UNUSABLE_PASSWORD
+        users.append({
+            "id": user_id, "email": r["email"], "password_hash": password_hash,
+            "first_name": r["first_name"], "last_name": r["last_name"], "created_at": now,
+        })
+        for cur in CURRENCIES:
+            amount = r["balances"].get(cur, 0)
+            balances.append({
+                "id": str(uuid.uuid4()), "user_id": user_id, "currency": cur,
+                "amount": amount, "slot": 0, "updated_at": now,
+            })
+            if amount:
+                topups.append({
+                    "to_user_id": user_id, "currency": cur, "amount": amount, "type": "topup",
+                    "details": {"source": "import"}, "created_at": now,
+                })
+        if r["card"]:
+            cards.append(dict(r["card"], id=str(uuid.uuid4()), user_id=user_id, created_at=now))
+
+    _insert(session, User.__table__, users, use_copy)
+    _insert(session, CurrencyBalance.__table__, balances, use_copy)
+    _insert(session, Card.__table__, cards, use_copy)
+    ledger.post_many(topups)
+    return len(users), len(cards)
+
+
+def _load_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"records": 0}
+
+
+def _save_state(path, result):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"records": result.records, "users": result.users, "cards": result.cards,
+                   "rejected": dict(result.rejected)}, f)
+    os.replace(tmp, path)
+
+
+def import_file(path, fmt=None, chunk_size=5000, state_path=None, rejects_path=None, restart=False, progress=None):
+    """
+    Import `path` chunk by chunk and return an ImportResult. Memory is bounded
+    by `chunk_size` records. `progress(result)` is called after each commit.
+    """
+    session = db.session
+    state_path = state_path or path + ".import-state.json"
+    rejects_path = rejects_path or path + ".rejects.ndjson"
+    if restart:
+        for p in (state_path, rejects_path):
+            if os.path.exists(p):
+                os.unlink(p)
+    state = _load_state(state_path)
+    result = ImportResult(state["records"])
+    result.users = state.get("users", 0)
+    result.cards = state.get("cards", 0)
+    result.rejected.update(state.get("rejected", {}))
+
+    bind = session.get_bind()
+    use_copy = bind.dialect.name == "postgresql" and bind.dialect.driver == "psycopg2"
+
+    with open(rejects_path, "a", encoding="utf-8") as rejects:
+        pending = []  # rejects of the open chunk, written once it commits
+
+        def reject(n, reason, rec):
+            pending.append((reason, json.dumps({"record": n, "reason": reason, "row": rec}, default=str)))
+
+        def flush(chunk, last):
+            if chunk:
+                emails = [r["email"] for _, r, _ in chunk]
+                existing = set(session.execute(select(User.email).where(User.email.in_(emails))).scalars())
+                fresh = []
+                for n, r, raw in chunk:
+                    if r["email"] in existing:
+                        reject(n, "email exists", raw)
+                    else:
+                        fresh.append(r)
+                if fresh:
+                    users, cards = write_chunk(session, fresh, use_copy)
+                    result.users += users
+                    result.cards += cards
+            session.commit()
+            for reason, line in pending:
+                result.rejected[reason] += 1
+                rejects.write(line + "\n")
+            rejects.flush()
+            pending.clear()
+            result.records = last
+            result.chunks += 1
+            _save_state(state_path, result)
+            if progress:
+                progress(result)
+
+        chunk, seen, last = [], set(), result.records
+        for n, rec in read_records(path, fmt):
+            if n <= result.records:
+                continue  # committed by an earlier run
+            last = n
+            try:
+                if isinstance(rec, Rejected):
+                    raise rec
+                r = validate(rec)
+                if r["email"] in seen:
+                    raise Rejected("duplicate email in file")
+            except Rejected as e:
+                reject(n, str(e), rec if isinstance(rec, dict) else None)
+            else:
+                seen.add(r["email"])
+                chunk.append((n, r, rec))
+            if len(chunk) >= chunk_size:
+                flush(chunk, last)
+                chunk, seen = [], set()
+        if chunk or last > result.records:
+            flush(chunk, last)
+    return result
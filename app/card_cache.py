@@ -0,0 +1,145 @@
+"""
+Read-through cache of cards by masked PAN for the authorization hot path.
+
+Entries are dropped as soon as a card is inserted, updated or deleted
+through the ORM and the transaction commits. Other worker processes on the
+same host learn about it through a shared generation file: every
+invalidation replaces the file, and a worker that sees a new file clears
+its local cache before the next lookup.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from .cache import TTLCache
+
+
+class CardInfo:
+    __slots__ = ("id", "user_id", "status", "expiry")
+
+    def __init__(self, id, user_id, status, expiry):
+        self.id = id
+        self.user_id = user_id
+        self.status = status
+        self.expiry = expiry
+
+
+def default_generation_file(database_uri):
+    digest = hashlib.sha1(database_uri.encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"flaskwallet-cards-{digest}.gen")
+
+
+class CardCache:
+    def __init__(self, maxsize, ttl, generation_file):
+        self._cache = TTLCache(maxsize, ttl)
+        self._path = generation_file
+        self._lock = threading.RLock()
+        self._local_gen = 0
+        self._file_gen = self._stat()
+
+    def _stat(self):
+        try:
+            st = os.stat(self._path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _sync(self):
+        # one stat() per lookup is far cheaper than the database round trip
+        gen = self._stat()
+        if gen != self._file_gen:
+            with self._lock:
+                self._file_gen = gen
+                self._local_gen += 1
+                self._cache.clear()
+        return self._local_gen
+
+    def lookup(self, pan, load):
+        """Return CardInfo for `pan`, calling `load(pan)` (-> Card or None) on a miss."""
+        info, gen = self.peek(pan)
+        if info is not None:
+            return info
+        return self.store(pan, load(pan), gen)
+
+    def peek(self, pan):
+        """(CardInfo or None, generation); pass the generation to store() after loading."""
+        gen = self._sync()
+        return self._cache.get(pan), gen
+
+    def store(self, pan, card, gen):
+        if card is None:
+            return None
+        info = CardInfo(card.id, card.user_id, card.status, card.expiry)
+        # don't publish what we read if a card changed while we were reading
+        with self._lock:
+            if self._sync() == gen:
+                self._cache.set(pan, info)
+        return info
+
+    def invalidate(self, pans):
+        with self._lock:
+            self._local_gen += 1
+            for pan in pans:
+                self._cache.invalidate(pan)
+        self._bump_file()
+
+    def _bump_file(self):
+        # write-then-rename gives every bump a new inode, so readers can't miss it
+        directory = os.path.dirname(self._path) or "."
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".cards-")
+        with os.fdopen(fd, "w") as f:
+            f.write(str(os.getpid()))
+            f.flush()
+            st = os.fstat(fd)
+        os.replace(tmp, self._path)
+        # remember the file this worker wrote, not whatever is there by now:
+        # a bump by another worker right after the rename must still evict
+        with self._lock:
+            self._file_gen = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+def _mark_dirty(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is None:
+        return
+    dirty = session.info.setdefault("card_cache_dirty", set())
+    dirty.add(target.pan_masked)
+    # a changed PAN must also evict the old one
+    dirty.update(inspect(target).attrs.pan_masked.history.deleted)
+
+
+def _after_commit(session):
+    dirty = session.info.pop("card_cache_dirty", None)
+    if not dirty or not has_app_context():
+        return
+    cache = current_app.extensions.get("card_cache")
+    if cache is not None:
+        cache.invalidate(dirty)
+
+
+def _after_rollback(session):
+    session.info.pop("card_cache_dirty", None)
+
+
+_installed = False
+
+
+def install_listeners():
+    global _installed
+    if _installed:
+        return
+    from .models import Card
+    for name in ("after_insert", "after_update", "after_delete"):
+        event.listen(Card, name, _mark_dirty)
+    event.listen(Session, "after_commit", _after_commit)
+    event.listen(Session, "after_rollback", _after_rollback)
+    _installed = True
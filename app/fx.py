@@ -0,0 +1,188 @@
+"""
+USD/LBP exchange.
+
+Rates live in `exchange_rates`; each process serves them from an immutable
+`RateSnapshot` held by a `RateBook`. A background thread reloads the
+snapshot every EXCHANGE_RATE_REFRESH seconds (one `max(id)` query when
+nothing changed), so requests never read rates from the database. A
+snapshot older than EXCHANGE_RATE_MAX_AGE (the refresher keeps failing) is
+refused rather than used.
+
+Rates are exact fractions parsed from decimal strings, and conversion works
+on integer minor units: the customer receives the floor of a conversion and
+pays the ceiling of one, so rounding never creates money.
+"""
+
+import logging
+import os
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+from fractions import Fraction
+
+from sqlalchemy import func, select
+
+from . import db, ledger, sessions
+from .models import ExchangeRate
+
+log = logging.getLogger(__name__)
+
+
+class RatesUnavailable(Exception):
+    pass
+
+
+def parse_rate(value):
+    try:
+        rate = Fraction(Decimal(str(value)))
+    except (InvalidOperation, ValueError):
+        raise ValueError("invalid rate")
+    if rate <= 0:
+        raise ValueError("rate must be > 0")
+    return rate
+
+
+def format_rate(rate, places=12):
+    """A rate as a decimal string; inverse rates are cut to `places` decimals."""
+    value = Decimal(rate.numerator) / Decimal(rate.denominator)
+    if rate.denominator % 10 ** places:
+        value = round(value, places)
+    return format(value.normalize(), "f")
+
+
+def convert(minor, rate, src_exponent, dst_exponent, round_up=False):
+    """`minor` units of the source currency in destination minor units, exactly."""
+    value = Fraction(minor) * rate * Fraction(10) ** (dst_exponent - src_exponent)
+    if round_up:
+        return -(-value.numerator // value.denominator)
+    return value.numerator // value.denominator
+
+
+class RateSnapshot:
+    __slots__ = ("version", "rates", "loaded_at")
+
+    def __init__(self, version, rates, loaded_at):
+        self.version = version
+        self.rates = rates  # {(base, quote): Fraction}
+        self.loaded_at = loaded_at
+
+    def rate(self, src, dst):
+        """Units of `dst` per unit of `src`, or None."""
+        if src == dst:
+            return Fraction(1)
+        if (src, dst) in self.rates:
+            return self.rates[(src, dst)]
+        if (dst, src) in self.rates:
+            return 1 / self.rates[(dst, src)]
+        return None
+
+    def refreshed(self, loaded_at):
+        return RateSnapshot(self.version, self.rates, loaded_at)
+
+    def as_dict(self):
+        return {
+            "version": self.version,
+            "rates": {f"{b}/{q}": format_rate(r) for (b, q), r in sorted(self.rates.items())},
+        }
+
+
+def load_snapshot(session=None):
+    session = session or sessions.current()
+    latest = select(func.max(ExchangeRate.id)).group_by(ExchangeRate.base, ExchangeRate.quote)
+    rows = session.execute(
+        select(ExchangeRate.id, ExchangeRate.base, ExchangeRate.quote, ExchangeRate.rate)
+        .where(ExchangeRate.id.in_(latest))
+    ).all()
+    version = max((r.id for r in rows), default=0)
+    return RateSnapshot(version, {(r.base, r.quote): parse_rate(r.rate) for r in rows}, time.monotonic())
+
+
+class RateBook:
+    def __init__(self, app, refresh_interval=5.0, max_age=60.0):
+        self.app = app
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def current(self):
+        """The snapshot; the first call in a process loads it and starts the refresher."""
+        snap = self._snapshot
+        if snap is None or self._pid != os.getpid():
+            with self._lock:
+                if self._snapshot is None or self._pid != os.getpid():
+                    self._snapshot = load_snapshot()
+                    self._start()
+                snap = self._snapshot
+        if self.max_age and time.monotonic() - snap.loaded_at > self.max_age:
+            raise RatesUnavailable("exchange rates are stale")
+        return snap
+
+    def reload(self):
+        """Swap in a fresh snapshot; only re-reads the rows when the version moved."""
+        version = sessions.current().execute(select(func.max(ExchangeRate.id))).scalar() or 0
+        snap = self._snapshot
+        if snap is not None and snap.version == version:
+            self._snapshot = snap.refreshed(time.monotonic())
+        else:
+            self._snapshot = load_snapshot()
+        return self._snapshot
+
+    def _start(self):
+        # threads don't survive fork, so every worker process starts its own
+        self._pid = os.getpid()
+        if self.refresh_interval:
+            threading.Thread(target=self._run, name="fx-refresh", daemon=True).start()
+
+    def _run(self):
+        pid = self._pid
+        while self._pid == pid:
+            time.sleep(self.refresh_interval)
+            with self.app.app_context():
+                try:
+                    self.reload()
+                except Exception:
+                    log.exception("exchange rate refresh failed")
+                finally:
+                    db.session.remove()
+
+
+def set_rate(base, quote, rate):
+    """Append a new rate row (a new snapshot version) and return it."""
+    row = ExchangeRate(base=base, quote=quote, rate=str(Decimal(str(rate))))
+    parse_rate(row.rate)
+    db.session.add(row)
+    db.session.commit()
+    return row
+
+
+def debit_with_fallback(user_id, currency, minor, snapshot, exponents):
+    """
+    Debit `minor` of `currency`, or its converted equivalent from another
+    currency the user holds when that one is missing or short. Both balances
+    are locked with one ordered `lock_many`.
+    Returns (debited currency, debited minor, new balance, rate or None);
+    raises ledger.BalanceNotFound / ledger.InsufficientFunds like debit().
+    """
+    balance = ledger.try_debit(user_id, currency, minor)
+    if balance is not None:
+        return currency, minor, balance, None
+
+    others = [c for c in exponents if c != currency and snapshot.rate(currency, c) is not None]
+    locked = ledger.lock_many([(user_id, currency)] + [(user_id, c) for c in others], missing_ok=True)
+    key = (user_id, currency)
+    if key in locked and locked.total(key) >= minor:
+        locked.debit(key, minor)
+        return currency, minor, locked.total(key), None
+    for other in others:
+        if (user_id, other) not in locked:
+            continue
+        rate = snapshot.rate(currency, other)
+        need = convert(minor, rate, exponents[currency], exponents[other], round_up=True)
+        if locked.total((user_id, other)) >= need:
+            locked.debit((user_id, other), need)
+            return other, need, locked.total((user_id, other)), rate
+    if key not in locked:
+        raise ledger.BalanceNotFound(f"balance not found for user {user_id} currency {currency}")
+    raise ledger.InsufficientFunds(locked.total(key))
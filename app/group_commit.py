@@ -0,0 +1,212 @@
+"""
+Group commit for the authorization webhook (AUTH_GROUP_COMMIT=1).
+
+Concurrent authorizations in one worker are gathered for up to
+AUTH_BATCH_WINDOW_MS (or until AUTH_BATCH_MAX arrive) and run in a single
+database transaction: the idempotency keys are claimed first, as the
+single-request path claims before it debits, then the balances the batch
+will debit are locked once, in key order (as transfers lock), the requests
+are applied in arrival order with the usual prechecks, debits and postings,
+and one commit covers all of them. Each caller still gets its own 2110
+response.
+
+There is no extra thread. The first request to arrive leads: it waits out
+the window, takes the batch and runs it, while the next arrival already
+leads the following batch. Anything unusual (a duplicate key claimed by
+another worker, any error) rolls the batch back and the leader runs its
+requests one by one through `process_authorization`, so a batch never
+answers differently from the unbatched path. Keys that were committed
+earlier replay their stored response inside the batch. A request the
+leader never answers (it died mid-batch, or is still running after
+AUTH_BATCH_TIMEOUT_MS) is run on its own by its caller; the key claim keeps
+that idempotent whichever side gets there first.
+
+The window adds up to AUTH_BATCH_WINDOW_MS to every authorization; it pays
+off when many requests queue on the same balance rows.
+"""
+
+import os
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import select
+
+from . import ledger, metrics, sessions
+from .models import CardAuthRequest
+from .routes.webhook import (
+    CURRENCY_MAP, decide, expand_response, lookup_card, process_authorization, publish_response, store_response,
+)
+
+
+class _Pending:
+    __slots__ = ("req", "event", "lead", "result", "error")
+
+    def __init__(self, req):
+        self.req = req
+        self.event = threading.Event()
+        self.lead = False
+        self.result = None
+        self.error = None
+
+    def resolve(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.event.set()
+
+
+class GroupCommitter:
+    def __init__(self, window, max_batch, timeout=5.0):
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._queue = []
+        self._leader = None
+
+    def submit(self, req):
+        """(body, status) for one authorization, run as part of a batch."""
+        idem = req.get("idempotency_key")
+        if not idem or current_app.extensions["idempotency_cache"].get(idem) is not None:
+            return process_authorization(req)
+
+        item = _Pending(req)
+        with self._cond:
+            self._queue.append(item)
+            if self._leader is None:
+                self._leader = item
+                item.lead = True
+            elif len(self._queue) >= self.max_batch:
+                self._cond.notify_all()
+        if not item.lead and not item.event.wait(self.timeout):
+            with self._cond:
+                # still queued: leave, so no later leader takes it
+                if not item.lead and item in self._queue:
+                    self._queue.remove(item)
+        if item.lead:
+            self._lead()
+        if item.error is not None:
+            raise item.error
+        if item.result is None:
+            # the leader gave up on it or never answered
+            metrics.inc("auth_batch_fallbacks_total", ())
+            return process_authorization(req)
+        return item.result
+
+    def _lead(self):
+        deadline = time.monotonic() + self.window
+        with self._cond:
+            while len(self._queue) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._queue[:self.max_batch]
+            del self._queue[:self.max_batch]
+            # the next arrival gathers the following batch while this one runs
+            if self._queue:
+                self._leader = self._queue[0]
+                self._leader.lead = True
+                self._leader.event.set()
+            else:
+                self._leader = None
+        metrics.observe("auth_batch_size", (), len(batch))
+        try:
+            try:
+                results = run_batch([item.req for item in batch])
+            except Exception:
+                sessions.current().rollback()
+                metrics.inc("auth_batch_fallbacks_total", ())
+                for item in batch:
+                    try:
+                        item.resolve(process_authorization(item.req))
+                    except Exception as e:
+                        sessions.current().rollback()
+                        item.resolve(error=e)
+                return
+            for item, result in zip(batch, results):
+                item.resolve(result)
+        finally:
+            # whatever stopped this thread, nobody waits on it forever:
+            # an unanswered request runs on its own in its caller
+            for item in batch:
+                if not item.event.is_set():
+                    item.resolve()
+
+
+def run_batch(reqs):
+    """
+    Authorize `reqs` (all carrying an idempotency_key) in arrival order in one
+    transaction. Returns [(body, status)]; raises, with nothing committed, on
+    anything the per-request path should handle instead.
+    """
+    session = sessions.current()
+    keys = [req["idempotency_key"] for req in reqs]
+    claimed = {
+        row.idempotency_key: row
+        for row in session.execute(
+            select(CardAuthRequest.idempotency_key, CardAuthRequest.request_payload, CardAuthRequest.response_payload)
+            .where(CardAuthRequest.idempotency_key.in_(set(keys)))
+        )
+    }
+    if any(not row.response_payload for row in claimed.values()):
+        raise LookupError("authorization in progress")
+
+    # claim before locking any balance, like process_authorization(), and in
+    # key order, so batches and single requests can't wait on each other in
+    # a cycle; a key claimed meanwhile elsewhere fails the flush
+    records = {}
+    for key in sorted(set(keys) - set(claimed)):
+        req = reqs[keys.index(key)]
+        records[key] = CardAuthRequest(idempotency_key=key, request_payload=req, response_payload={})
+        session.add(records[key])
+    session.flush()
+
+    cards = [lookup_card(req.get("primaryAccountNumber")) for req in reqs]
+    balances = {
+        (card.user_id, CURRENCY_MAP.get(req.get("currencyCode", "840"), "USD"))
+        for req, card, key in zip(reqs, cards, keys)
+        if card is not None and card.status == "active" and key not in claimed
+    }
+    if balances:
+        ledger.lock_many(balances, missing_ok=True)
+
+    results = []
+    published = []
+    replayed = []
+    first = {}
+    for req, card, key in zip(reqs, cards, keys):
+        if key in first:
+            # the same key twice in one batch: the second replays the first
+            results.append(results[first[key]])
+            continue
+        first[key] = len(results)
+        if key in claimed:
+            resp = expand_response(claimed[key].response_payload, claimed[key].request_payload)
+            results.append((resp, 200))
+            replayed.append((key, resp))
+            continue
+        record = records[key]
+        resp = decide(req, card)
+        store_response(record, resp)
+        results.append((resp, 200))
+        published.append((key, resp))
+    session.commit()
+    for key, resp in published:
+        publish_response(key, resp)
+    cache = current_app.extensions["idempotency_cache"]
+    for key, resp in replayed:
+        cache.set(key, resp)
+    return results
+
+
+def init_app(app):
+    app.config.setdefault("AUTH_GROUP_COMMIT", os.getenv("AUTH_GROUP_COMMIT", "0") == "1")
+    app.config.setdefault("AUTH_BATCH_WINDOW_MS", float(os.getenv("AUTH_BATCH_WINDOW_MS", 2)))
+    app.config.setdefault("AUTH_BATCH_MAX", int(os.getenv("AUTH_BATCH_MAX", 32)))
+    app.config.setdefault("AUTH_BATCH_TIMEOUT_MS", float(os.getenv("AUTH_BATCH_TIMEOUT_MS", 5000)))
+    if app.config["AUTH_GROUP_COMMIT"]:
+        app.extensions["auth_group_commit"] = GroupCommitter(
+            app.config["AUTH_BATCH_WINDOW_MS"] / 1000.0, app.config["AUTH_BATCH_MAX"],
+            app.config["AUTH_BATCH_TIMEOUT_MS"] / 1000.0,
+        )
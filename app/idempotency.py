@@ -0,0 +1,121 @@
+"""
+Retention for card_auth_requests, the idempotency claims of the webhook.
+
+A key only has to outlive the partner's retry window, so rows processed more
+than IDEMPOTENCY_RETENTION_HOURS ago (default 720, 0 keeps everything) are
+deleted by `purge()`: small batches picked through the processed_at index,
+one short transaction each, with IDEMPOTENCY_PURGE_PAUSE seconds between
+them. On Postgres a batch skips rows another purger holds locked, so every
+worker can run one. Each process purges from a daemon thread every
+IDEMPOTENCY_PURGE_INTERVAL seconds (0 disables it; `flask purge-idempotency`
+does the same by hand).
+
+A replay of a purged key is processed again, so the retention has to stay
+well above how long a partner keeps retrying.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, select
+
+from . import db
+from .models import CardAuthRequest
+
+log = logging.getLogger(__name__)
+
+PURGE_BATCH = 1000
+
+
+def cutoff(retention_hours, now=None):
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    return now - timedelta(hours=retention_hours)
+
+
+def purge(before, batch_size=PURGE_BATCH, pause=0.0, max_batches=None):
+    """Delete claims processed before `before`, a batch per commit. Returns the count."""
+    postgres = db.session.get_bind().dialect.name == "postgresql"
+    deleted = batches = 0
+    while max_batches is None or batches < max_batches:
+        q = (
+            select(CardAuthRequest.id)
+            .where(CardAuthRequest.processed_at < before)
+            .order_by(CardAuthRequest.processed_at)
+            .limit(batch_size)
+        )
+        if postgres:
+            q = q.with_for_update(skip_locked=True)
+        ids = db.session.execute(q).scalars().all()
+        if not ids:
+            db.session.commit()
+            break
+        db.session.execute(delete(CardAuthRequest).where(CardAuthRequest.id.in_(ids)))
+        db.session.commit()
+        deleted += len(ids)
+        batches += 1
+        if len(ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+
+class Purger:
+    def __init__(self, app, interval, retention_hours, batch_size=PURGE_BATCH, pause=0.0):
+        self.app = app
+        self.interval = interval
+        self.retention_hours = retention_hours
+        self.batch_size = batch_size
+        self.pause = pause
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        # threads don't survive fork, so every worker process starts its own
+        if self._pid == os.getpid() or not self.interval or not self.retention_hours:
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name="idempotency-purge", daemon=True).start()
+
+    def run_once(self):
+        return purge(cutoff(self.retention_hours), self.batch_size, self.pause)
+
+    def _run(self):
+        pid = self._pid
+        while self._pid == pid:
+            # jittered, so the workers of one deployment don't purge in step
+            time.sleep(self.interval * random.uniform(0.5, 1.5))
+            with self.app.app_context():
+                try:
+                    n = self.run_once()
+                    if n:
+                        log.info("purged %d idempotency claim(s)", n)
+                except Exception:
+                    log.exception("idempotency purge failed")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+
+def init_app(app):
+    app.config.setdefault("IDEMPOTENCY_RETENTION_HOURS", float(os.getenv("IDEMPOTENCY_RETENTION_HOURS", 720)))
+    app.config.setdefault("IDEMPOTENCY_PURGE_INTERVAL", float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", 300)))
+    app.config.setdefault("IDEMPOTENCY_PURGE_BATCH", int(os.getenv("IDEMPOTENCY_PURGE_BATCH", PURGE_BATCH)))
+    app.config.setdefault("IDEMPOTENCY_PURGE_PAUSE", float(os.getenv("IDEMPOTENCY_PURGE_PAUSE", 0.05)))
+    # store 2110 responses as the fields that differ from the request
+    app.config.setdefault("IDEMPOTENCY_COMPACT_RESPONSES", os.getenv("IDEMPOTENCY_COMPACT_RESPONSES", "0") == "1")
+
+    purger = app.extensions["idempotency_purger"] = Purger(
+        app,
+        app.config["IDEMPOTENCY_PURGE_INTERVAL"],
+        app.config["IDEMPOTENCY_RETENTION_HOURS"],
+        app.config["IDEMPOTENCY_PURGE_BATCH"],
+        app.config["IDEMPOTENCY_PURGE_PAUSE"],
+    )
+    app.before_request(purger.ensure_started)
@@ -0,0 +1,127 @@
+"""
+Append-only double-entry journal.
+
+Every transaction appends two `JournalEntry` rows: a negative entry on the
+account the money leaves and a positive one on the account it reaches.
+Money entering or leaving the wallet goes through "external:*" accounts,
+so the whole journal always sums to zero.
+
+A balance is its `BalanceSnapshot` plus every entry after the snapshot's
+`last_entry_id`. `compact()` periodically folds the tail into the snapshot
+so reads stay short.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, tuple_, union_all
+
+from . import db, sessions
+from .models import BalanceSnapshot, JournalEntry
+
+# counterparty account for money entering or leaving the wallet, by transaction type
+EXTERNAL_ACCOUNTS = {
+    "topup": "external:topup",
+    "payment": "external:merchant",
+    "card_payment": "external:card_network",
+    "exchange_out": "external:fx",
+    "exchange_in": "external:fx",
+}
+
+# entries younger than this may still belong to open transactions, whose
+# lower ids can commit after higher ones; compaction never passes them
+COMPACTION_LAG = timedelta(seconds=60)
+
+
+def entries_for(tx_id, currency, amount, from_account, to_account, created_at=None):
+    now = created_at or datetime.now(timezone.utc)
+    return [
+        {"transaction_id": tx_id, "account": from_account, "currency": currency, "amount": -amount, "created_at": now},
+        {"transaction_id": tx_id, "account": to_account, "currency": currency, "amount": amount, "created_at": now},
+    ]
+
+
+def append(entries):
+    """Insert journal entry dicts with one executemany."""
+    if entries:
+        sessions.current().execute(db.insert(JournalEntry), entries)
+
+
+def _derived(snap_filter, entry_filter):
+    # snapshot + tail in a single statement, so a concurrent compaction can't
+    # make us count a range twice or not at all
+    s = BalanceSnapshot.__table__
+    e = JournalEntry.__table__
+    snaps = db.select(s.c.account, s.c.currency, s.c.amount).where(snap_filter(s))
+    tail = (
+        db.select(e.c.account, e.c.currency, e.c.amount)
+        .select_from(e.outerjoin(s, (s.c.account == e.c.account) & (s.c.currency == e.c.currency)))
+        .where(entry_filter(e), e.c.id > func.coalesce(s.c.last_entry_id, 0))
+    )
+    u = union_all(snaps, tail).subquery()
+    rows = sessions.current().execute(
+        db.select(u.c.account, u.c.currency, func.sum(u.c.amount)).group_by(u.c.account, u.c.currency)
+    ).all()
+    return {(account, currency): int(amount) for account, currency, amount in rows}
+
+
+def balances_for(keys):
+    """{(account, currency): balance} for the given keys; missing keys have no history."""
+    keys = list(keys)
+    if not keys:
+        return {}
+    return _derived(
+        lambda s: tuple_(s.c.account, s.c.currency).in_(keys),
+        lambda e: tuple_(e.c.account, e.c.currency).in_(keys),
+    )
+
+
+def balance(account, currency):
+    return balances_for([(account, currency)]).get((account, currency), 0)
+
+
+def account_balances(account):
+    """{currency: balance} for every currency the account has history in."""
+    derived = _derived(lambda s: s.c.account == account, lambda e: e.c.account == account)
+    return {currency: amount for (_, currency), amount in derived.items()}
+
+
+def compact(lag=COMPACTION_LAG, batch_size=1000):
+    """
+    Advance snapshots to the newest entry older than `lag`. Only snapshots
+    and entries are read; nothing the request path writes is locked.
+    Returns (accounts advanced, entry id the snapshots now cover).
+    """
+    e = JournalEntry.__table__
+    s = BalanceSnapshot.__table__
+    horizon = datetime.now(timezone.utc) - lag
+    cutoff = sessions.current().execute(db.select(func.max(e.c.id)).where(e.c.created_at < horizon)).scalar()
+    if cutoff is None:
+        return 0, 0
+
+    sums = sessions.current().execute(
+        db.select(e.c.account, e.c.currency, func.sum(e.c.amount))
+        .select_from(e.outerjoin(s, (s.c.account == e.c.account) & (s.c.currency == e.c.currency)))
+        .where(e.c.id <= cutoff, e.c.id > func.coalesce(s.c.last_entry_id, 0))
+        .group_by(e.c.account, e.c.currency)
+    ).all()
+
+    now = datetime.now(timezone.utc)
+    advanced = 0
+    for start in range(0, len(sums), batch_size):
+        for account, currency, delta in sums[start:start + batch_size]:
+            snap = sessions.current().get(BalanceSnapshot, (account, currency))
+            if snap is None:
+                snap = BalanceSnapshot(account=account, currency=currency, amount=0)
+                sessions.current().add(snap)
+            snap.amount = (snap.amount or 0) + int(delta)
+            snap.last_entry_id = cutoff
+            snap.taken_at = now
+            advanced += 1
+        sessions.current().commit()
+
+    # accounts with no new entries still move forward, keeping tails short
+    sessions.current().execute(
+        db.update(s).where(s.c.last_entry_id < cutoff).values(last_entry_id=cutoff, taken_at=now)
+    )
+    sessions.current().commit()
+    return advanced, cutoff
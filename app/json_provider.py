@@ -0,0 +1,60 @@
+"""
+JSON encoding for responses and request bodies.
+
+`FastJSONProvider` is Flask's DefaultJSONProvider with orjson doing the
+encoding and decoding when it is installed, and the stdlib otherwise. It
+keeps Flask's output rules (sorted keys, HTTP dates for datetimes, Decimal
+as string, indented when debugging), so switching it on or off only changes
+speed and that non-ASCII text is sent as UTF-8 rather than \\u escapes.
+Values orjson cannot encode (integers past 64 bits) fall back to the stdlib.
+
+JSON_PROVIDER=stdlib keeps Flask's provider.
+"""
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib provider is used instead
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    def _options(self, indent=False):
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps_bytes(self, obj, indent=False):
+        """`obj` as UTF-8 encoded JSON."""
+        if orjson is not None:
+            try:
+                return orjson.dumps(obj, default=self.default, option=self._options(indent))
+            except TypeError:
+                pass
+        return super().dumps(obj, **({"indent": 2} if indent else {"separators": (",", ":")})).encode()
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        return self._app.response_class(self.dumps_bytes(obj, indent) + b"\n", mimetype=self.mimetype)
+
+
+def init_app(app, name="fast"):
+    if name == "fast":
+        app.json = FastJSONProvider(app)
+    elif name != "stdlib":
+        raise ValueError("JSON_PROVIDER must be 'fast' or 'stdlib'")
@@ -0,0 +1,383 @@
+"""
+Balance mutations shared by the money-moving endpoints.
+
+A balance is one or more `CurrencyBalance` rows ("slots") for the same
+(user_id, currency). Normal accounts have only slot 0. Hot accounts
+(merchants, the topup float) get extra slots so concurrent credits can
+each lock a different row instead of queueing on one.
+
+`debit()` and `credit()` are single conditional statements:
+
+    UPDATE currency_balances SET amount = amount - :x
+    WHERE user_id = :u AND currency = :c AND slot = 0 AND amount >= :x
+    RETURNING amount, <sum of the other slots>
+
+so the row lock is held for one statement and the funds check lives in the
+WHERE clause. SQLite's RETURNING can't carry the correlated sum, so there
+the UPDATE is followed by a SELECT; SQLite already holds the database write
+lock from the UPDATE, which makes the pair atomic.
+
+Only a debit that slot 0 can't cover falls back to locking every slot
+(`lock_for_debit`) and draining them in order.
+
+Every transaction is also posted to the double-entry journal (`post()`),
+which is also where the wallet balance cache learns which users to
+invalidate once the transaction commits.
+With LEDGER_MODE=journal the journal becomes the source of truth: credits
+only append, debits lock slot 0 of the balance as a per-account mutex
+without updating it, and balances are read as snapshot + journal tail.
+"""
+
+import uuid
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import func, tuple_, update
+
+from . import balance_cache, db, journal, sessions, statements
+from .money import InvalidAmount
+from .models import CurrencyBalance, Transaction
+
+_cb = CurrencyBalance.__table__
+_other = _cb.alias("other_slot")
+
+# the rest of the balance, next to the row a statement touches
+_OTHER_SLOTS = (
+    db.select(func.coalesce(func.sum(_other.c.amount), 0))
+    .where(_other.c.user_id == _cb.c.user_id, _other.c.currency == _cb.c.currency, _other.c.id != _cb.c.id)
+    .scalar_subquery()
+)
+
+
+class BalanceNotFound(LookupError):
+    pass
+
+
+class InsufficientFunds(Exception):
+    def __init__(self, balance):
+        super().__init__("insufficient_funds")
+        self.balance = balance
+
+
+def _positive(minor):
+    # `amount >= :x` is no funds check at all for x <= 0, and a negative
+    # credit is a debit without one
+    if minor <= 0:
+        raise InvalidAmount("amount must be > 0")
+
+
+def _apply(stmt, where):
+    """Run a conditional UPDATE; return the balance total after it, or None if no row matched."""
+    bind = sessions.current().get_bind()
+    if bind.dialect.name != "sqlite" and bind.dialect.update_returning:
+        row = sessions.current().execute(
+            stmt.returning(_cb.c.amount, _OTHER_SLOTS), execution_options={"synchronize_session": False}
+        ).first()
+    else:
+        result = sessions.current().execute(stmt, execution_options={"synchronize_session": False})
+        if result.rowcount == 0:
+            return None
+        row = sessions.current().execute(db.select(_cb.c.amount, _OTHER_SLOTS).where(*where)).first()
+    if row is None:
+        return None
+    return int(row[0]) + int(row[1])
+
+
+def journal_mode():
+    return current_app.config.get("LEDGER_MODE") == "journal"
+
+
+def _exists(user_id, currency):
+    return sessions.current().execute(
+        db.select(_cb.c.id).where(_cb.c.user_id == user_id, _cb.c.currency == currency).limit(1)
+    ).first() is not None
+
+
+def debit(user_id, currency, minor):
+    """
+    Take `minor` from a balance and return the new total.
+    Raises BalanceNotFound, InsufficientFunds (with the current total) or
+    InvalidAmount for a non-positive `minor`.
+    """
+    _positive(minor)
+    if journal_mode():
+        # debits still serialize per account, but nothing shared is updated
+        mutex = sessions.current().execute(
+            db.select(_cb.c.id).where(_cb.c.user_id == user_id, _cb.c.currency == currency, _cb.c.slot == 0)
+            .with_for_update()
+        ).first()
+        if mutex is None:
+            raise BalanceNotFound(f"balance not found for user {user_id} currency {currency}")
+        balance = journal.balance(user_id, currency)
+        if balance < minor:
+            raise InsufficientFunds(balance)
+        return balance - minor
+
+    total = try_debit(user_id, currency, minor)
+    if total is not None:
+        return total
+
+    # slot 0 alone can't cover it: missing, short, or a hot account whose
+    # funds sit in other slots
+    rows = lock_for_debit(user_id, currency)
+    if not rows:
+        raise BalanceNotFound(f"balance not found for user {user_id} currency {currency}")
+    balance = total_of(rows)
+    if balance < minor:
+        raise InsufficientFunds(balance)
+    drain(rows, minor)
+    # later Core UPDATEs don't autoflush, so write the drained slots now
+    sessions.current().flush()
+    return balance - minor
+
+
+def try_debit(user_id, currency, minor):
+    """
+    Only the single conditional UPDATE on slot 0: the new total, or None when
+    slot 0 is missing or short (nothing is locked then). Always None in
+    journal mode. Raises InvalidAmount for a non-positive `minor`.
+    """
+    _positive(minor)
+    if journal_mode():
+        return None
+    where = (_cb.c.user_id == user_id, _cb.c.currency == currency, _cb.c.slot == 0)
+    return _apply(
+        update(_cb).where(*where, _cb.c.amount >= minor).values(amount=_cb.c.amount - minor), where
+    )
+
+
+def credit(user_id, currency, minor):
+    """
+    Add `minor` to a balance and return the new total. Hot accounts take the
+    first slot no other transaction holds; when every slot is busy (or there
+    is only one) wait on slot 0. Raises BalanceNotFound, or InvalidAmount
+    for a non-positive `minor`.
+    """
+    _positive(minor)
+    if journal_mode():
+        # append-only: the credit entry itself is written by post()
+        if not _exists(user_id, currency):
+            raise BalanceNotFound(f"balance not found for user {user_id} currency {currency}")
+        return journal.balance(user_id, currency) + minor
+
+    key = (_cb.c.user_id == user_id, _cb.c.currency == currency)
+    free_slot = (
+        db.select(_cb.c.id).where(*key).order_by(_cb.c.slot).limit(1)
+        .with_for_update(skip_locked=True).scalar_subquery()
+    )
+    where = (_cb.c.id == free_slot,)
+    total = _apply(update(_cb).where(*where).values(amount=_cb.c.amount + minor), where)
+    if total is not None:
+        return total
+
+    where = key + (_cb.c.slot == 0,)
+    total = _apply(update(_cb).where(*where).values(amount=_cb.c.amount + minor), where)
+    if total is None:
+        raise BalanceNotFound(f"balance not found for user {user_id} currency {currency}")
+    return total
+
+
+def lock_for_debit(user_id, currency):
+    """Lock all slots of a balance, ordered by slot. Empty list if missing."""
+    return sessions.current().execute(
+        db.select(CurrencyBalance)
+        .where(CurrencyBalance.user_id == user_id, CurrencyBalance.currency == currency)
+        .order_by(CurrencyBalance.slot)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    ).scalars().all()
+
+
+def total_of(rows):
+    return sum(r.amount for r in rows)
+
+
+def drain(rows, minor):
+    """Take `minor` from locked slot rows, draining in slot order. Caller checks funds."""
+    remaining = minor
+    for r in rows:
+        if remaining <= 0:
+            break
+        take = min(r.amount, remaining)
+        r.amount = r.amount - take
+        remaining -= take
+    if remaining > 0:
+        raise ValueError("insufficient funds across slots")
+
+
+class LockedBalances:
+    """
+    Balances locked once for a multi-leg operation. Legs are applied in
+    memory with debit()/credit(); in balance mode the slot rows are updated
+    too and written at flush.
+    """
+
+    def __init__(self, rows, totals):
+        self._rows = rows
+        self._totals = totals
+
+    def __contains__(self, key):
+        return key in self._totals
+
+    def total(self, key):
+        return self._totals[key]
+
+    def debit(self, key, minor):
+        _positive(minor)
+        if self._totals[key] < minor:
+            raise InsufficientFunds(self._totals[key])
+        self._totals[key] -= minor
+        if self._rows is not None:
+            drain(self._rows[key], minor)
+
+    def credit(self, key, minor):
+        _positive(minor)
+        self._totals[key] += minor
+        if self._rows is not None:
+            row = self._rows[key][0]
+            row.amount = row.amount + minor
+
+
+def lock_many(keys, missing_ok=False):
+    """
+    Lock every slot of each (user_id, currency) once, with one SELECT in key
+    order (the order transfer() uses). Raises BalanceNotFound for a missing
+    key, unless `missing_ok`, which leaves missing keys out of the result.
+    """
+    keys = sorted(set(keys))
+    rows = sessions.current().execute(
+        db.select(CurrencyBalance)
+        .where(tuple_(CurrencyBalance.user_id, CurrencyBalance.currency).in_(keys))
+        .order_by(CurrencyBalance.user_id, CurrencyBalance.currency, CurrencyBalance.slot)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    ).scalars().all()
+    by_key = {}
+    for r in rows:
+        by_key.setdefault((r.user_id, r.currency), []).append(r)
+    for uid, cur in keys:
+        if (uid, cur) not in by_key and not missing_ok:
+            raise BalanceNotFound(f"balance not found for user {uid} currency {cur}")
+    keys = [k for k in keys if k in by_key]
+    if journal_mode():
+        derived = journal.balances_for(keys)
+        return LockedBalances(None, {k: derived.get(k, 0) for k in keys})
+    return LockedBalances(by_key, {k: total_of(v) for k, v in by_key.items()})
+
+
+def post(type, currency, minor, from_user_id=None, to_user_id=None, details=None):
+    """
+    Record a completed transaction, its two journal entries and its monthly
+    statement rollups. Money from or to outside the wallet is booked against
+    the type's external account.
+    """
+    now = datetime.now(timezone.utc)
+    tx = Transaction(
+        id=str(uuid.uuid4()),
+        from_user_id=from_user_id,
+        to_user_id=to_user_id,
+        currency=currency,
+        amount=minor,
+        type=type,
+        status="completed",
+        details=details or {},
+        created_at=now,
+    )
+    sessions.current().add(tx)
+    balance_cache.touch(sessions.current(), (from_user_id, to_user_id))
+    external = journal.EXTERNAL_ACCOUNTS.get(type)
+    journal.append(journal.entries_for(tx.id, currency, minor, from_user_id or external, to_user_id or external, now))
+    statements.record([{
+        "from_user_id": from_user_id, "to_user_id": to_user_id, "currency": currency,
+        "amount": minor, "type": type, "created_at": now,
+    }])
+    return tx
+
+
+def post_many(rows):
+    """Bulk version of post() for transaction row dicts (id, from/to, currency, amount, type...)."""
+    if not rows:
+        return
+    now = datetime.now(timezone.utc)
+    entries = []
+    for r in rows:
+        r.setdefault("id", str(uuid.uuid4()))
+        r.setdefault("status", "completed")
+        r.setdefault("created_at", now)
+        external = journal.EXTERNAL_ACCOUNTS.get(r["type"])
+        entries.extend(journal.entries_for(
+            r["id"], r["currency"], r["amount"],
+            r.get("from_user_id") or external, r.get("to_user_id") or external, r["created_at"],
+        ))
+    sessions.current().execute(db.insert(Transaction), rows)
+    balance_cache.touch(sessions.current(), [u for r in rows for u in (r.get("from_user_id"), r.get("to_user_id"))])
+    journal.append(entries)
+    statements.record(rows)
+
+
+def balance_of(user_id, currency):
+    """Current balance summed over slots, or None when the user has no such balance."""
+    if journal_mode():
+        return journal.balance(user_id, currency) if _exists(user_id, currency) else None
+    return sessions.current().execute(
+        db.select(func.sum(CurrencyBalance.amount))
+        .where(CurrencyBalance.user_id == user_id, CurrencyBalance.currency == currency)
+    ).scalar()
+
+
+def balances_of(user_id):
+    """{currency: amount} summed over slots."""
+    if journal_mode():
+        currencies = sessions.current().execute(
+            db.select(_cb.c.currency).where(_cb.c.user_id == user_id).distinct().order_by(_cb.c.currency)
+        ).scalars().all()
+        derived = journal.account_balances(user_id)
+        return {cur: derived.get(cur, 0) for cur in currencies}
+    rows = sessions.current().execute(
+        db.select(CurrencyBalance.currency, func.sum(CurrencyBalance.amount))
+        .where(CurrencyBalance.user_id == user_id)
+        .group_by(CurrencyBalance.currency)
+        .order_by(CurrencyBalance.currency)
+    ).all()
+    return {cur: int(amount) for cur, amount in rows}
+
+
+def balances_of_many(user_ids):
+    """{user_id: {currency: amount}} in one query; users without balances are left out."""
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return {}
+    rows = sessions.current().execute(
+        db.select(_cb.c.user_id, _cb.c.currency, func.sum(_cb.c.amount))
+        .where(_cb.c.user_id.in_(user_ids))
+        .group_by(_cb.c.user_id, _cb.c.currency)
+        .order_by(_cb.c.user_id, _cb.c.currency)
+    ).all()
+    if journal_mode():
+        derived = journal.balances_for([(uid, cur) for uid, cur, _ in rows])
+        rows = [(uid, cur, derived.get((uid, cur), 0)) for uid, cur, _ in rows]
+    out = {}
+    for uid, cur, amount in rows:
+        out.setdefault(uid, {})[cur] = int(amount)
+    return out
+
+
+def set_slots(user_id, currency, slots):
+    """
+    Re-shard a balance into `slots` rows. Growing adds empty slots; shrinking
+    folds the removed slots' amounts back into slot 0. Caller commits.
+    """
+    if slots < 1:
+        raise ValueError("slots must be >= 1")
+    rows = lock_for_debit(user_id, currency)
+    if not rows:
+        raise LookupError(f"balance not found for user {user_id} currency {currency}")
+    by_slot = {r.slot: r for r in rows}
+    for r in rows:
+        if r.slot >= slots:
+            by_slot[0].amount = by_slot[0].amount + r.amount
+            sessions.current().delete(r)
+    for n in range(slots):
+        if n not in by_slot:
+            sessions.current().add(CurrencyBalance(user_id=user_id, currency=currency, amount=0, slot=n))
+    sessions.current().flush()
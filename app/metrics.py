@@ -0,0 +1,317 @@
+"""
+Prometheus metrics, served as text at GET /metrics.
+
+    http_request_duration_seconds{route,method,status}   histogram
+    db_statements_per_request{route}                     histogram
+    db_time_per_request_seconds{route}                   histogram
+    authorization_outcomes_total{action_code}            counter
+    db_pool_checked_out / db_pool_saturation{pid}        gauges (this process)
+    admission_rejected_total{class,reason}               counter (ADMISSION_LIMIT)
+    admission_queue_seconds{class}                       histogram
+    admission_in_flight / _waiting / _limit{pid,class}   gauges (this process)
+
+Recording takes no lock: every thread writes its own shard, and a scrape
+sums the shards (shards of finished threads are folded into one retired
+shard). With several worker processes, set METRICS_DIR to a directory shared
+by them; each process rewrites `<dir>/<pid>-<start>.json` at most every
+METRICS_FLUSH_INTERVAL seconds and a scrape merges all of the files.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from flask import Response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+HELP = {
+    "http_request_duration_seconds": ("histogram", "Request latency by route and status."),
+    "db_statements_per_request": ("histogram", "SQL statements executed per request."),
+    "db_time_per_request_seconds": ("histogram", "Time spent in SQL statements per request."),
+    "authorization_outcomes_total": ("counter", "Card authorizations by actionCode."),
+    "auth_batch_size": ("histogram", "Authorizations per group commit (AUTH_GROUP_COMMIT)."),
+    "auth_batch_fallbacks_total": ("counter", "Group commits rolled back and retried one by one."),
+    "admission_rejected_total": ("counter", "Requests shed with 503 by admission control, by class and reason."),
+    "admission_queue_seconds": ("histogram", "Time admitted requests waited for a slot, by class."),
+    "replica_routed_reads_total": ("counter", "Routed reads by target database and why (REPLICA_DATABASE_URL)."),
+}
+
+BUCKETS = {
+    "http_request_duration_seconds": LATENCY_BUCKETS,
+    "db_statements_per_request": STATEMENT_BUCKETS,
+    "db_time_per_request_seconds": LATENCY_BUCKETS,
+    "auth_batch_size": BATCH_BUCKETS,
+    "admission_queue_seconds": LATENCY_BUCKETS,
+}
+
+
+class _Shard:
+    __slots__ = ("counters", "hists")
+
+    def __init__(self):
+        self.counters = {}  # (name, labels) -> value
+        self.hists = {}     # (name, labels) -> [bucket counts..., +Inf count, sum]
+
+    def merge(self, other_counters, other_hists):
+        for key, value in other_counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, values in other_hists.items():
+            mine = self.hists.get(key)
+            if mine is None:
+                self.hists[key] = list(values)
+            else:
+                for i, v in enumerate(values):
+                    mine[i] += v
+
+
+_local = threading.local()
+_shards = []  # (thread, shard)
+_shards_lock = threading.Lock()
+_retired = _Shard()
+
+
+def _fold_dead():
+    # shards of finished threads; nobody writes to them any more
+    global _shards
+    alive = []
+    for thread, shard in _shards:
+        if thread.is_alive():
+            alive.append((thread, shard))
+        else:
+            _retired.merge(shard.counters, shard.hists)
+    _shards = alive
+
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = _local.shard = _Shard()
+        with _shards_lock:
+            _fold_dead()
+            _shards.append((threading.current_thread(), shard))
+        return shard
+
+
+def inc(name, labels=(), value=1):
+    counters = _shard().counters
+    key = (name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, labels, value):
+    hists = _shard().hists
+    key = (name, labels)
+    h = hists.get(key)
+    buckets = BUCKETS[name]
+    if h is None:
+        h = hists[key] = [0] * (len(buckets) + 2)
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            h[i] += 1
+            break
+    else:
+        h[len(buckets)] += 1
+    h[-1] += value
+
+
+def authorization_outcome(action_code):
+    inc("authorization_outcomes_total", (("action_code", action_code),))
+
+
+def _local_snapshot():
+    total = _Shard()
+    with _shards_lock:
+        _fold_dead()
+        total.merge(_retired.counters, _retired.hists)
+        shards = [s for _, s in _shards]
+    for shard in shards:
+        # copies: the owning thread may be inserting keys meanwhile
+        total.merge(dict(shard.counters), {k: list(v) for k, v in list(shard.hists.items())})
+    return total
+
+
+# -- multi-process -------------------------------------------------------------
+
+_started = time.time_ns()
+_last_flush = [0.0]
+
+
+def _dump_path(directory):
+    return os.path.join(directory, "%d-%d.json" % (os.getpid(), _started))
+
+
+def _encode(shard):
+    return {
+        "counters": [[name, list(map(list, labels)), v] for (name, labels), v in shard.counters.items()],
+        "hists": [[name, list(map(list, labels)), v] for (name, labels), v in shard.hists.items()],
+    }
+
+
+def _decode(data):
+    counters = {(name, tuple(map(tuple, labels))): v for name, labels, v in data["counters"]}
+    hists = {(name, tuple(map(tuple, labels))): v for name, labels, v in data["hists"]}
+    return counters, hists
+
+
+def flush(directory):
+    """Write this process's totals to `directory` (atomic replace)."""
+    path = _dump_path(directory)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(_encode(_local_snapshot()), f)
+    os.replace(tmp, path)
+    _last_flush[0] = time.monotonic()
+
+
+def _flush_at_exit(directory):
+    try:
+        flush(directory)
+    except OSError:
+        pass
+
+
+def collect(directory=None):
+    """Totals for this process, or for every process that dumped to `directory`."""
+    if not directory:
+        return _local_snapshot()
+    flush(directory)
+    total = _Shard()
+    for entry in os.listdir(directory):
+        if not entry.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, entry)) as f:
+                total.merge(*_decode(json.load(f)))
+        except (OSError, ValueError):
+            continue  # a worker is mid-write or the file was just removed
+    return total
+
+
+# -- exposition ------------------------------------------------------------------
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs) + "}"
+
+
+def render(shard, gauges=()):
+    lines = []
+    by_name = {}
+    for (name, labels), value in shard.counters.items():
+        by_name.setdefault(name, []).append((labels, value))
+    for (name, labels), value in shard.hists.items():
+        by_name.setdefault(name, []).append((labels, value))
+
+    for name in sorted(by_name):
+        kind, doc = HELP[name]
+        lines.append("# HELP %s %s" % (name, doc))
+        lines.append("# TYPE %s %s" % (name, kind))
+        for labels, value in sorted(by_name[name]):
+            if kind == "counter":
+                lines.append("%s%s %s" % (name, _labels(labels), value))
+                continue
+            buckets = BUCKETS[name]
+            cumulative = 0
+            for bound, count in zip(buckets, value):
+                cumulative += count
+                lines.append("%s_bucket%s %d" % (name, _labels(labels, (("le", bound),)), cumulative))
+            cumulative += value[len(buckets)]
+            lines.append("%s_bucket%s %d" % (name, _labels(labels, (("le", "+Inf"),)), cumulative))
+            lines.append("%s_sum%s %r" % (name, _labels(labels), float(value[-1])))
+            lines.append("%s_count%s %d" % (name, _labels(labels), cumulative))
+
+    for name, doc, samples in gauges:
+        lines.append("# HELP %s %s" % (name, doc))
+        lines.append("# TYPE %s gauge" % name)
+        for labels, value in samples:
+            lines.append("%s%s %s" % (name, _labels(labels), value))
+    return "\n".join(lines) + "\n"
+
+
+# -- collection hooks ------------------------------------------------------------
+
+# [statements, seconds] of the request running in this context
+_db_usage = ContextVar("db_usage", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_t0", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("metrics_t0")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    usage = _db_usage.get()
+    if usage is not None:
+        usage[0] += 1
+        usage[1] += elapsed
+
+
+def install_listeners():
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def init_app(app):
+    app.config.setdefault("METRICS_DIR", os.getenv("METRICS_DIR"))
+    app.config.setdefault("METRICS_FLUSH_INTERVAL", float(os.getenv("METRICS_FLUSH_INTERVAL", 5)))
+    install_listeners()
+
+    directory = app.config["METRICS_DIR"]
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        atexit.register(_flush_at_exit, directory)
+
+    @app.before_request
+    def start_metrics():
+        request.environ["metrics.start"] = time.perf_counter()
+        request.environ["metrics.db_token"] = _db_usage.set([0, 0.0])
+
+    @app.after_request
+    def record_metrics(response):
+        started = request.environ.pop("metrics.start", None)
+        token = request.environ.pop("metrics.db_token", None)
+        if started is None:
+            return response
+        usage = _db_usage.get() or [0, 0.0]
+        if token is not None:
+            _db_usage.reset(token)
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        observe("http_request_duration_seconds",
+                (("route", route), ("method", request.method), ("status", response.status_code)),
+                time.perf_counter() - started)
+        observe("db_statements_per_request", (("route", route),), usage[0])
+        observe("db_time_per_request_seconds", (("route", route),), usage[1])
+        if directory and time.monotonic() - _last_flush[0] >= app.config["METRICS_FLUSH_INTERVAL"]:
+            flush(directory)
+        return response
+
+    def metrics_view():
+        from . import db, pool
+        gauges = []
+        pid = (("pid", os.getpid()),)
+        sat = pool.saturation(db.engine)
+        if sat is not None:
+            gauges.append(("db_pool_checked_out", "Connections checked out of this process's pool.", [(pid, sat["checked_out"])]))
+            gauges.append(("db_pool_saturation", "Checked out / (pool_size + max_overflow).", [(pid, sat["saturation"])]))
+        limiter = app.extensions.get("admission")
+        if limiter is not None:
+            gauges.extend(limiter.gauges(pid))
+        body = render(collect(directory), gauges)
+        return Response(body, mimetype="text/plain; version=0.0.4")
+
+    app.add_url_rule("/metrics", "metrics", metrics_view, methods=["GET"])
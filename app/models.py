@@ -1,8 +1,7 @@
 import uuid
 from datetime import datetime, timezone
 from sqlalchemy.dialects.postgresql import UUID
-from werkzeug.security import generate_password_hash, check_password_hash
-from . import db
+from . import db, passwords
 
 def uuid4():
     return str(uuid.uuid4())
@@ -20,10 +19,14 @@ class User(db.Model):
     balances = db.relationship("CurrencyBalance", back_populates="user", cascade="all, delete-orphan")
 
     def set_password(self, password: str):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = passwords.current().hash(password)
 
     def check_password(self, password: str) -> bool:
-        return check_password_hash(self.password_hash, password)
+        # swaps in a rehash when the stored hash uses an old scheme or cost
+        ok, new_hash = passwords.current().verify(password, self.password_hash)
+        if new_hash:
+            self.password_hash = new_hash
+        return ok
 
 class CurrencyBalance(db.Model):
     __tablename__ = "currency_balances"
@@ -31,11 +34,12 @@ class CurrencyBalance(db.Model):
     user_id = db.Column(UUID(as_uuid=False), db.ForeignKey("users.id"), nullable=False)
     currency = db.Column(db.String(3), nullable=False)  # "USD" or "LBP"
     amount = db.Column(db.BigInteger, nullable=False, default=0)  # minor units
+    slot = db.Column(db.Integer, nullable=False, default=0, server_default="0")  # >0 only for hot accounts
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
     user = db.relationship("User", back_populates="balances")
 
-    __table_args__ = (db.UniqueConstraint("user_id", "currency", name="uq_user_currency"),)
+    __table_args__ = (db.UniqueConstraint("user_id", "currency", "slot", name="uq_user_currency_slot"),)
 
 class Card(db.Model):
     __tablename__ = "cards"
@@ -61,10 +65,69 @@ class Transaction(db.Model):
     details = db.Column(db.JSON, default={})
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
+    # history is read per user, newest first; one index per side of the transfer
+    __table_args__ = (
+        db.Index("ix_transactions_from_user_created", "from_user_id", "created_at"),
+        db.Index("ix_transactions_to_user_created", "to_user_id", "created_at"),
+    )
+
 class CardAuthRequest(db.Model):
     __tablename__ = "card_auth_requests"
     id = db.Column(UUID(as_uuid=False), primary_key=True, default=uuid4)
     idempotency_key = db.Column(db.String(36), unique=True, nullable=False)
     request_payload = db.Column(db.JSON, nullable=False)
-    response_payload = db.Column(db.JSON, nullable=False)
+    response_payload = db.Column(db.JSON, nullable=False)  # see routes.webhook.compact_response
     processed_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    # the retention purge walks this; lookups use the unique idempotency_key index
+    __table_args__ = (db.Index("ix_card_auth_requests_processed_at", "processed_at"),)
+
+# one side of a double-entry posting: every transaction appends a debit (negative)
+# and a credit (positive) entry that sum to zero; rows are only ever inserted
+class JournalEntry(db.Model):
+    __tablename__ = "journal_entries"
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True, autoincrement=True)
+    transaction_id = db.Column(UUID(as_uuid=False), nullable=False)
+    account = db.Column(db.String(64), nullable=False)  # user id, or "external:<counterparty>"
+    currency = db.Column(db.String(3), nullable=False)
+    amount = db.Column(db.BigInteger, nullable=False)  # signed minor units
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (db.Index("ix_journal_account_currency_id", "account", "currency", "id"),)
+
+# balance of an account as of journal entry last_entry_id, advanced by compaction
+class BalanceSnapshot(db.Model):
+    __tablename__ = "balance_snapshots"
+    account = db.Column(db.String(64), primary_key=True)
+    currency = db.Column(db.String(3), primary_key=True)
+    amount = db.Column(db.BigInteger, nullable=False, default=0)
+    last_entry_id = db.Column(db.BigInteger, nullable=False, default=0)
+    taken_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+# money in / out per user, month, currency and transaction type; upserted by
+# ledger.post() in the same transaction as the Transaction row. Busy accounts
+# can spread their rows over STATEMENT_SHARDS shards; readers sum them.
+class MonthlyStatement(db.Model):
+    __tablename__ = "monthly_statements"
+    user_id = db.Column(UUID(as_uuid=False), primary_key=True)
+    month = db.Column(db.String(7), primary_key=True)  # "YYYY-MM"
+    currency = db.Column(db.String(3), primary_key=True)
+    type = db.Column(db.String(32), primary_key=True)
+    direction = db.Column(db.String(3), primary_key=True)  # "in" | "out"
+    shard = db.Column(db.Integer, primary_key=True, default=0, autoincrement=False)
+    amount = db.Column(db.BigInteger, nullable=False, default=0)  # minor units
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+# USD/LBP rates; a change appends a row, and the newest id is the version the
+# in-memory snapshot (app/fx.py) carries
+class ExchangeRate(db.Model):
+    __tablename__ = "exchange_rates"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    base = db.Column(db.String(3), nullable=False)
+    quote = db.Column(db.String(3), nullable=False)
+    rate = db.Column(db.String(40), nullable=False)  # decimal string, quote units per 1 base unit
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+class ReplicaHeartbeat(db.Model):
+    __tablename__ = "replica_heartbeat"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # a single row, id 1
+    beat_ms = db.Column(db.BigInteger, nullable=False)  # wall clock of the last stamp on the primary, epoch ms
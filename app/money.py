@@ -0,0 +1,209 @@
+"""
+Money amounts as integer minor units.
+
+`to_minor()` turns a decimal string, int or JSON float into minor units of a
+currency without going through float arithmetic: the text is split at the
+decimal point and the digits are joined, so "1234567890123.45" LBP is exact.
+Amounts with more decimals than the currency has are rejected rather than
+rounded (trailing zeros are fine). `format_minor()` is the inverse and
+`to_minor_many()` parses a batch, reporting the index of the first bad one.
+"""
+
+from decimal import Decimal, InvalidOperation
+from math import isfinite
+
+MINOR_UNITS = {"USD": 2, "LBP": 2}  # using 2 decimals for simplicity
+DEFAULT_EXPONENT = 2
+MAX_DIGITS = 30  # integer digits; far beyond any balance, keeps int() cheap
+
+_SCALE = {e: 10 ** e for e in range(0, 9)}
+_FORMAT = {e: "%%d.%%0%dd" % e for e in range(1, 9)}
+# below these bounds doubles are spaced well under one minor unit, so each
+# amount with `e` decimals has a double of its own and the float path is exact
+_FLOAT_EXACT = {e: 2.0 ** 50 / 10 ** e for e in range(0, 9)}
+
+
+class InvalidAmount(ValueError):
+    def __init__(self, message, index=None):
+        super().__init__(message)
+        self.index = index
+
+
+def exponent(currency):
+    return MINOR_UNITS.get(currency, DEFAULT_EXPONENT)
+
+
+def _from_decimal(text, exp):
+    # exponent notation ("1e3", "1E+2") is rare enough for the slow path
+    try:
+        value = Decimal(text).scaleb(exp)
+    except InvalidOperation:
+        raise InvalidAmount("invalid amount")
+    if not value.is_finite() or value.adjusted() >= MAX_DIGITS + exp:
+        raise InvalidAmount("invalid amount")
+    if value != value.to_integral_value():
+        raise InvalidAmount("amount has more than %d decimals" % exp)
+    return int(value)
+
+
+def _fast(value, exp):
+    # "123.45" with exactly the currency's decimals and nothing but ASCII
+    # digits around the point: drop the point and let int() do the rest.
+    # None sends everything else (signs, whitespace, floats) down _parse().
+    if type(value) is str and exp < len(value) <= MAX_DIGITS and value[-exp - 1] == ".":
+        digits = value.replace(".", "", 1)
+        if digits.isdigit() and digits.isascii():
+            return int(digits)
+    return None
+
+
+def _parse(value, exp):
+    # callers have tried the string fast path already
+    if type(value) is float and -_FLOAT_EXACT[exp] < value < _FLOAT_EXACT[exp]:
+        # a JSON number with at most `exp` decimals parses to the double
+        # nearest minor / scale, so dividing back must give the same double
+        scale = _SCALE[exp]
+        minor = round(value * scale)
+        if minor / scale == value:
+            return minor
+    return _parse_slow(value, exp)
+
+
+def _parse_slow(value, exp):
+    kind = type(value)
+    if kind is int:
+        return value * _SCALE[exp]
+    if kind is float:
+        # repr() is the shortest string that reads back as the same float,
+        # i.e. what the client wrote in its JSON
+        if not isfinite(value):
+            raise InvalidAmount("invalid amount")
+        value = repr(value)
+    elif kind is not str:
+        if isinstance(value, Decimal):
+            return _from_decimal(str(value), exp)
+        raise InvalidAmount("invalid amount")
+
+    text = value.strip()
+    whole, _, frac = text.partition(".")
+    negative = whole[:1] == "-"
+    if negative or whole[:1] == "+":
+        whole = whole[1:]
+    if not (whole or frac) or not (whole + frac).isascii():
+        raise InvalidAmount("invalid amount")
+    if (whole and not whole.isdigit()) or (frac and not frac.isdigit()):
+        if "e" in text or "E" in text:
+            return _from_decimal(text, exp)
+        raise InvalidAmount("invalid amount")
+    if len(whole) > MAX_DIGITS:
+        raise InvalidAmount("invalid amount")
+    if len(frac) > exp:
+        if frac[exp:].strip("0"):
+            raise InvalidAmount("amount has more than %d decimals" % exp)
+        frac = frac[:exp]
+    minor = int((whole or "0") + frac + "0" * (exp - len(frac)))
+    return -minor if negative else minor
+
+
+def to_minor(value, currency="USD"):
+    """`value` (str, int, float or Decimal) in minor units of `currency`; raises InvalidAmount."""
+    exp = MINOR_UNITS.get(currency, DEFAULT_EXPONENT)
+    minor = _fast(value, exp)
+    return _parse(value, exp) if minor is None else minor
+
+
+def to_minor_many(pairs):
+    """
+    [(value, currency), ...] -> [minor, ...]. Raises InvalidAmount with
+    `.index` set to the first amount that does not parse.
+    """
+    out = []
+    append = out.append
+    units = MINOR_UNITS
+    for i, (value, currency) in enumerate(pairs):
+        exp = units.get(currency, DEFAULT_EXPONENT)
+        minor = _fast(value, exp)
+        if minor is not None:
+            append(minor)
+            continue
+        try:
+            append(_parse(value, exp))
+        except InvalidAmount as e:
+            raise InvalidAmount(str(e), index=i)
+    return out
+
+
+def format_minor(minor, currency="USD"):
+    """Minor units as a plain decimal string: 123456 -> "1234.56"."""
+    exp = MINOR_UNITS.get(currency, DEFAULT_EXPONENT)
+    if exp == 2 and minor >= 0:
+        return "%d.%02d" % divmod(minor, 100)
+    if minor >= 0 and exp:
+        return _FORMAT[exp] % divmod(minor, _SCALE[exp])
+    if not exp:
+        return str(minor)
+    return "-" + _FORMAT[exp] % divmod(-minor, _SCALE[exp])
+
+
+class Money:
+    """An amount in minor units of one currency. Immutable and hashable."""
+
+    __slots__ = ("minor", "currency")
+
+    def __init__(self, minor, currency):
+        object.__setattr__(self, "minor", minor)
+        object.__setattr__(self, "currency", currency)
+
+    @classmethod
+    def parse(cls, value, currency):
+        return cls(to_minor(value, currency), currency)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Money is immutable")
+
+    def __repr__(self):
+        return "Money(%s %s)" % (format_minor(self.minor, self.currency), self.currency)
+
+    def __str__(self):
+        return format_minor(self.minor, self.currency)
+
+    def __eq__(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        return self.minor == other.minor and self.currency == other.currency
+
+    def __hash__(self):
+        return hash((self.minor, self.currency))
+
+    def _check(self, other):
+        if not isinstance(other, Money):
+            return False
+        if other.currency != self.currency:
+            raise ValueError("currency mismatch: %s vs %s" % (self.currency, other.currency))
+        return True
+
+    def __add__(self, other):
+        if not self._check(other):
+            return NotImplemented
+        return Money(self.minor + other.minor, self.currency)
+
+    def __sub__(self, other):
+        if not self._check(other):
+            return NotImplemented
+        return Money(self.minor - other.minor, self.currency)
+
+    def __neg__(self):
+        return Money(-self.minor, self.currency)
+
+    def __lt__(self, other):
+        if not self._check(other):
+            return NotImplemented
+        return self.minor < other.minor
+
+    def __le__(self, other):
+        if not self._check(other):
+            return NotImplemented
+        return self.minor <= other.minor
+
+    def __bool__(self):
+        return self.minor != 0
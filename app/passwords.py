@@ -0,0 +1,111 @@
+"""
+Password hashing off the request thread.
+
+The scheme and its cost come from the environment:
+
+    PASSWORD_SCHEME        pbkdf2_sha256 (default), bcrypt, sha512_crypt, ...
+    PASSWORD_ROUNDS        rounds for that scheme (default: DEFAULT_ROUNDS, else passlib's)
+    PASSWORD_HASH_WORKERS  hashing threads (default: CPU count)
+    PASSWORD_HASH_QUEUE    hashes allowed to wait for a thread (default 4 x workers)
+
+Hashes run on a bounded pool, so at most PASSWORD_HASH_WORKERS cores hash at
+once and the rest stay free for I/O-bound requests; past the queue limit
+`HashingBusy` is raised instead of piling up threads. Verification reports a
+replacement hash when the stored one uses an older scheme or cost (including
+the werkzeug hashes written before this module), which `User.check_password`
+swaps in.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, has_app_context
+from passlib.context import CryptContext
+from werkzeug.security import check_password_hash
+
+# what werkzeug.generate_password_hash produced before
+WERKZEUG_PREFIXES = ("pbkdf2:", "scrypt:")
+
+# schemes verify() still accepts after PASSWORD_SCHEME moves off them
+KNOWN_SCHEMES = ("pbkdf2_sha256", "bcrypt", "sha512_crypt", "sha256_crypt")
+
+# keep the cost werkzeug used, rather than passlib's lower pbkdf2 default
+DEFAULT_ROUNDS = {"pbkdf2_sha256": 600000}
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class Hasher:
+    def __init__(self, scheme="pbkdf2_sha256", rounds=None, workers=None, queue=None):
+        settings = {"schemes": [scheme] + [s for s in KNOWN_SCHEMES if s != scheme], "deprecated": "auto"}
+        rounds = rounds or DEFAULT_ROUNDS.get(scheme)
+        if rounds:
+            settings[scheme + "__rounds"] = rounds
+        self.context = CryptContext(**settings)
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pwhash")
+        self._slots = threading.BoundedSemaphore(self.workers + (self.workers * 4 if queue is None else queue))
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            return self._pool.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(self.context.hash, password)
+
+    def hash_many(self, passwords):
+        """Hash a batch on every worker at once (bulk imports); not subject to the queue limit."""
+        return list(self._pool.map(self.context.hash, passwords))
+
+    def verify(self, password, stored):
+        """(matches, replacement hash or None)."""
+        if stored.startswith(WERKZEUG_PREFIXES):
+            ok = self._run(check_password_hash, stored, password)
+            if not ok:
+                return False, None
+            # the upgrade is best-effort: a busy pool must not fail the login
+            try:
+                return True, self.hash(password)
+            except HashingBusy:
+                return True, None
+        if self.context.identify(stored) is None:  # not a hash this context knows
+            return False, None
+        # anything failing past here (a backend, the rehash) is an error, not a mismatch
+        return self._run(self.context.verify_and_update, password, stored)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+def from_env():
+    rounds = os.getenv("PASSWORD_ROUNDS")
+    workers = os.getenv("PASSWORD_HASH_WORKERS")
+    queue = os.getenv("PASSWORD_HASH_QUEUE")
+    return Hasher(
+        scheme=os.getenv("PASSWORD_SCHEME", "pbkdf2_sha256"),
+        rounds=int(rounds) if rounds else None,
+        workers=int(workers) if workers else None,
+        queue=int(queue) if queue else None,
+    )
+
+
+_fallback = None
+_fallback_lock = threading.Lock()
+
+
+def current():
+    """The app's hasher, or a process-wide one outside an app context."""
+    global _fallback
+    if has_app_context():
+        return current_app.extensions["password_hasher"]
+    with _fallback_lock:
+        if _fallback is None:
+            _fallback = from_env()
+        return _fallback
@@ -0,0 +1,189 @@
+"""
+Connection pool configuration and instrumentation.
+
+Pool settings come from the environment:
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (s), DB_POOL_RECYCLE (s),
+    DB_POOL_PRE_PING (1/0)
+
+Every checkout is timed (time spent waiting for a free connection) and every
+checkout -> checkin pair gives a connection hold time. Both are summed per
+request into a `Server-Timing: db-wait, db-hold` response header and into
+process-wide counters, next to a saturation gauge
+(checked out / (pool_size + max_overflow)) served at GET /internal/pool.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from flask import g, has_app_context, jsonify
+from sqlalchemy import event, exc, make_url
+from sqlalchemy.pool import QueuePool
+
+from . import db
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_OVERFLOW = 10  # SQLAlchemy's own default
+
+
+def _env(name, cast):
+    value = os.getenv(name)
+    return None if value in (None, "") else cast(value)
+
+
+def engine_options(database_uri):
+    """SQLALCHEMY_ENGINE_OPTIONS for this database; pool sizing only applies to queue pools."""
+    options = {}
+    pre_ping = _env("DB_POOL_PRE_PING", lambda v: v.lower() in ("1", "true", "yes"))
+    recycle = _env("DB_POOL_RECYCLE", int)
+    if pre_ping is not None:
+        options["pool_pre_ping"] = pre_ping
+    if recycle is not None:
+        options["pool_recycle"] = recycle
+
+    url = make_url(database_uri)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return options  # Flask-SQLAlchemy forces a StaticPool here
+
+    options["poolclass"] = TimedQueuePool
+    for key, name, cast in (
+        ("pool_size", "DB_POOL_SIZE", int),
+        ("max_overflow", "DB_MAX_OVERFLOW", int),
+        ("pool_timeout", "DB_POOL_TIMEOUT", float),
+    ):
+        value = _env(name, cast)
+        if value is not None:
+            options[key] = value
+    options.setdefault("max_overflow", DEFAULT_MAX_OVERFLOW)
+    return options
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.hold_seconds = 0.0
+        self.max_hold_seconds = 0.0
+
+    def waited(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds += seconds
+            if seconds > self.max_wait_seconds:
+                self.max_wait_seconds = seconds
+
+    def timed_out(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def held(self, seconds):
+        with self._lock:
+            self.hold_seconds += seconds
+            if seconds > self.max_hold_seconds:
+                self.max_hold_seconds = seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.wait_seconds, 6),
+                "wait_seconds_max": round(self.max_wait_seconds, 6),
+                "hold_seconds_total": round(self.hold_seconds, 6),
+                "hold_seconds_max": round(self.max_hold_seconds, 6),
+            }
+
+
+stats = PoolStats()
+
+
+def _request_add(key, seconds):
+    if has_app_context():
+        g.setdefault("db_timing", {"wait": 0.0, "hold": 0.0})[key] += seconds
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that times how long each checkout waits for a connection."""
+
+    def __init__(self, creator, max_overflow=DEFAULT_MAX_OVERFLOW, **kw):
+        super().__init__(creator, max_overflow=max_overflow, **kw)
+        # the configured value, for saturation(); negative means unbounded
+        self.max_overflow = max_overflow
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            stats.timed_out()
+            _request_add("wait", time.perf_counter() - t0)
+            raise
+        waited = time.perf_counter() - t0
+        stats.waited(waited)
+        _request_add("wait", waited)
+        return conn
+
+
+def _on_checkout(dbapi_conn, record, proxy):
+    record.info["checked_out_at"] = time.perf_counter()
+
+
+def _on_checkin(dbapi_conn, record):
+    t0 = record.info.pop("checked_out_at", None)
+    if t0 is None:
+        return
+    held = time.perf_counter() - t0
+    stats.held(held)
+    _request_add("hold", held)
+
+
+def saturation(engine):
+    pool = engine.pool
+    if not isinstance(pool, TimedQueuePool):
+        return None
+    capacity = pool.size() + max(pool.max_overflow, 0)
+    checked_out = pool.checkedout()
+    return {
+        "size": pool.size(),
+        "max_overflow": pool.max_overflow,
+        "checked_out": checked_out,
+        "saturation": round(checked_out / capacity, 4) if capacity else 1.0,
+    }
+
+
+def init_app(app):
+    app.config.setdefault("DB_POOL_SATURATION_WARN", float(os.getenv("DB_POOL_SATURATION_WARN", 0.9)))
+
+    with app.app_context():
+        engine = db.engine
+    if not event.contains(engine.pool, "checkout", _on_checkout):
+        event.listen(engine.pool, "checkout", _on_checkout)
+        event.listen(engine.pool, "checkin", _on_checkin)
+
+    @app.after_request
+    def add_db_timing(response):
+        # hand the connection back now rather than at teardown, so a
+        # read-only request's hold time is in its header too. Anything still
+        # uncommitted here is what teardown would roll back anyway.
+        if db.session().in_transaction():
+            db.session.rollback()
+        timing = g.pop("db_timing", None)
+        if timing is not None:
+            response.headers["Server-Timing"] = "db-wait;dur=%.2f, db-hold;dur=%.2f" % (
+                timing["wait"] * 1000.0, timing["hold"] * 1000.0,
+            )
+        sat = saturation(engine)
+        if sat is not None and sat["saturation"] >= app.config["DB_POOL_SATURATION_WARN"]:
+            log.warning("connection pool %.0f%% saturated (%d checked out)", sat["saturation"] * 100, sat["checked_out"])
+        return response
+
+    def pool_status():
+        return jsonify({"pool": saturation(engine), "stats": stats.snapshot()}), 200
+
+    app.add_url_rule("/internal/pool", "pool_status", pool_status, methods=["GET"])
@@ -0,0 +1,213 @@
+"""
+SQL profiling: per-request statement logs, N+1 detection, slow-query plans
+and query budgets for tests.
+
+With SQL_PROFILE=1 every request records each statement with its duration
+and row count. Statement shapes (whitespace and IN-list placeholders
+collapsed) seen SQL_NPLUS1_THRESHOLD times or more in one request are logged
+as N+1 suspects, and statements slower than SQL_SLOW_QUERY_MS are logged with
+their EXPLAIN plan, both to the rotating file SQL_PROFILE_LOG. The last
+requests are summarised at GET /internal/sql-profile.
+
+`query_budget()` works without the config switch:
+
+    with query_budget(6, max_repeats=1):
+        client.post("/api/webhook/webhook/authorize", json=payload)
+
+raises QueryBudgetExceeded (an AssertionError) listing the statements when
+the block runs more statements, or repeats a shape more often, than allowed.
+"""
+
+import logging
+import os
+import re
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+
+from flask import jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+_WS = re.compile(r"\s+")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*(?:\?|%\(\w+\)s|%s|\$\d+|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|%s|\$\d+|:\w+))+\s*\)")
+_EXPLAINABLE = ("select", "with", "update", "delete", "insert")
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def shape(statement):
+    """Statement text with whitespace and expanded IN lists collapsed."""
+    return _PLACEHOLDER_LIST.sub("(?)", _WS.sub(" ", statement).strip())
+
+
+class QueryLog:
+    def __init__(self, slow_ms=None):
+        self.slow_ms = slow_ms
+        self.statements = []  # (statement, duration seconds, rowcount)
+
+    def __len__(self):
+        return len(self.statements)
+
+    @property
+    def seconds(self):
+        return sum(d for _, d, _ in self.statements)
+
+    def shapes(self):
+        return Counter(shape(s) for s, _, _ in self.statements)
+
+    def repeated(self, threshold):
+        return [(s, n) for s, n in self.shapes().most_common() if n >= threshold]
+
+    def describe(self):
+        return "\n".join(
+            "  %6.2f ms  rows=%s  %s" % (d * 1000.0, rows, _WS.sub(" ", s)[:300])
+            for s, d, rows in self.statements
+        )
+
+
+_active = ContextVar("sql_query_logs", default=())
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active.get():
+        conn.info.setdefault("profiler_t0", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    logs = _active.get()
+    started = conn.info.get("profiler_t0")
+    if not logs or not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    rowcount = cursor.rowcount
+    for qlog in logs:
+        qlog.statements.append((statement, elapsed, rowcount))
+    slow_ms = min((q.slow_ms for q in logs if q.slow_ms is not None), default=None)
+    if slow_ms is not None and elapsed * 1000.0 >= slow_ms and not executemany:
+        log.warning("slow query %.1f ms (rows=%s): %s\n%s",
+                    elapsed * 1000.0, rowcount, _WS.sub(" ", statement), explain(conn, statement, parameters))
+
+
+def explain(conn, statement, parameters):
+    """The plan of `statement`, run on the raw DBAPI connection so no events fire."""
+    if not statement.lstrip().lower().startswith(_EXPLAINABLE):
+        return "(no plan)"
+    dialect = conn.dialect.name
+    prefix = "EXPLAIN QUERY PLAN " if dialect == "sqlite" else "EXPLAIN "
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        if dialect == "postgresql":
+            # a failing EXPLAIN must not abort the request's transaction
+            cursor.execute("SAVEPOINT profiler_explain")
+        try:
+            cursor.execute(prefix + statement, parameters)
+            plan = "\n".join("    " + " | ".join(str(c) for c in row) for row in cursor.fetchall())
+        except Exception as e:
+            if dialect == "postgresql":
+                cursor.execute("ROLLBACK TO SAVEPOINT profiler_explain")
+            return "(EXPLAIN failed: %s)" % e
+        if dialect == "postgresql":
+            cursor.execute("RELEASE SAVEPOINT profiler_explain")
+        return plan
+    finally:
+        cursor.close()
+
+
+def install_listeners():
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _push(qlog):
+    install_listeners()
+    return _active.set(_active.get() + (qlog,))
+
+
+@contextmanager
+def recording(slow_ms=None):
+    """Record every statement run in this context (nested recordings all see them)."""
+    qlog = QueryLog(slow_ms)
+    token = _push(qlog)
+    try:
+        yield qlog
+    finally:
+        _active.reset(token)
+
+
+@contextmanager
+def query_budget(max_statements=None, max_repeats=None):
+    with recording() as qlog:
+        yield qlog
+    problems = []
+    if max_statements is not None and len(qlog) > max_statements:
+        problems.append("%d statements, budget is %d" % (len(qlog), max_statements))
+    if max_repeats is not None:
+        for s, n in qlog.repeated(max_repeats + 1):
+            problems.append("shape repeated %d times (max %d): %s" % (n, max_repeats, s[:200]))
+    if problems:
+        raise QueryBudgetExceeded("; ".join(problems) + "\n" + qlog.describe())
+
+
+def _file_handler(path, max_bytes, backups):
+    path = os.path.abspath(path)
+    for handler in log.handlers:
+        if isinstance(handler, RotatingFileHandler) and handler.baseFilename == path:
+            return handler
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    log.addHandler(handler)
+    log.setLevel(logging.INFO)
+    return handler
+
+
+def init_app(app):
+    app.config.setdefault("SQL_PROFILE", os.getenv("SQL_PROFILE", "0").lower() in ("1", "true", "yes"))
+    app.config.setdefault("SQL_SLOW_QUERY_MS", float(os.getenv("SQL_SLOW_QUERY_MS", 100)))
+    app.config.setdefault("SQL_NPLUS1_THRESHOLD", int(os.getenv("SQL_NPLUS1_THRESHOLD", 3)))
+    app.config.setdefault("SQL_PROFILE_LOG", os.getenv("SQL_PROFILE_LOG", "sql_profile.log"))
+    app.config.setdefault("SQL_PROFILE_LOG_MAX_BYTES", int(os.getenv("SQL_PROFILE_LOG_MAX_BYTES", 10 * 1024 * 1024)))
+    app.config.setdefault("SQL_PROFILE_LOG_BACKUPS", int(os.getenv("SQL_PROFILE_LOG_BACKUPS", 5)))
+    if not app.config["SQL_PROFILE"]:
+        return
+
+    _file_handler(app.config["SQL_PROFILE_LOG"], app.config["SQL_PROFILE_LOG_MAX_BYTES"], app.config["SQL_PROFILE_LOG_BACKUPS"])
+    recent = app.extensions["sql_profile"] = deque(maxlen=100)
+
+    @app.before_request
+    def start_profile():
+        qlog = request.environ["profiler.log"] = QueryLog(app.config["SQL_SLOW_QUERY_MS"])
+        request.environ["profiler.token"] = _push(qlog)
+
+    @app.after_request
+    def finish_profile(response):
+        token = request.environ.pop("profiler.token", None)
+        qlog = request.environ.pop("profiler.log", None)
+        if token is None:
+            return response
+        _active.reset(token)
+        endpoint = request.url_rule.rule if request.url_rule is not None else request.path
+        repeated = qlog.repeated(app.config["SQL_NPLUS1_THRESHOLD"])
+        for s, n in repeated:
+            log.warning("possible N+1 on %s %s: %d x %s", request.method, endpoint, n, s)
+        recent.append({
+            "endpoint": endpoint,
+            "method": request.method,
+            "status": response.status_code,
+            "statements": len(qlog),
+            "db_ms": round(qlog.seconds * 1000.0, 3),
+            "repeated": [{"shape": s, "count": n} for s, n in repeated],
+        })
+        return response
+
+    def profile_view():
+        return jsonify(list(recent)), 200
+
+    app.add_url_rule("/internal/sql-profile", "sql_profile", profile_view, methods=["GET"])
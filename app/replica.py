@@ -0,0 +1,168 @@
+"""
+Read replica routing (REPLICA_DATABASE_URL).
+
+With a replica configured, the endpoints listed in REPLICA_ENDPOINTS (by
+default the transaction history and wallet reads) run against a session on
+the replica's own engine and pool (sized by the same DB_POOL_* settings).
+Everything else, including every write, stays on the primary.
+
+Lag is measured with a heartbeat. Every REPLICA_CHECK_INTERVAL seconds each
+worker stamps the single `replica_heartbeat` row on the primary and reads
+the replica's copy back; the lag is the age of that copy, so it also grows
+while the replica cannot be reached. Routed reads go to the primary while
+the lag is unknown or above REPLICA_MAX_LAG seconds.
+
+Reading your own writes: every successful write response carries
+X-Write-Time (epoch ms). A read that sends it back as X-Read-After is served
+by the replica only once the replica's heartbeat has passed that time;
+X-Read-After: primary always reads from the primary. Both times are worker
+wall clocks, so keep the hosts NTP-synced.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from flask import g, jsonify, request
+from sqlalchemy import create_engine, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import db, metrics, pool, sessions
+from .models import ReplicaHeartbeat
+
+log = logging.getLogger(__name__)
+
+DEFAULT_ENDPOINTS = "payments.payment_history,payments.get_wallets"
+READ_AFTER_HEADER = "X-Read-After"
+WRITE_TIME_HEADER = "X-Write-Time"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def stamp(session):
+    """Write the heartbeat on the primary; returns the stamped time."""
+    beat = now_ms()
+    if not session.execute(update(ReplicaHeartbeat).where(ReplicaHeartbeat.id == 1).values(beat_ms=beat)).rowcount:
+        session.add(ReplicaHeartbeat(id=1, beat_ms=beat))
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()  # another worker inserted the row first; its stamp will do
+    return beat
+
+
+class Replica:
+    def __init__(self, app, url, max_lag=5.0, interval=1.0):
+        self.app = app
+        self.engine = create_engine(url, **pool.engine_options(url))
+        self.max_lag = max_lag
+        self.interval = interval
+        self.position_ms = None  # the replica's heartbeat at the last check
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def check(self):
+        """Stamp the primary, read the replica's heartbeat back; returns the lag."""
+        stamp(db.session)
+        with Session(self.engine) as session:
+            position = session.execute(select(ReplicaHeartbeat.beat_ms).where(ReplicaHeartbeat.id == 1)).scalar()
+        if position is not None:
+            self.position_ms = position
+        return self.lag()
+
+    def lag(self):
+        """Seconds the replica is behind as of now, None before it has a heartbeat."""
+        if self.position_ms is None:
+            return None
+        return max(0, now_ms() - self.position_ms) / 1000.0
+
+    def target(self, read_after=None):
+        """("replica" | "primary", reason) for one routed read."""
+        if read_after == "primary":
+            return "primary", "requested"
+        lag = self.lag()
+        if lag is None or lag > self.max_lag:
+            return "primary", "lag"
+        if read_after:
+            try:
+                if self.position_ms < int(read_after):
+                    return "primary", "read_your_writes"
+            except ValueError:
+                return "primary", "requested"
+        return "replica", "ok"
+
+    def ensure_started(self):
+        # threads don't survive fork, so every worker process starts its own
+        if self._pid == os.getpid() or not self.interval:
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name="replica-lag", daemon=True).start()
+
+    def _run(self):
+        pid = self._pid
+        while self._pid == pid:
+            with self.app.app_context():
+                try:
+                    self.check()
+                except Exception:
+                    log.exception("replica lag check failed")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            time.sleep(self.interval)
+
+
+def init_app(app):
+    app.config.setdefault("REPLICA_DATABASE_URL", os.getenv("REPLICA_DATABASE_URL"))
+    app.config.setdefault("REPLICA_ENDPOINTS", os.getenv("REPLICA_ENDPOINTS", DEFAULT_ENDPOINTS))
+    app.config.setdefault("REPLICA_MAX_LAG", float(os.getenv("REPLICA_MAX_LAG", 5)))
+    app.config.setdefault("REPLICA_CHECK_INTERVAL", float(os.getenv("REPLICA_CHECK_INTERVAL", 1)))
+    if not app.config["REPLICA_DATABASE_URL"]:
+        return
+
+    endpoints = frozenset(e.strip() for e in app.config["REPLICA_ENDPOINTS"].split(",") if e.strip())
+    replica = app.extensions["replica"] = Replica(
+        app, app.config["REPLICA_DATABASE_URL"], app.config["REPLICA_MAX_LAG"], app.config["REPLICA_CHECK_INTERVAL"],
+    )
+    app.before_request(replica.ensure_started)
+
+    @app.before_request
+    def route_reads():
+        if request.endpoint not in endpoints or request.method not in SAFE_METHODS:
+            return
+        target, reason = replica.target(request.headers.get(READ_AFTER_HEADER))
+        metrics.inc("replica_routed_reads_total", (("endpoint", request.endpoint), ("target", target), ("reason", reason)))
+        if target == "replica":
+            g.replica_session = Session(replica.engine)
+            g.replica_token = sessions.push(g.replica_session)
+
+    @app.teardown_request
+    def release_replica(exc):
+        session = g.pop("replica_session", None)
+        if session is not None:
+            sessions.pop(g.pop("replica_token"))
+            session.close()
+
+    @app.after_request
+    def stamp_writes(response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            response.headers[WRITE_TIME_HEADER] = str(now_ms())
+        return response
+
+    def replica_status():
+        lag = replica.lag()
+        return jsonify({
+            "lag_seconds": lag,
+            "max_lag_seconds": replica.max_lag,
+            "position_ms": replica.position_ms,
+            "serving": lag is not None and lag <= replica.max_lag,
+        }), 200
+
+    app.add_url_rule("/internal/replica", "replica_status", replica_status, methods=["GET"])
@@ -1,14 +1,12 @@
-from flask import Blueprint, request, jsonify, current_app
-from .. import db
-from ..models import User, CurrencyBalance, Transaction
+from flask import Blueprint, request, jsonify
+from .. import db, ledger
+from ..money import InvalidAmount, format_minor, to_minor
+from ..passwords import HashingBusy
+from ..models import User, CurrencyBalance
 from sqlalchemy.exc import IntegrityError
 
 bp = Blueprint("auth", __name__)
 
-def to_minor(amount_float):
-    # convert decimal string/float to integer minor units (2 decimal places)
-    return int(round(float(amount_float) * 100))
-
 @bp.route("/signup", methods=["POST"])
 def signup():
     data = request.get_json() or {}
@@ -19,7 +17,10 @@ def signup():
     if not email or not password:
         return jsonify({"error": "email and password required"}), 400
     user = User(email=email, first_name=first_name, last_name=last_name)
-    user.set_password(password)
+    try:
+        user.set_password(password)
+    except HashingBusy:
+        return jsonify({"error": "signup busy, retry shortly"}), 503, {"Retry-After": "1"}
     try:
         db.session.add(user)
         db.session.flush()
@@ -27,12 +28,31 @@ def signup():
         for cur in ("USD", "LBP"):
             bal = CurrencyBalance(user_id=user.id, currency=cur, amount=0)
             db.session.add(bal)
+        body = {"user_id": user.id, "email": user.email}
         db.session.commit()
     except IntegrityError:
         db.session.rollback()
         return jsonify({"error": "email already exists"}), 409
 
-    return jsonify({"user_id": user.id, "email": user.email}), 201
+    return jsonify(body), 201
+
+@bp.route("/login", methods=["POST"])
+def login():
+    data = request.get_json() or {}
+    email = data.get("email")
+    password = data.get("password")
+    if not email or not password:
+        return jsonify({"error": "email and password required"}), 400
+    user = User.query.filter_by(email=email).first()
+    try:
+        ok = user is not None and user.check_password(password)
+    except HashingBusy:
+        return jsonify({"error": "login busy, retry shortly"}), 503, {"Retry-After": "1"}
+    if not ok:
+        return jsonify({"error": "invalid credentials"}), 401
+    body = {"user_id": user.id}
+    db.session.commit()  # persists an upgraded hash, if any
+    return jsonify(body), 200
 
 @bp.route("/topup", methods=["POST"])
 def topup():
@@ -47,22 +67,18 @@ def topup():
     if not user_id or not currency or amount is None:
         return jsonify({"error": "user_id, currency, amount required"}), 400
     try:
-        minor = to_minor(amount)
-    except Exception:
+        minor = to_minor(amount, currency)
+    except InvalidAmount:
         return jsonify({"error": "invalid amount format"}), 400
+    if minor <= 0:
+        return jsonify({"error": "amount must be > 0"}), 400
 
-    # lock the balance row
-    from sqlalchemy import select, update, literal_column
-    from sqlalchemy.orm import with_loader_criteria
-
-    bal = db.session.execute(
-        db.select(CurrencyBalance).where(CurrencyBalance.user_id == user_id, CurrencyBalance.currency == currency).with_for_update()
-    ).scalar_one_or_none()
-    if bal is None:
+    # one conditional UPDATE; hot accounts spread credits over their slots
+    try:
+        balance = ledger.credit(user_id, currency, minor)
+    except ledger.BalanceNotFound:
         return jsonify({"error": "balance not found for user/currency"}), 404
 
-    bal.amount = bal.amount + minor
-    tx = Transaction(from_user_id=None, to_user_id=user_id, currency=currency, amount=minor, type="topup", status="completed", metadata={})
-    db.session.add(tx)
+    ledger.post("topup", currency, minor, to_user_id=user_id)
     db.session.commit()
-    return jsonify({"balance_minor": bal.amount, "balance_decimal": "%.2f" % (bal.amount / 100.0)}), 200
+    return jsonify({"balance_minor": balance, "balance_decimal": format_minor(balance, currency)}), 200
@@ -1,12 +1,30 @@
-from flask import Blueprint, request, jsonify
-from .. import db
-from ..models import CurrencyBalance, Transaction, User, Card
-from sqlalchemy.exc import IntegrityError
+import base64
+import json
+import re
+from datetime import datetime
+
+from flask import Blueprint, current_app, request, jsonify
+from .. import archive, db, ledger, sessions, statements
+from ..money import InvalidAmount, format_minor, to_minor
+from ..models import Transaction, Card
+from sqlalchemy import tuple_, union
 
 bp = Blueprint("payments", __name__)
 
-def to_minor(amount_float):
-    return int(round(float(amount_float) * 100))
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+BULK_WALLETS_MAX = 1000
+HISTORY_FIELDS = ("id", "from_user_id", "to_user_id", "currency", "amount", "type", "status", "details", "created_at")
+MONTH_RE = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
+
+def encode_cursor(created_at, tx_id):
+    raw = json.dumps([created_at.isoformat(), tx_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    ts, tx_id = json.loads(raw)
+    return datetime.fromisoformat(ts), str(tx_id)
 
 @bp.route("/payments", methods=["POST"])
 def create_payment():
@@ -25,94 +43,154 @@ def create_payment():
         return jsonify({"error": "from_user_id, currency, amount required"}), 400
 
     try:
-        minor = to_minor(amount)
-    except Exception:
+        minor = to_minor(amount, currency)
+    except InvalidAmount:
         return jsonify({"error": "invalid amount format"}), 400
+    if minor <= 0:
+        return jsonify({"error": "amount must be > 0"}), 400
 
-    # lock sender balance
-    bal_from = db.session.execute(
-        db.select(CurrencyBalance).where(CurrencyBalance.user_id == from_user, CurrencyBalance.currency == currency).with_for_update()
-    ).scalar_one_or_none()
-    if bal_from is None:
+    # debit sender, then credit receiver; each is one conditional UPDATE
+    try:
+        from_balance = ledger.debit(from_user, currency, minor)
+    except ledger.BalanceNotFound:
+        db.session.rollback()
         return jsonify({"error": f"balance not found for user {from_user} currency {currency}"}), 404
-
-    if bal_from.amount < minor:
+    except ledger.InsufficientFunds:
+        db.session.rollback()
         return jsonify({"error": "insufficient_funds"}), 402
 
     # if to_user provided, credit receiver
-    bal_to = None
     if to_user:
-        bal_to = db.session.execute(
-            db.select(CurrencyBalance).where(CurrencyBalance.user_id == to_user, CurrencyBalance.currency == currency).with_for_update()
-        ).scalar_one_or_none()
-        if bal_to is None:
+        try:
+            ledger.credit(to_user, currency, minor)
+        except ledger.BalanceNotFound:
+            db.session.rollback()
             return jsonify({"error": f"receiver balance not found for {currency}"}), 404
 
-    # perform debit / credit
-    bal_from.amount -= minor
-    if bal_to:
-        bal_to.amount += minor
-
     # create transaction record
-    tx = Transaction(
-        from_user_id=from_user,
-        to_user_id=to_user,
-        currency=currency,
-        amount=minor,
-        type="payment",
-        status="completed",
-        details={"description": description},
-    )
-    db.session.add(tx)
-    db.session.commit()
-
-    return jsonify({
+    tx = ledger.post("payment", currency, minor, from_user_id=from_user, to_user_id=to_user, details={"description": description})
+    body = {
         "transaction_id": tx.id,
         "status": tx.status,
-        "new_balance_minor": bal_from.amount,
-        "new_balance_decimal": "%.2f" % (bal_from.amount / 100.0),
-    }), 201
+        "new_balance_minor": from_balance,
+        "new_balance_decimal": format_minor(from_balance, currency),
+    }
+    db.session.commit()
+
+    return jsonify(body), 201
 
 
 @bp.route("/payments/history/<user_id>", methods=["GET"])
 def payment_history(user_id):
     """
-    Get user's transaction history.
+    Get user's transaction history, newest first, one page at a time.
+    query: ?limit=50&cursor=<X-Next-Cursor of the previous page>&archive=1
+    The body is the page; the X-Next-Cursor header is absent on the last page.
+    With archive=1 the pages continue into archived months once the live
+    table runs out.
     """
-    transactions = Transaction.query.filter(
-        (Transaction.from_user_id == user_id) | (Transaction.to_user_id == user_id)
-    ).order_by(Transaction.created_at.desc()).all()
+    try:
+        limit = int(request.args.get("limit", HISTORY_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "invalid limit"}), 400
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+
+    after = None
+    if request.args.get("cursor"):
+        try:
+            after = decode_cursor(request.args["cursor"])
+        except Exception:
+            return jsonify({"error": "invalid cursor"}), 400
+
+    # one ordered, limited scan per side so each uses its (user, created_at)
+    # index, then merge; UNION also drops a self-transfer seen from both sides
+    def side(column):
+        q = db.select(Transaction.id, Transaction.created_at).where(column == user_id)
+        if after is not None:
+            ts, tx_id = after
+            q = q.where(Transaction.created_at <= ts, tuple_(Transaction.created_at, Transaction.id) < (ts, tx_id))
+        return db.select(
+            q.order_by(Transaction.created_at.desc(), Transaction.id.desc()).limit(limit + 1).subquery()
+        )
+
+    page = union(side(Transaction.from_user_id), side(Transaction.to_user_id)).subquery()
+    # sessions.current(): the replica session when this read is routed there
+    transactions = sessions.current().execute(
+        db.select(Transaction)
+        .join(page, Transaction.id == page.c.id)
+        .order_by(page.c.created_at.desc(), page.c.id.desc())
+        .limit(limit + 1)
+    ).scalars().all()
+
+    rows = [{c: getattr(tx, c) for c in HISTORY_FIELDS} for tx in transactions]
+    if len(rows) <= limit and request.args.get("archive") in ("1", "true"):
+        # archived months are all older than anything still live
+        older_than = (rows[-1]["created_at"], rows[-1]["id"]) if rows else after
+        rows += archive.history(user_id, before=older_than, limit=limit + 1 - len(rows))
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
 
     data = []
-    for tx in transactions:
-        data.append({
-            "id": tx.id,
-            "from_user_id": tx.from_user_id,
-            "to_user_id": tx.to_user_id,
-            "currency": tx.currency,
-            "amount": "%.2f" % (tx.amount / 100.0),
-            "type": tx.type,
-            "status": tx.status,
-            "details": tx.details,
-            "created_at": tx.created_at.isoformat(),
-        })
-    return jsonify(data), 200
-
+    for tx in rows:
+        data.append(dict(tx, amount=format_minor(tx["amount"], tx["currency"]), created_at=tx["created_at"].isoformat()))
+    resp = jsonify(data)
+    if has_more:
+        last = rows[-1]
+        resp.headers["X-Next-Cursor"] = encode_cursor(last["created_at"], last["id"])
+    return resp, 200
+
+
+def wallet_balances(user_ids):
+    """{user_id: {currency: amount}}, through the balance cache when it is on."""
+    cache = current_app.extensions["balance_cache"]
+    if cache is None:
+        found = ledger.balances_of_many(user_ids)
+        return {user_id: found.get(user_id, {}) for user_id in user_ids}
+    return cache.get_many(user_ids, ledger.balances_of_many)
+
+def wallet_entries(balances):
+    # hot accounts hold several slots per currency; report the sum
+    return [
+        {"currency": currency, "balance_minor": amount, "balance_decimal": format_minor(amount, currency)}
+        for currency, amount in balances.items()
+    ]
 
 @bp.route("/wallets/<user_id>", methods=["GET"])
 def get_wallets(user_id):
     """
     Get all wallet balances for a user.
     """
-    balances = CurrencyBalance.query.filter_by(user_id=user_id).all()
-    result = []
-    for b in balances:
-        result.append({
-            "currency": b.currency,
-            "balance_minor": b.amount,
-            "balance_decimal": "%.2f" % (b.amount / 100.0),
-        })
-    return jsonify(result), 200
+    return jsonify(wallet_entries(wallet_balances([user_id])[user_id])), 200
+
+
+@bp.route("/wallets/bulk", methods=["POST"])
+def get_wallets_bulk():
+    """
+    Wallet balances of many users at once (back office).
+    body: { "user_ids": ["<uuid>", ...] } (up to 1000)
+    Unknown users map to an empty list.
+    """
+    user_ids = (request.get_json() or {}).get("user_ids")
+    if not isinstance(user_ids, list) or not all(isinstance(u, str) for u in user_ids):
+        return jsonify({"error": "user_ids must be a list of ids"}), 400
+    if len(user_ids) > BULK_WALLETS_MAX:
+        return jsonify({"error": f"at most {BULK_WALLETS_MAX} user_ids"}), 400
+    balances = wallet_balances(user_ids)
+    return jsonify({user_id: wallet_entries(balances[user_id]) for user_id in user_ids}), 200
+
+
+@bp.route("/wallets/<user_id>/summary", methods=["GET"])
+def wallet_summary(user_id):
+    """
+    Monthly money in / out per currency, with a breakdown by transaction type.
+    query: ?from=YYYY-MM&to=YYYY-MM (both inclusive, optional)
+    """
+    since, until = request.args.get("from"), request.args.get("to")
+    for value in (since, until):
+        if value is not None and not MONTH_RE.match(value):
+            return jsonify({"error": "months must look like YYYY-MM"}), 400
+    return jsonify({"user_id": user_id, "months": statements.summary(user_id, since, until)}), 200
 
 from flask import request, jsonify
 
@@ -148,3 +226,25 @@ def create_card():
         "expiry": card.expiry
     }), 201
 
+
+
+CARD_STATUSES = ("active", "frozen", "canceled")
+
+@bp.route("/cards/<card_id>/status", methods=["POST"])
+def set_card_status(card_id):
+    """
+    Freeze, unfreeze or cancel a card.
+    body: { "status": "active" | "frozen" | "canceled" }
+    """
+    data = request.get_json() or {}
+    status = data.get("status")
+    if status not in CARD_STATUSES:
+        return jsonify({"error": "status must be one of " + ", ".join(CARD_STATUSES)}), 400
+
+    card = db.session.get(Card, card_id)
+    if card is None:
+        return jsonify({"error": "card not found"}), 404
+    card.status = status
+    # committing evicts the card from every worker's authorization cache
+    db.session.commit()
+    return jsonify({"id": card.id, "status": card.status}), 200
@@ -1,12 +1,12 @@
-from flask import Blueprint, request, jsonify
-from .. import db
-from ..models import CurrencyBalance, Transaction
-from sqlalchemy.exc import NoResultFound
+import uuid
+
+from flask import Blueprint, current_app, request, jsonify
+from .. import db, fx, ledger
+from ..money import MINOR_UNITS, InvalidAmount, to_minor, to_minor_many
 
 bp = Blueprint("transfer", __name__)
 
-def to_minor(amount_float):
-    return int(round(float(amount_float) * 100))
+MAX_BATCH_LEGS = 1000
 
 @bp.route("/transfer", methods=["POST"])
 def transfer():
@@ -23,36 +23,190 @@ def transfer():
         return jsonify({"error": "from_user_id,to_user_id,currency,amount required"}), 400
 
     try:
-        minor = to_minor(amount)
-    except Exception:
+        minor = to_minor(amount, currency)
+    except InvalidAmount:
         return jsonify({"error": "invalid amount"}), 400
     if minor <= 0:
         return jsonify({"error": "amount must be > 0"}), 400
 
-    # to avoid deadlocks, lock balances in deterministic order by (user_id, currency)
+    # to avoid deadlocks, touch balances in deterministic order by (user_id, currency);
+    # each debit/credit is one conditional UPDATE holding its row lock until commit
     key1 = (from_user, currency)
     key2 = (to_user, currency)
     ordered = sorted([key1, key2], key=lambda k: (k[0], k[1]))
-    # fetch and lock
-    balances = {}
+    debited = False
     for uid, cur in ordered:
-        bal = db.session.execute(
-            db.select(CurrencyBalance).where(CurrencyBalance.user_id == uid, CurrencyBalance.currency == cur).with_for_update()
-        ).scalar_one_or_none()
-        if bal is None:
+        try:
+            if (uid, cur) == key1 and not debited:
+                from_balance = ledger.debit(uid, cur, minor)
+                debited = True
+            else:
+                to_balance = ledger.credit(uid, cur, minor)
+        except ledger.BalanceNotFound:
+            db.session.rollback()
             return jsonify({"error": f"balance not found for user {uid} currency {cur}"}), 404
-        balances[(uid, cur)] = bal
+        except ledger.InsufficientFunds:
+            db.session.rollback()
+            return jsonify({"error": "insufficient_funds"}), 402
+
+    tx = ledger.post("p2p", currency, minor, from_user_id=from_user, to_user_id=to_user)
+    body = {"tx_id": tx.id, "from_new_balance": from_balance, "to_new_balance": to_balance}
+    db.session.commit()
+    return jsonify(body), 200
 
-    b_from = balances[(from_user, currency)]
-    b_to = balances[(to_user, currency)]
 
-    if b_from.amount < minor:
-        return jsonify({"error": "insufficient_funds"}), 402
+@bp.route("/batch", methods=["POST"])
+def transfer_batch():
+    """
+    All-or-nothing batch of transfers in one database transaction.
+    body: { "legs": [ { "from_user_id": "...", "to_user_id": "...", "currency": "USD", "amount": 10.50 }, ... ] }
+    Every touched balance row is locked once, in (user_id, currency) order, and
+    the transaction rows go in with a single bulk insert.
+    """
+    data = request.get_json() or {}
+    legs = data.get("legs")
+    if not isinstance(legs, list) or not legs:
+        return jsonify({"error": "legs required"}), 400
+    if len(legs) > MAX_BATCH_LEGS:
+        return jsonify({"error": f"at most {MAX_BATCH_LEGS} legs per batch"}), 400
+
+    fields = []
+    for i, leg in enumerate(legs):
+        leg = leg if isinstance(leg, dict) else {}
+        from_user = leg.get("from_user_id")
+        to_user = leg.get("to_user_id")
+        currency = leg.get("currency")
+        amount = leg.get("amount")
+        if not from_user or not to_user or not currency or amount is None:
+            return jsonify({"error": "from_user_id,to_user_id,currency,amount required", "leg": i}), 400
+        fields.append((from_user, to_user, currency, amount))
+    try:
+        minors = to_minor_many([(amount, currency) for _, _, currency, amount in fields])
+    except InvalidAmount as e:
+        return jsonify({"error": "invalid amount", "leg": e.index}), 400
+    parsed = []
+    for i, ((from_user, to_user, currency, _), minor) in enumerate(zip(fields, minors)):
+        if minor <= 0:
+            return jsonify({"error": "amount must be > 0", "leg": i}), 400
+        parsed.append((from_user, to_user, currency, minor))
+
+    # lock every touched row once, in the same deterministic order transfer() uses
+    keys = sorted({(f, cur) for f, _, cur, _ in parsed} | {(t, cur) for _, t, cur, _ in parsed})
+    try:
+        balances = ledger.lock_many(keys)
+    except ledger.BalanceNotFound as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 404
+
+    batch_id = str(uuid.uuid4())
+    tx_rows = []
+    for i, (from_user, to_user, currency, minor) in enumerate(parsed):
+        try:
+            balances.debit((from_user, currency), minor)
+        except ledger.InsufficientFunds:
+            db.session.rollback()
+            return jsonify({"error": "insufficient_funds", "leg": i}), 402
+        balances.credit((to_user, currency), minor)
+        tx_rows.append({
+            "id": str(uuid.uuid4()),
+            "from_user_id": from_user,
+            "to_user_id": to_user,
+            "currency": currency,
+            "amount": minor,
+            "type": "p2p",
+            "details": {"batch_id": batch_id, "leg": i},
+        })
 
-    b_from.amount = b_from.amount - minor
-    b_to.amount = b_to.amount + minor
+    new_balances = [
+        {"user_id": uid, "currency": cur, "balance_minor": balances.total((uid, cur))} for uid, cur in keys
+    ]
+    ledger.post_many(tx_rows)
+    db.session.commit()
+    return jsonify({"batch_id": batch_id, "tx_ids": [r["id"] for r in tx_rows], "balances": new_balances}), 200
+
+
+@bp.route("/rates", methods=["GET"])
+def rates():
+    """The current exchange rate snapshot: { "version": 3, "rates": { "USD/LBP": "89500" } }"""
+    try:
+        snapshot = current_app.extensions["rates"].current()
+    except fx.RatesUnavailable as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    return jsonify(snapshot.as_dict()), 200
+
+
+@bp.route("/exchange", methods=["POST"])
+def exchange():
+    """
+    Convert between a user's own currency balances at the current rate.
+    body: { "user_id": "...", "from_currency": "USD", "to_currency": "LBP", "amount": 10.50, "rate_version": 3 }
+    `rate_version` (optional) is the snapshot version the client quoted; a
+    newer snapshot answers 409 with the current rate instead of converting.
+    The credited amount is rounded down to whole minor units.
+    """
+    data = request.get_json() or {}
+    user_id = data.get("user_id")
+    src = data.get("from_currency")
+    dst = data.get("to_currency")
+    amount = data.get("amount")
+    if not user_id or not src or not dst or amount is None:
+        return jsonify({"error": "user_id,from_currency,to_currency,amount required"}), 400
+    if src not in MINOR_UNITS or dst not in MINOR_UNITS or src == dst:
+        return jsonify({"error": "unsupported currency pair"}), 400
+    try:
+        minor = to_minor(amount, src)
+    except InvalidAmount:
+        return jsonify({"error": "invalid amount"}), 400
+    if minor <= 0:
+        return jsonify({"error": "amount must be > 0"}), 400
+    quoted = data.get("rate_version")
+    if quoted is not None:
+        # 3 or "3"; str() first so 3.5 and true are refused rather than truncated
+        try:
+            quoted = int(str(quoted))
+        except ValueError:
+            return jsonify({"error": "rate_version must be an integer"}), 400
+
+    try:
+        snapshot = current_app.extensions["rates"].current()
+    except fx.RatesUnavailable as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    rate = snapshot.rate(src, dst)
+    if rate is None:
+        return jsonify({"error": f"no rate for {src}/{dst}"}), 503, {"Retry-After": "5"}
+    if quoted is not None and quoted != snapshot.version:
+        return jsonify({"error": "rate_changed", "rate_version": snapshot.version,
+                        "rate": fx.format_rate(rate)}), 409
+    credited = fx.convert(minor, rate, MINOR_UNITS[src], MINOR_UNITS[dst])
+    if credited <= 0:
+        return jsonify({"error": "amount too small to convert"}), 400
+
+    # both legs under one ordered lock, like a batch transfer
+    src_key, dst_key = (user_id, src), (user_id, dst)
+    try:
+        balances = ledger.lock_many(sorted([src_key, dst_key]))
+        balances.debit(src_key, minor)
+    except ledger.BalanceNotFound as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 404
+    except ledger.InsufficientFunds:
+        db.session.rollback()
+        return jsonify({"error": "insufficient_funds"}), 402
+    balances.credit(dst_key, credited)
 
-    tx = Transaction(from_user_id=from_user, to_user_id=to_user, currency=currency, amount=minor, type="p2p", status="completed", metadata={})
-    db.session.add(tx)
+    exchange_id = str(uuid.uuid4())
+    details = {"exchange_id": exchange_id, "rate": fx.format_rate(rate), "rate_version": snapshot.version}
+    ledger.post_many([
+        {"id": str(uuid.uuid4()), "from_user_id": user_id, "to_user_id": None, "currency": src,
+         "amount": minor, "type": "exchange_out", "details": details},
+        {"id": str(uuid.uuid4()), "from_user_id": None, "to_user_id": user_id, "currency": dst,
+         "amount": credited, "type": "exchange_in", "details": details},
+    ])
+    body = {
+        "exchange_id": exchange_id,
+        "rate_version": snapshot.version,
+        "debited": {"currency": src, "amount_minor": minor, "balance_minor": balances.total(src_key)},
+        "credited": {"currency": dst, "amount_minor": credited, "balance_minor": balances.total(dst_key)},
+    }
     db.session.commit()
-    return jsonify({"tx_id": tx.id, "from_new_balance": b_from.amount, "to_new_balance": b_to.amount}), 200
+    return jsonify(body), 200
@@ -1,139 +1,238 @@
-from flask import Blueprint, request, jsonify
-from .. import db
-from ..models import Card, CardAuthRequest, CurrencyBalance, Transaction
-from datetime import datetime
+from flask import Blueprint, request, jsonify, current_app
+from .. import fx, ledger, metrics, sessions
+from ..money import MINOR_UNITS, InvalidAmount, to_minor
+from ..models import Card, CardAuthRequest
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 
 bp = Blueprint("webhook", __name__)
 
 CURRENCY_MAP = {"840": "USD", "422": "LBP"}  # 840 USD, 422 LB
-MINOR_UNITS = {"USD": 2, "LBP": 2}  # using 2 decimals for simplicity
-
-def parse_minor(amount_str, currency="USD"):
-    # amount_str like "27.50" -> minor units int
-    return int(round(float(amount_str) * (10 ** MINOR_UNITS.get(currency, 2))))
+ISO_CODES = {cur: code for code, cur in CURRENCY_MAP.items()}
+
+# the additionalAmounts balance entry per ISO currency code, worked out once
+# instead of two map lookups and a str() per response
+def _balance_layout(code):
+    return {
+        "accountType": "00",
+        "amountType": "02",
+        "currencyCode": code,
+        "currencyMinorUnit": str(MINOR_UNITS.get(CURRENCY_MAP.get(code, "USD"), 2)),
+        "amountSign": "C",
+    }
 
-def build_response_template(req, action_code, approval_code, new_balance_minor):
-    # required fields per spec
-    tpl = {
+BALANCE_LAYOUTS = {code: _balance_layout(code) for code in CURRENCY_MAP}
+
+def build_response_template(req, action_code, approval_code, new_balance_minor, balance_currency=None):
+    # required fields per spec; the balance is in the request currency unless
+    # a cross-currency authorization debited another one
+    get = req.get
+    balance_code = ISO_CODES[balance_currency] if balance_currency else get("currencyCode", "840")
+    layout = BALANCE_LAYOUTS.get(balance_code)
+    balance = layout.copy() if layout else _balance_layout(balance_code)
+    balance["value"] = str(new_balance_minor).rjust(12, "0")
+    # one dict display: the fields are fixed, so a literal beats any loop
+    return {
         "messageType": "2110",
-        "primaryAccountNumber": req.get("primaryAccountNumber"),
-        "processingCode": req.get("processingCode"),
-        "amountTransaction": req.get("amountTransaction"),
-        "amountCardholderBilling": req.get("amountCardholderBilling"),
-        "dateAndTimeTransmission": req.get("dateAndTimeTransmission"),
-        "conversionRateCardholderBilling": req.get("conversionRateCardholderBilling"),
-        "systemsTraceAuditNumber": req.get("systemsTraceAuditNumber"),
-        "dateCapture": req.get("dateCapture"),
-        "merchantCategoryCode": req.get("merchantCategoryCode"),
-        "acquiringInstitutionIdentificationCode": req.get("acquiringInstitutionIdentificationCode"),
-        "retrievalReferenceNumber": req.get("retrievalReferenceNumber"),
-        "cardAcceptorTerminalIdentification": req.get("cardAcceptorTerminalIdentification"),
-        "cardAcceptorIdentificationCode": req.get("cardAcceptorIdentificationCode"),
-        "cardAcceptorName": req.get("cardAcceptorName"),
-        "cardAcceptorCity": req.get("cardAcceptorCity"),
-        "cardAcceptorCountryCode": req.get("cardAcceptorCountryCode"),
-        "posDataCode": req.get("posDataCode"),
-        "cardExpiry": req.get("cardExpiry"),
+        "primaryAccountNumber": get("primaryAccountNumber"),
+        "processingCode": get("processingCode"),
+        "amountTransaction": get("amountTransaction"),
+        "amountCardholderBilling": get("amountCardholderBilling"),
+        "dateAndTimeTransmission": get("dateAndTimeTransmission"),
+        "conversionRateCardholderBilling": get("conversionRateCardholderBilling"),
+        "systemsTraceAuditNumber": get("systemsTraceAuditNumber"),
+        "dateCapture": get("dateCapture"),
+        "merchantCategoryCode": get("merchantCategoryCode"),
+        "acquiringInstitutionIdentificationCode": get("acquiringInstitutionIdentificationCode"),
+        "retrievalReferenceNumber": get("retrievalReferenceNumber"),
+        "cardAcceptorTerminalIdentification": get("cardAcceptorTerminalIdentification"),
+        "cardAcceptorIdentificationCode": get("cardAcceptorIdentificationCode"),
+        "cardAcceptorName": get("cardAcceptorName"),
+        "cardAcceptorCity": get("cardAcceptorCity"),
+        "cardAcceptorCountryCode": get("cardAcceptorCountryCode"),
+        "posDataCode": get("posDataCode"),
+        "cardExpiry": get("cardExpiry"),
         "actionCode": action_code,
         "approvalCode": approval_code,
-        "additionalAmounts": [
-            {
-                "accountType": "00",
-                "amountType": "02",
-                "currencyCode": req.get("currencyCode", "840"),
-                "currencyMinorUnit": str(MINOR_UNITS.get(CURRENCY_MAP.get(req.get("currencyCode","840"), "USD"), 2)),
-                "amountSign": "C",
-                "value": str(new_balance_minor).rjust(12, "0")
-            }
-        ]
+        "additionalAmounts": [balance],
     }
-    return tpl
 
-@bp.route("/webhook/authorize", methods=["POST"])
-def authorize():
-    req = request.get_json() or {}
-    idem = req.get("idempotency_key")
-    if not idem:
-        return jsonify({"error": "idempotency_key required"}), 400
-
-    # return existing if processed
-    existing = db.session.query(CardAuthRequest).filter_by(idempotency_key=idem).first()
-    if existing:
-        return jsonify(existing.response_payload), 200
-
-    # parse basic fields
-    pan = req.get("primaryAccountNumber")
-    amount_str = req.get("amountTransaction")
-    currency_code = req.get("currencyCode", "840")
-    currency = CURRENCY_MAP.get(currency_code, "USD")
-    txn_ref = req.get("txn_ref")
+# compact storage (IDEMPOTENCY_COMPACT_RESPONSES): a 2110 response mostly
+# echoes the request it answers, so only the fields that differ are stored
+RESPONSE_FIELDS = tuple(build_response_template({}, "", "", 0))
+ECHO_FIELDS = frozenset(RESPONSE_FIELDS[1:-3])
+COMPACT_MARKER = "~echo"
+
+def compact_response(resp, req):
+    if tuple(resp) != RESPONSE_FIELDS:
+        return resp
+    out = {COMPACT_MARKER: 1}
+    for field, value in resp.items():
+        if field not in ECHO_FIELDS or value != req.get(field):
+            out[field] = value
+    return out
+
+def expand_response(stored, req):
+    """The response `compact_response` stored; full payloads pass through."""
+    if COMPACT_MARKER not in stored:
+        return stored
+    return {field: stored[field] if field in stored else req.get(field) for field in RESPONSE_FIELDS}
+
+def precheck(req, card):
+    """
+    Everything decided before the balance is touched. `card` is a Card or
+    CardInfo (or None). Returns (action_code, currency, amount_minor) where
+    action_code is None when the authorization may go on to the debit.
+    """
+    currency = CURRENCY_MAP.get(req.get("currencyCode", "840"), "USD")
 
     # find card by masked PAN
-    card = db.session.query(Card).filter_by(pan_masked=pan).first()
     if not card:
-        resp = build_response_template(req, action_code="05", approval_code="000000", new_balance_minor=0)
-        # store record
-        record = CardAuthRequest(idempotency_key=idem, request_payload=req, response_payload=resp)
-        db.session.add(record)
-        db.session.commit()
-        return jsonify(resp), 200
-
+        return "05", currency, None
     if card.status != "active":
-        resp = build_response_template(req, action_code="57", approval_code="000000", new_balance_minor=0)
-        record = CardAuthRequest(idempotency_key=idem, request_payload=req, response_payload=resp)
-        db.session.add(record); db.session.commit()
-        return jsonify(resp), 200
+        return "57", currency, None
 
     # E-commerce checks
     ecom = req.get("ecom")
     if ecom:
         # sample policy: require 3DS frictionless and AVS Y to approve
         if ecom.get("three_ds") != "frictionless" or ecom.get("avs_result") != "Y":
-            resp = build_response_template(req, action_code="05", approval_code="000000", new_balance_minor=0)
-            record = CardAuthRequest(idempotency_key=idem, request_payload=req, response_payload=resp)
-            db.session.add(record); db.session.commit()
-            return jsonify(resp), 200
+            return "05", currency, None
 
     # parse amount
     try:
-        amount_minor = parse_minor(amount_str, currency)
-    except Exception:
-        resp = build_response_template(req, action_code="05", approval_code="000000", new_balance_minor=0)
-        record = CardAuthRequest(idempotency_key=idem, request_payload=req, response_payload=resp)
-        db.session.add(record); db.session.commit()
-        return jsonify(resp), 200
-
+        amount_minor = to_minor(req.get("amountTransaction"), currency)
+    except InvalidAmount:
+        return "05", currency, None
     if amount_minor <= 0:
-        resp = build_response_template(req, action_code="05", approval_code="000000", new_balance_minor=0)
-        record = CardAuthRequest(idempotency_key=idem, request_payload=req, response_payload=resp)
-        db.session.add(record); db.session.commit()
-        return jsonify(resp), 200
-
-    # attempt to debit under transaction and lock balance
-    bal = db.session.execute(
-        db.select(CurrencyBalance).where(CurrencyBalance.user_id == card.user_id, CurrencyBalance.currency == currency).with_for_update()
-    ).scalar_one_or_none()
-    if bal is None:
-        resp = build_response_template(req, action_code="05", approval_code="000000", new_balance_minor=0)
-        record = CardAuthRequest(idempotency_key=idem, request_payload=req, response_payload=resp)
-        db.session.add(record); db.session.commit()
-        return jsonify(resp), 200
-
-    if bal.amount < amount_minor:
-        resp = build_response_template(req, action_code="51", approval_code="000000", new_balance_minor=bal.amount)
-        record = CardAuthRequest(idempotency_key=idem, request_payload=req, response_payload=resp)
-        db.session.add(record); db.session.commit()
-        return jsonify(resp), 200
-
-    # debit and create transaction
-    bal.amount = bal.amount - amount_minor
-    tx = Transaction(from_user_id=card.user_id, to_user_id=None, currency=currency, amount=amount_minor, type="card_payment", status="completed", metadata={"txn_ref": txn_ref})
-    db.session.add(tx)
-    db.session.flush()  # get tx.id
+        return "05", currency, None
+
+    return None, currency, amount_minor
+
+def _load_card(pan):
+    return sessions.current().query(Card).filter_by(pan_masked=pan).first()
+
+def lookup_card(pan):
+    return current_app.extensions["card_cache"].lookup(pan, _load_card)
+
+def store_response(record, resp):
+    if current_app.config["IDEMPOTENCY_COMPACT_RESPONSES"]:
+        record.response_payload = compact_response(resp, record.request_payload)
+    else:
+        record.response_payload = resp
+
+def publish_response(key, resp):
+    # only once the claim holding `resp` is committed
+    current_app.extensions["idempotency_cache"].set(key, resp)
+    metrics.authorization_outcome(resp["actionCode"])
+
+def _finish(record, resp):
+    # store the response on the claimed record and publish it to the cache
+    store_response(record, resp)
+    key = record.idempotency_key  # read before commit expires the record
+    sessions.current().commit()
+    publish_response(key, resp)
+    return resp, 200
+
+def replay_stored(idem):
+    """(body, status) for a key someone else claimed: its stored response, or 409 while it is open."""
+    existing = sessions.current().execute(
+        select(CardAuthRequest.request_payload, CardAuthRequest.response_payload)
+        .where(CardAuthRequest.idempotency_key == idem)
+    ).first()
+    if existing is None or not existing.response_payload:
+        return {"error": "authorization in progress"}, 409
+    resp = expand_response(existing.response_payload, existing.request_payload)
+    current_app.extensions["idempotency_cache"].set(idem, resp)
+    return resp, 200
+
+def decide(req, card):
+    """
+    Prechecks, debit and transaction for a request whose key is claimed.
+    Returns the 2110 response; committing is up to the caller.
+    """
+    # card, status, e-commerce and amount checks
+    action_code, currency, amount_minor = precheck(req, card)
+    if action_code is not None:
+        return build_response_template(req, action_code=action_code, approval_code="000000", new_balance_minor=0)
+
+    # debit in one conditional UPDATE; the funds check is part of the statement.
+    # With AUTH_CROSS_CURRENCY a missing or short balance may be covered from
+    # the user's other currency at the current rate snapshot.
+    snapshot = None
+    if current_app.config["AUTH_CROSS_CURRENCY"]:
+        try:
+            snapshot = current_app.extensions["rates"].current()
+        except fx.RatesUnavailable:
+            snapshot = None
+    debit_currency, debit_minor, rate = currency, amount_minor, None
+    try:
+        if snapshot is not None:
+            debit_currency, debit_minor, balance, rate = fx.debit_with_fallback(
+                card.user_id, currency, amount_minor, snapshot, MINOR_UNITS
+            )
+        else:
+            balance = ledger.debit(card.user_id, currency, amount_minor)
+    except ledger.BalanceNotFound:
+        return build_response_template(req, action_code="05", approval_code="000000", new_balance_minor=0)
+    except ledger.InsufficientFunds as e:
+        return build_response_template(req, action_code="51", approval_code="000000", new_balance_minor=e.balance)
+
+    # create transaction
+    details = {"txn_ref": req.get("txn_ref")}
+    if rate is not None:
+        details["fx"] = {"currency": currency, "amount": amount_minor, "rate": fx.format_rate(rate), "rate_version": snapshot.version}
+    tx = ledger.post("card_payment", debit_currency, debit_minor, from_user_id=card.user_id, details=details)
 
     approval_code = tx.id[:6] if isinstance(tx.id, str) else "000000"
-    resp = build_response_template(req, action_code="00", approval_code=approval_code, new_balance_minor=bal.amount)
-    record = CardAuthRequest(idempotency_key=idem, request_payload=req, response_payload=resp)
-    db.session.add(record)
-    db.session.commit()
-    return jsonify(resp), 200
+    return build_response_template(req, action_code="00", approval_code=approval_code, new_balance_minor=balance,
+                                   balance_currency=debit_currency if rate is not None else None)
+
+def process_authorization(req):
+    """
+    The authorization flow, returning (body, status). Runs against
+    sessions.current(), so the sync view and the async path share it.
+    """
+    session = sessions.current()
+    idem = req.get("idempotency_key")
+    if not idem:
+        return {"error": "idempotency_key required"}, 400
+
+    # return existing if processed recently by this worker
+    cached = current_app.extensions["idempotency_cache"].get(idem)
+    if cached is not None:
+        return cached, 200
+
+    # claim the key before doing any work. A concurrent duplicate blocks on the
+    # unique index until we commit, then fails here and replays our response.
+    record = CardAuthRequest(idempotency_key=idem, request_payload=req, response_payload={})
+    session.add(record)
+    try:
+        session.flush()
+    except IntegrityError:
+        session.rollback()
+        return replay_stored(idem)
+
+    return _finish(record, decide(req, lookup_card(req.get("primaryAccountNumber"))))
+
+@bp.route("/webhook/authorize", methods=["POST"])
+def authorize():
+    req = request.get_json() or {}
+    # AUTH_GROUP_COMMIT=1: coalesced with concurrent authorizations (app/group_commit.py)
+    batcher = current_app.extensions.get("auth_group_commit")
+    if batcher is not None:
+        body, status = batcher.submit(req)
+    else:
+        body, status = process_authorization(req)
+    return jsonify(body), status
+
+
+@bp.route("/webhook/stats", methods=["GET"])
+def idempotency_stats():
+    """Hit/miss counters of this worker's idempotency, card and balance caches."""
+    balance_cache = current_app.extensions["balance_cache"]
+    return jsonify({
+        "idempotency_cache": current_app.extensions["idempotency_cache"].stats(),
+        "card_cache": current_app.extensions["card_cache"].stats(),
+        "balance_cache": balance_cache.stats() if balance_cache is not None else None,
+    }), 200
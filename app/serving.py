@@ -0,0 +1,166 @@
+"""
+Production serving: `flask --app manage.py serve` runs the app under gunicorn
+(optional dependency) with --workers processes of --threads threads each.
+
+The app is built and warmed once, in the master, before the workers fork:
+mappers are configured, the schema is checked against the models, the hot
+read paths run once so their compiled SQL sits in the engine's statement
+cache, and the newest cards are loaded into the card cache. Workers inherit
+all of it. The master then disposes its pools, and every worker disposes
+the inherited engines again right after fork (close=False: a socket opened
+before the fork is never used by two processes). Before a worker accepts its
+first request it opens a connection per thread and loads the exchange rate
+snapshot, so the first requests after a deploy don't pay for any of that.
+"""
+
+import logging
+import os
+import uuid
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import configure_mappers
+
+from . import db, fx
+from .models import Card
+
+log = logging.getLogger(__name__)
+
+WARM_CARDS = 10000
+# read endpoints run once in the master: (endpoint, query string)
+WARM_READS = (
+    ("payments.get_wallets", ""),
+    ("payments.payment_history", "limit=1"),
+    ("payments.wallet_summary", ""),
+)
+
+
+class SchemaNotMigrated(RuntimeError):
+    pass
+
+
+def engines(app):
+    """Every engine this app opens connections on."""
+    with app.app_context():
+        found = list(db.engines.values())
+    replica = app.extensions.get("replica")
+    if replica is not None:
+        found.append(replica.engine)
+    return found
+
+
+def check_schema(app):
+    """Raise SchemaNotMigrated when a model's table is missing from the database."""
+    with app.app_context():
+        existing = set(inspect(db.engine).get_table_names())
+    missing = sorted(set(db.metadata.tables) - existing)
+    if missing:
+        raise SchemaNotMigrated("tables missing (run flask db upgrade): " + ", ".join(missing))
+
+
+def warm_cards(app, limit=WARM_CARDS):
+    """Load the `limit` newest cards into the card cache; returns how many."""
+    cache = app.extensions["card_cache"]
+    with app.app_context():
+        cards = db.session.execute(
+            db.select(Card).order_by(Card.created_at.desc()).limit(limit)
+        ).scalars().all()
+        for card in cards:
+            _, gen = cache.peek(card.pan_masked)
+            cache.store(card.pan_masked, card, gen)
+        db.session.remove()
+    return len(cards)
+
+
+def warm_reads(app):
+    # view functions called directly: no before_request hooks, so nothing
+    # starts a background thread in the master. A sample read that fails
+    # only costs its warm-up, so it is logged rather than stopping startup.
+    user_id = str(uuid.uuid4())
+    for endpoint, query in WARM_READS:
+        with app.test_request_context(query_string=query):
+            try:
+                app.view_functions[endpoint](user_id=user_id)
+            except Exception:
+                log.exception("warm-up read %s failed", endpoint)
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+
+def prepare(app, cards=WARM_CARDS):
+    """Master-side warm-up before forking; returns what was done."""
+    configure_mappers()
+    check_schema(app)
+    warm_reads(app)
+    warmed = warm_cards(app, cards) if cards else 0
+    for engine in engines(app):
+        engine.dispose()
+    return {"cards": warmed}
+
+
+def after_fork(app):
+    for engine in engines(app):
+        engine.dispose(close=False)
+
+
+def warm_worker(app, connections):
+    """
+    Open up to `connections` pooled connections at once (capped by the pool)
+    and load the rate snapshot. Returns how many connections were opened.
+    """
+    engine = engines(app)[0]
+    capacity = getattr(engine.pool, "size", lambda: connections)()
+    opened = []
+    try:
+        for _ in range(min(connections, capacity)):
+            conn = engine.connect()
+            conn.exec_driver_sql("SELECT 1")
+            opened.append(conn)
+    finally:
+        for conn in opened:
+            conn.close()
+    if capacity < connections:
+        log.warning("pool size %d is below %d threads; raise DB_POOL_SIZE", capacity, connections)
+    with app.app_context():
+        try:
+            app.extensions["rates"].current()
+        except fx.RatesUnavailable:
+            log.warning("exchange rates unavailable at warm-up")
+        finally:
+            db.session.remove()
+    return len(opened)
+
+
+def default_workers():
+    return int(os.getenv("WEB_CONCURRENCY", 2 * (os.cpu_count() or 1) + 1))
+
+
+def run(app, bind, workers, threads, timeout=30, cards=WARM_CARDS):
+    """Warm up, then serve with gunicorn until it exits."""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise RuntimeError("serving needs gunicorn: pip install gunicorn") from None
+
+    report = prepare(app, cards)
+    log.info("warmed up: %d card(s) cached", report["cards"])
+    options = {
+        "bind": bind,
+        "workers": workers,
+        "threads": threads,
+        "worker_class": "gthread",
+        "preload_app": True,
+        "timeout": timeout,
+        "post_fork": lambda server, worker: after_fork(app),
+        "post_worker_init": lambda worker: warm_worker(app, threads),
+    }
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    Server().run()
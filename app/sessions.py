@@ -0,0 +1,37 @@
+"""
+The session ledger code runs against.
+
+Request handlers use Flask-SQLAlchemy's `db.session`. The async authorize
+path (app/asgi.py) runs the same code inside `AsyncSession.run_sync()` and
+swaps in that session with `using()`. Request hooks that route a whole
+request elsewhere (app/replica.py) use `push()` / `pop()`.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from . import db
+
+_override = ContextVar("ledger_session", default=None)
+
+
+def current():
+    return _override.get() or db.session
+
+
+@contextmanager
+def using(session):
+    token = _override.set(session)
+    try:
+        yield session
+    finally:
+        _override.reset(token)
+
+
+def push(session):
+    """Make `session` current until `pop(token)`."""
+    return _override.set(session)
+
+
+def pop(token):
+    _override.reset(token)
@@ -0,0 +1,168 @@
+"""
+Monthly statement rollups.
+
+`record()` is called by `ledger.post()` / `post_many()` for every new
+transaction and upserts one `MonthlyStatement` row per user side (money out
+of `from_user_id`, money in to `to_user_id`) in the same database
+transaction, so a summary never disagrees with the committed transactions.
+
+`rebuild()` recomputes the rollups from raw transactions, either to repair
+them or (with verify=True) only to report differences. Months that were
+archived out of the live table are left alone.
+"""
+
+import random
+from collections import defaultdict
+
+from flask import current_app
+from sqlalchemy import delete, func, literal, select, union_all
+
+from . import db, sessions
+from .models import MonthlyStatement, Transaction
+
+_ms = MonthlyStatement.__table__
+KEY = ("user_id", "month", "currency", "type", "direction", "shard")
+
+
+def _dialect_insert(session):
+    name = session.get_bind().dialect.name
+    if name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert
+
+
+def _shard():
+    shards = current_app.config.get("STATEMENT_SHARDS", 1)
+    return random.randrange(shards) if shards > 1 else 0
+
+
+def record(txs):
+    """Add transaction dicts (from/to user, currency, amount, type, created_at) to the rollups."""
+    deltas = defaultdict(lambda: [0, 0])
+    shard = _shard()
+    for tx in txs:
+        month = tx["created_at"].strftime("%Y-%m")
+        for user_id, direction in ((tx.get("from_user_id"), "out"), (tx.get("to_user_id"), "in")):
+            if user_id:
+                d = deltas[(user_id, month, tx["currency"], tx["type"], direction, shard)]
+                d[0] += tx["amount"]
+                d[1] += 1
+    if not deltas:
+        return
+    # sorted, so concurrent multi-row upserts lock rows in the same order
+    rows = [dict(zip(KEY, key), amount=a, count=n) for key, (a, n) in sorted(deltas.items())]
+    session = sessions.current()
+    insert = _dialect_insert(session)
+    if insert is None:
+        for row in rows:
+            where = [_ms.c[k] == row[k] for k in KEY]
+            updated = session.execute(
+                _ms.update().where(*where).values(amount=_ms.c.amount + row["amount"], count=_ms.c["count"] + row["count"])
+            ).rowcount
+            if not updated:
+                session.execute(_ms.insert().values(**row))
+        return
+    stmt = insert(_ms).values(rows)
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=list(KEY),
+        set_={"amount": _ms.c.amount + stmt.excluded.amount, "count": _ms.c["count"] + stmt.excluded["count"]},
+    ))
+
+
+def summary(user_id, since=None, until=None):
+    """
+    [{month, currency, in, out, by_type: {type: {in, out, count}}}] newest
+    month first; `since` / `until` are inclusive "YYYY-MM" bounds.
+    """
+    q = (
+        select(_ms.c.month, _ms.c.currency, _ms.c.type, _ms.c.direction,
+               func.sum(_ms.c.amount), func.sum(_ms.c["count"]))
+        .where(_ms.c.user_id == user_id)
+        .group_by(_ms.c.month, _ms.c.currency, _ms.c.type, _ms.c.direction)
+    )
+    if since:
+        q = q.where(_ms.c.month >= since)
+    if until:
+        q = q.where(_ms.c.month <= until)
+    months = {}
+    for month, currency, type, direction, amount, count in sessions.current().execute(q):
+        entry = months.setdefault((month, currency), {
+            "month": month, "currency": currency, "in": 0, "out": 0, "by_type": {},
+        })
+        entry[direction] += int(amount)
+        by_type = entry["by_type"].setdefault(type, {"in": 0, "out": 0, "count": 0})
+        by_type[direction] += int(amount)
+        by_type["count"] += int(count)
+    ordered = sorted(months.values(), key=lambda e: e["currency"])
+    return sorted(ordered, key=lambda e: e["month"], reverse=True)
+
+
+def _month_of(column):
+    if db.session.get_bind().dialect.name == "postgresql":
+        return func.to_char(column, "YYYY-MM")
+    return func.strftime("%Y-%m", column)
+
+
+def computed(user_id=None, since=None):
+    """{key without shard: (amount, count)} straight from the transactions table."""
+    t = Transaction.__table__
+    month = _month_of(t.c.created_at)
+    sides = []
+    for column, direction in ((t.c.from_user_id, "out"), (t.c.to_user_id, "in")):
+        q = select(
+            column.label("user_id"), month.label("month"), t.c.currency, t.c.type,
+            literal(direction).label("direction"), t.c.amount,
+        ).where(column.isnot(None), t.c.created_at.isnot(None))
+        if user_id:
+            q = q.where(column == user_id)
+        sides.append(q)
+    rows = union_all(*sides).subquery()
+    q = select(rows.c.user_id, rows.c.month, rows.c.currency, rows.c.type, rows.c.direction,
+               func.sum(rows.c.amount), func.count()).group_by(
+        rows.c.user_id, rows.c.month, rows.c.currency, rows.c.type, rows.c.direction)
+    if since:
+        q = q.where(rows.c.month >= since)
+    return {tuple(r[:5]): (int(r[5]), int(r[6])) for r in db.session.execute(q)}
+
+
+def stored(user_id=None, since=None):
+    q = select(_ms.c.user_id, _ms.c.month, _ms.c.currency, _ms.c.type, _ms.c.direction,
+               func.sum(_ms.c.amount), func.sum(_ms.c["count"])).group_by(
+        _ms.c.user_id, _ms.c.month, _ms.c.currency, _ms.c.type, _ms.c.direction)
+    if user_id:
+        q = q.where(_ms.c.user_id == user_id)
+    if since:
+        q = q.where(_ms.c.month >= since)
+    return {tuple(r[:5]): (int(r[5]), int(r[6])) for r in db.session.execute(q)}
+
+
+def rebuild(user_id=None, since=None, verify=False):
+    """
+    Compare the rollups with the transactions from `since` ("YYYY-MM", default:
+    the oldest live month) and, unless `verify`, rewrite the ones that differ.
+    Returns the differing keys as {key: (stored, computed)}.
+    """
+    if since is None:
+        oldest = db.session.execute(select(func.min(Transaction.created_at))).scalar()
+        if oldest is None:
+            return {}
+        since = oldest.strftime("%Y-%m")
+    want = computed(user_id, since)
+    have = stored(user_id, since)
+    diff = {k: (have.get(k), want.get(k)) for k in want.keys() | have.keys() if have.get(k) != want.get(k)}
+    if verify or not diff:
+        return diff
+    for user, month, currency, type, direction in diff:
+        db.session.execute(delete(_ms).where(
+            _ms.c.user_id == user, _ms.c.month == month, _ms.c.currency == currency,
+            _ms.c.type == type, _ms.c.direction == direction,
+        ))
+    rows = [dict(zip(KEY, k + (0,)), amount=want[k][0], count=want[k][1]) for k in sorted(diff) if k in want]
+    if rows:
+        db.session.execute(_ms.insert(), rows)
+    db.session.commit()
+    return diff
@@ -0,0 +1,8 @@
+"""
+Load and latency benchmarks for the wallet endpoints.
+
+Run:
+    python -m bench.run --db sqlite --clients 8 --requests 200
+    python -m bench.run --db postgres --save-baseline bench_baseline.json
+    python -m bench.run --db postgres --baseline bench_baseline.json
+"""
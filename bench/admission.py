@@ -0,0 +1,85 @@
+"""
+Admission control under a read flood: authorizations against wallet and
+history reads, without and with ADMISSION_LIMIT.
+
+    python -m bench.admission --db postgres --readers 64 --authorizers 8 --limit 16
+    python -m bench.admission --limit 8 --queue-ms critical:1000,normal:500,low:50
+
+Both runs send the same traffic. With the limiter on, reads are shed with
+503 once they would eat into the reserved slots, so the authorize row should
+keep its latency while the readers row shows errors instead of queueing.
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+
+from . import harness
+from .run import make_app, print_table
+from .scenarios import authorize, build_fixture
+
+
+def readers(fx):
+    def call(client, worker, i):
+        user_id = random.Random(worker * 1_000_003 + i).choice(fx.user_ids)
+        if i % 2:
+            return client.get(f"/api/payments/payments/history/{user_id}?limit=50")
+        return client.get(f"/api/payments/wallets/{user_id}")
+    return call
+
+
+def run_mixed(app, label, args):
+    fx = build_fixture(app, args.accounts)
+    results = {}
+
+    def run(name, call, clients):
+        results[name] = harness.run_concurrent(app, name, call, clients, args.requests)
+
+    threads = [
+        threading.Thread(target=run, args=(f"{label}:read", readers(fx), args.readers)),
+        threading.Thread(target=run, args=(f"{label}:auth", authorize(fx), args.authorizers)),
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--db", default="sqlite")
+    p.add_argument("--readers", type=int, default=32, help="clients polling wallets and history")
+    p.add_argument("--authorizers", type=int, default=4)
+    p.add_argument("--requests", type=int, default=50, help="requests per client")
+    p.add_argument("--accounts", type=int, default=50)
+    p.add_argument("--limit", type=int, default=8, help="ADMISSION_LIMIT for the second run")
+    p.add_argument("--queue-ms", default=None, help="ADMISSION_QUEUE_MS for the second run")
+    args = p.parse_args(argv)
+
+    url = harness.database_url(args.db)
+    counters = harness.LockCounters()
+    counters.install()
+    results = {}
+    try:
+        for label, limit in (("off", 0), (f"limit{args.limit}", args.limit)):
+            os.environ["ADMISSION_LIMIT"] = str(limit)
+            if args.queue_ms:
+                os.environ["ADMISSION_QUEUE_MS"] = args.queue_ms
+            for name, r in run_mixed(make_app(url), label, args).items():
+                r.update(counters.for_endpoint(name))
+                results[name] = r
+    finally:
+        counters.uninstall()
+        os.environ.pop("ADMISSION_LIMIT", None)
+        os.environ.pop("ADMISSION_QUEUE_MS", None)
+        if args.db == "sqlite":
+            os.unlink(url[len("sqlite:///"):])
+    print_table(results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
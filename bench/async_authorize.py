@@ -0,0 +1,107 @@
+"""
+Concurrent authorizations per worker: the threaded Flask view against the
+ASGI path on one event loop.
+
+    python -m bench.async_authorize --db postgres --clients 64 --requests 50
+
+Both sides run in this single process. The sync side uses one thread per
+client (what a threaded worker does); the async side runs every client as a
+task on one event loop sharing an async connection pool.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+from app.asgi import AUTHORIZE_PATH, create_asgi_app
+
+from . import harness
+from .run import make_app, print_table
+from .scenarios import authorization_payload, authorize, build_fixture
+
+
+async def _asgi_post(asgi, payload):
+    body = json.dumps(payload).encode()
+    status = {}
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+
+    await asgi({"type": "http", "method": "POST", "path": AUTHORIZE_PATH}, receive, send)
+    return status["code"]
+
+
+async def _run_async(asgi, fx, clients, requests_per_client):
+    latencies = []
+    errors = {}
+
+    async def client(w):
+        for i in range(requests_per_client):
+            rng = random.Random(w * 1_000_003 + i)
+            payload = authorization_payload(rng.choice(fx.pans), str(uuid.uuid4()))
+            t0 = time.perf_counter()
+            try:
+                code = await _asgi_post(asgi, payload)
+            except Exception as e:
+                code = type(e).__name__
+            latencies.append((time.perf_counter() - t0) * 1000.0)
+            if code != 200:
+                errors[str(code)] = errors.get(str(code), 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(w) for w in range(clients)))
+    wall = time.perf_counter() - started
+    await asgi.aclose()
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 1) if wall else 0.0,
+        "p50_ms": round(harness.percentile(latencies, 50), 2),
+        "p95_ms": round(harness.percentile(latencies, 95), 2),
+        "p99_ms": round(harness.percentile(latencies, 99), 2),
+        "lock_waits": 0,
+        "lock_timeouts": 0,
+        "deadlocks": 0,
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--db", default="sqlite")
+    p.add_argument("--clients", type=int, default=32)
+    p.add_argument("--requests", type=int, default=50)
+    p.add_argument("--accounts", type=int, default=50)
+    args = p.parse_args(argv)
+
+    url = harness.database_url(args.db)
+    app = make_app(url)
+    results = {}
+    try:
+        fx = build_fixture(app, args.accounts)
+        r = harness.run_concurrent(app, "sync", authorize(fx), args.clients, args.requests)
+        r.update(lock_waits=0, lock_timeouts=0, deadlocks=0)
+        results["sync"] = r
+
+        fx = build_fixture(app, args.accounts)
+        results["async"] = asyncio.run(_run_async(create_asgi_app(app), fx, args.clients, args.requests))
+    finally:
+        if args.db == "sqlite":
+            os.unlink(url[len("sqlite:///"):])
+    print_table(results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
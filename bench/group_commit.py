@@ -0,0 +1,72 @@
+"""
+Group commit for authorizations: throughput against latency per batching
+window.
+
+    python -m bench.group_commit --db postgres --clients 64 --requests 50 --accounts 4
+    python -m bench.group_commit --windows 0,1,2,5 --max-batch 32
+
+Window 0 is the plain per-request path. Few --accounts means many
+authorizations queue on the same balance rows, which is where batching pays.
+Rows show requests per second, latency percentiles, the lock waits seen and
+the mean batch size.
+"""
+
+import argparse
+import os
+import sys
+
+from app import group_commit, metrics
+
+from . import harness
+from .run import make_app, print_table
+from .scenarios import authorize, build_fixture
+
+
+def _batch_totals():
+    hist = metrics.collect().hists.get(("auth_batch_size", ()))
+    return (hist[-1], sum(hist[:-1])) if hist else (0, 0)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--db", default="sqlite")
+    p.add_argument("--clients", type=int, default=32)
+    p.add_argument("--requests", type=int, default=50)
+    p.add_argument("--accounts", type=int, default=4)
+    p.add_argument("--windows", default="0,1,2,5", help="comma-separated batching windows in ms (0 = off)")
+    p.add_argument("--max-batch", type=int, default=32)
+    args = p.parse_args(argv)
+
+    url = harness.database_url(args.db)
+    app = make_app(url)
+    counters = harness.LockCounters()
+    counters.install()
+    results = {}
+    batch_sizes = {}
+    try:
+        for window in [float(w) for w in args.windows.split(",") if w]:
+            name = "off" if not window else f"{window:g}ms"
+            if window:
+                app.extensions["auth_group_commit"] = group_commit.GroupCommitter(window / 1000.0, args.max_batch)
+            else:
+                app.extensions.pop("auth_group_commit", None)
+            fx = build_fixture(app, args.accounts)
+            summed, batches = _batch_totals()
+            r = harness.run_concurrent(app, name, authorize(fx), args.clients, args.requests)
+            r.update(counters.for_endpoint(name))
+            results[name] = r
+            summed_after, batches_after = _batch_totals()
+            if batches_after > batches:
+                batch_sizes[name] = (summed_after - summed) / (batches_after - batches)
+    finally:
+        counters.uninstall()
+        if args.db == "sqlite":
+            os.unlink(url[len("sqlite:///"):])
+    print_table(results)
+    if batch_sizes:
+        print("\nmean batch size: " + ", ".join(f"{k} {v:.1f}" for k, v in batch_sizes.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
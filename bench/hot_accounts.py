@@ -0,0 +1,55 @@
+"""
+Contention benchmark for hot-account slots: N clients credit one account,
+first with a single balance row, then split over --slots rows.
+
+    python -m bench.hot_accounts --db postgres --clients 16 --slots 8
+
+SQLite locks the whole database per write, so the gain only shows on
+Postgres, where credits to different slot rows do not block each other.
+"""
+
+import argparse
+import os
+import sys
+
+from app import db, ledger
+
+from . import harness
+from .run import make_app, print_table
+from .scenarios import build_fixture, topup
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--db", default="sqlite")
+    p.add_argument("--clients", type=int, default=16)
+    p.add_argument("--requests", type=int, default=100)
+    p.add_argument("--slots", type=int, default=8)
+    args = p.parse_args(argv)
+
+    url = harness.database_url(args.db)
+    app = make_app(url)
+    counters = harness.LockCounters()
+    counters.install()
+    results = {}
+    try:
+        for slots in (1, args.slots):
+            name = f"slots={slots}"
+            # a single account, so every credit targets the same balance
+            fx = build_fixture(app, 1)
+            with app.app_context():
+                ledger.set_slots(fx.user_ids[0], "USD", slots)
+                db.session.commit()
+            r = harness.run_concurrent(app, name, topup(fx), args.clients, args.requests)
+            r.update(counters.for_endpoint(name))
+            results[name] = r
+    finally:
+        counters.uninstall()
+        if args.db == "sqlite":
+            os.unlink(url[len("sqlite:///"):])
+    print_table(results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
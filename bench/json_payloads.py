@@ -0,0 +1,133 @@
+"""
+JSON and 2110 response building on realistic authorization payloads.
+
+    python -m bench.json_payloads
+    python -m bench.json_payloads --number 50000
+
+Compares Flask's stdlib JSON provider with FastJSONProvider (orjson when
+installed) on a 2100 request and its 2110 response, and the per-field
+response builder the webhook used to have with build_response_template.
+Prints microseconds per operation, best of --repeat runs.
+"""
+
+import argparse
+import timeit
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from app import json_provider
+from app.routes.webhook import CURRENCY_MAP, MINOR_UNITS, build_response_template
+
+REQUEST_2100 = {
+    "messageType": "2100",
+    "processingCode": "000000",
+    "primaryAccountNumber": "545454******5454",
+    "amountTransaction": "27.50",
+    "amountCardholderBilling": "27.50",
+    "dateAndTimeTransmission": "2025-10-26T13:04:15Z",
+    "conversionRateCardholderBilling": "1.000000",
+    "systemsTraceAuditNumber": "847392",
+    "dateCapture": "2025-10-26",
+    "merchantCategoryCode": "5411",
+    "acquiringInstitutionIdentificationCode": "ACQ001",
+    "retrievalReferenceNumber": "012345678901",
+    "cardAcceptorTerminalIdentification": "T98765",
+    "cardAcceptorIdentificationCode": "MRC123",
+    "cardAcceptorName": "SuperMart Downtown",
+    "cardAcceptorCity": "Beirut",
+    "cardAcceptorCountryCode": "422",
+    "posDataCode": "051",
+    "cardExpiry": "1226",
+    "entry_mode": "chip",
+    "currencyCode": "840",
+    "txn_ref": "BANK_TXN_001122",
+    "idempotency_key": "idem-retail-1",
+    "ecom": {"three_ds": "frictionless", "avs_result": "Y"},
+}
+
+
+def legacy_build(req, action_code, approval_code, new_balance_minor):
+    # the builder before the precomputed layout, one req.get per field
+    return {
+        "messageType": "2110",
+        "primaryAccountNumber": req.get("primaryAccountNumber"),
+        "processingCode": req.get("processingCode"),
+        "amountTransaction": req.get("amountTransaction"),
+        "amountCardholderBilling": req.get("amountCardholderBilling"),
+        "dateAndTimeTransmission": req.get("dateAndTimeTransmission"),
+        "conversionRateCardholderBilling": req.get("conversionRateCardholderBilling"),
+        "systemsTraceAuditNumber": req.get("systemsTraceAuditNumber"),
+        "dateCapture": req.get("dateCapture"),
+        "merchantCategoryCode": req.get("merchantCategoryCode"),
+        "acquiringInstitutionIdentificationCode": req.get("acquiringInstitutionIdentificationCode"),
+        "retrievalReferenceNumber": req.get("retrievalReferenceNumber"),
+        "cardAcceptorTerminalIdentification": req.get("cardAcceptorTerminalIdentification"),
+        "cardAcceptorIdentificationCode": req.get("cardAcceptorIdentificationCode"),
+        "cardAcceptorName": req.get("cardAcceptorName"),
+        "cardAcceptorCity": req.get("cardAcceptorCity"),
+        "cardAcceptorCountryCode": req.get("cardAcceptorCountryCode"),
+        "posDataCode": req.get("posDataCode"),
+        "cardExpiry": req.get("cardExpiry"),
+        "actionCode": action_code,
+        "approvalCode": approval_code,
+        "additionalAmounts": [
+            {
+                "accountType": "00",
+                "amountType": "02",
+                "currencyCode": req.get("currencyCode", "840"),
+                "currencyMinorUnit": str(MINOR_UNITS.get(CURRENCY_MAP.get(req.get("currencyCode", "840"), "USD"), 2)),
+                "amountSign": "C",
+                "value": str(new_balance_minor).rjust(12, "0"),
+            }
+        ],
+    }
+
+
+def best_us(fn, number, repeat):
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--number", type=int, default=20000)
+    p.add_argument("--repeat", type=int, default=7)
+    args = p.parse_args(argv)
+
+    app = Flask(__name__)
+    stdlib = DefaultJSONProvider(app)
+    fast = json_provider.FastJSONProvider(app)
+    backend = "orjson" if json_provider.orjson is not None else "stdlib fallback"
+
+    minimal = {k: v for k, v in REQUEST_2100.items() if k not in ("posDataCode", "cardExpiry")}
+    response = build_response_template(REQUEST_2100, "00", "a1b2c3", 9725)
+    assert response == legacy_build(REQUEST_2100, "00", "a1b2c3", 9725)
+    assert list(response) == list(legacy_build(REQUEST_2100, "00", "a1b2c3", 9725))
+    body = stdlib.dumps(REQUEST_2100).encode()
+    assert fast.loads(body) == stdlib.loads(body)
+
+    n, r = args.number, args.repeat
+    rows = [
+        ("parse 2100", best_us(lambda: stdlib.loads(body), n, r), best_us(lambda: fast.loads(body), n, r)),
+        ("build 2110", best_us(lambda: legacy_build(REQUEST_2100, "00", "a1b2c3", 9725), n, r),
+         best_us(lambda: build_response_template(REQUEST_2100, "00", "a1b2c3", 9725), n, r)),
+        ("build sparse", best_us(lambda: legacy_build(minimal, "00", "a1b2c3", 9725), n, r),
+         best_us(lambda: build_response_template(minimal, "00", "a1b2c3", 9725), n, r)),
+        ("dump 2110", best_us(lambda: stdlib.dumps(response, separators=(",", ":")).encode(), n, r),
+         best_us(lambda: fast.dumps_bytes(response), n, r)),
+    ]
+    with app.app_context():
+        rows.append(("response", best_us(lambda: stdlib.response(response), n, r),
+                     best_us(lambda: fast.response(response), n, r)))
+
+    print(f"FastJSONProvider backend: {backend}")
+    header = f"{'operation':<13} {'old us':>8} {'new us':>8} {'speedup':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, old, new in rows:
+        print(f"{name:<13} {old:>8.2f} {new:>8.2f} {old / new:>7.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,102 @@
+"""
+Micro-benchmarks for app.money against the float-based helpers it replaced.
+
+    python -m bench.money
+    python -m bench.money --number 200000 --batch 1000
+
+Prints nanoseconds per call (best of --repeat runs), checks that the new
+parser agrees with the old one wherever the old one was exact, and counts
+how many large LBP amounts the old float path got wrong.
+"""
+
+import argparse
+import random
+import timeit
+
+from app import money
+
+
+def legacy_to_minor(amount_float):
+    return int(round(float(amount_float) * 100))
+
+
+def legacy_format(minor):
+    return "%.2f" % (minor / 100.0)
+
+
+def samples(n, seed=1):
+    rnd = random.Random(seed)
+    strings = ["%d.%02d" % (rnd.randrange(100000), rnd.randrange(100)) for _ in range(n)]
+    floats = [float(s) for s in strings]
+    minors = [rnd.randrange(10 ** 12) for _ in range(n)]
+    return strings, floats, minors
+
+
+def float_errors(n, seed=2):
+    """How many of n random 15-19 digit amounts the float parser misreads."""
+    rnd = random.Random(seed)
+    wrong = 0
+    for _ in range(n):
+        minor = rnd.randrange(10 ** 14, 10 ** 19)
+        text = money.format_minor(minor, "LBP")
+        assert money.to_minor(text, "LBP") == minor
+        wrong += legacy_to_minor(text) != minor
+    return wrong
+
+
+def measure(fn, values, number, repeat):
+    """Best ns per call of fn over `values`, cycled `number` times in total."""
+    rounds = max(1, number // len(values))
+
+    def run():
+        for _ in range(rounds):
+            for v in values:
+                fn(v)
+
+    best = min(timeit.repeat(run, number=1, repeat=repeat))
+    return best / (rounds * len(values)) * 1e9
+
+
+def measure_batch(fn, values, number, repeat):
+    rounds = max(1, number // len(values))
+    best = min(timeit.repeat(lambda: fn(values), number=rounds, repeat=repeat))
+    return best / (rounds * len(values)) * 1e9
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--number", type=int, default=100000, help="calls per measurement")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--batch", type=int, default=500, help="amounts per batched parse")
+    args = p.parse_args(argv)
+
+    strings, floats, minors = samples(args.batch)
+    for s, f in zip(strings, floats):
+        assert money.to_minor(s) == money.to_minor(f) == legacy_to_minor(s), s
+    for m in minors[:1000]:
+        assert money.format_minor(m) == legacy_format(m) or m >= 2 ** 53, m
+
+    pairs = [(s, "USD") for s in strings]
+    rows = [
+        ("parse str", measure(legacy_to_minor, strings, args.number, args.repeat),
+         measure(money.to_minor, strings, args.number, args.repeat)),
+        ("parse float", measure(legacy_to_minor, floats, args.number, args.repeat),
+         measure(money.to_minor, floats, args.number, args.repeat)),
+        ("parse batch", measure_batch(lambda vs: [legacy_to_minor(v) for v, _ in vs], pairs, args.number, args.repeat),
+         measure_batch(money.to_minor_many, pairs, args.number, args.repeat)),
+        ("format", measure(legacy_format, minors, args.number, args.repeat),
+         measure(money.format_minor, minors, args.number, args.repeat)),
+    ]
+
+    header = f"{'operation':<12} {'old ns':>8} {'new ns':>8} {'old/new':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, old, new in rows:
+        print(f"{name:<12} {old:>8.0f} {new:>8.0f} {old / new:>7.2f}x")
+    n = 10000
+    print(f"\nfloat parse wrong on {float_errors(n)}/{n} LBP amounts of 15-19 digits (exact parser: 0)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
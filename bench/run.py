@@ -0,0 +1,102 @@
+"""
+Benchmark the money-moving endpoints with N concurrent clients.
+
+    python -m bench.run [--db sqlite|postgres|<url>] [--clients 8]
+                        [--requests 200] [--accounts 50]
+                        [--only authorize,transfer]
+                        [--save-baseline PATH] [--baseline PATH]
+                        [--tolerance 10]
+
+Prints throughput, p50/p95/p99 latency, lock waits, lock timeouts and
+deadlocks per endpoint. With --baseline the run is diffed against a saved
+result and the exit code is 1 when any metric regresses past --tolerance.
+"""
+
+import argparse
+import os
+import platform
+import sys
+
+from . import harness
+from .scenarios import SCENARIOS, build_fixture
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--db", default="sqlite", help="sqlite, postgres or a full database URL")
+    p.add_argument("--clients", type=int, default=8)
+    p.add_argument("--requests", type=int, default=200, help="requests per client")
+    p.add_argument("--accounts", type=int, default=50, help="funded users; fewer = more lock contention")
+    p.add_argument("--only", default="", help="comma-separated scenario names")
+    p.add_argument("--save-baseline", metavar="PATH")
+    p.add_argument("--baseline", metavar="PATH")
+    p.add_argument("--tolerance", type=float, default=10.0, help="allowed regression in percent")
+    return p.parse_args(argv)
+
+
+def make_app(url):
+    os.environ["DATABASE_URL"] = url
+    from app import create_app
+    app = create_app("benchmark")
+    return app
+
+
+def print_table(results):
+    header = f"{'endpoint':<12} {'reqs':>6} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'lockw':>6} {'lockto':>6} {'dlock':>6}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        errs = sum(r["errors"].values())
+        print(f"{name:<12} {r['requests']:>6} {errs:>5} {r['throughput_rps']:>8} {r['p50_ms']:>8} "
+              f"{r['p95_ms']:>8} {r['p99_ms']:>8} {r['lock_waits']:>6} {r['lock_timeouts']:>6} {r['deadlocks']:>6}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    names = [n for n in args.only.split(",") if n] or list(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        print("unknown scenarios: " + ", ".join(sorted(unknown)), file=sys.stderr)
+        return 2
+
+    url = harness.database_url(args.db)
+    app = make_app(url)
+    counters = harness.LockCounters()
+    counters.install()
+
+    results = {}
+    try:
+        for name in names:
+            fx = build_fixture(app, args.accounts)
+            r = harness.run_concurrent(app, name, SCENARIOS[name](fx), args.clients, args.requests)
+            r.update(counters.for_endpoint(name))
+            results[name] = r
+    finally:
+        counters.uninstall()
+        if args.db == "sqlite":
+            os.unlink(url[len("sqlite:///"):])
+
+    print_table(results)
+
+    meta = {
+        "db": args.db if args.db in ("sqlite", "postgres") else "custom",
+        "clients": args.clients,
+        "requests": args.requests,
+        "accounts": args.accounts,
+        "python": platform.python_version(),
+    }
+    if args.save_baseline:
+        harness.save_results(args.save_baseline, results, meta)
+        print(f"baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        lines, regressed = harness.compare(harness.load_results(args.baseline), results, args.tolerance)
+        print()
+        print("\n".join(lines) or "no change against baseline")
+        if regressed:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""
+Benchmark fixtures and per-endpoint request generators.
+
+Every scenario is `call(client, worker, i) -> response`, built from a
+`Fixture` of pre-created users, balances and cards.
+"""
+
+import random
+import uuid
+
+from app import db
+from app.models import User, CurrencyBalance, Card, BalanceSnapshot
+
+START_BALANCE_MINOR = 10 ** 12
+
+
+class Fixture:
+    def __init__(self, user_ids, pans):
+        self.user_ids = user_ids
+        self.pans = pans
+
+
+def build_fixture(app, accounts):
+    """
+    Insert `accounts` users, each with funded USD/LBP balances and one card.
+    Fewer accounts means more requests collide on the same balance rows.
+    """
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user_ids = []
+        pans = []
+        for n in range(accounts):
+            user = User(email=f"bench{n}@example.com", first_name="Bench", password_hash="bench")
+            db.session.add(user)
+            db.session.flush()
+            for cur in ("USD", "LBP"):
+                db.session.add(CurrencyBalance(user_id=user.id, currency=cur, amount=START_BALANCE_MINOR))
+                # opening balance for LEDGER_MODE=journal runs
+                db.session.add(BalanceSnapshot(account=user.id, currency=cur, amount=START_BALANCE_MINOR, last_entry_id=0))
+            pan = "4%05d******%04d" % (n, n)
+            db.session.add(Card(user_id=user.id, pan_masked=pan, card_type="virtual", status="active", expiry="1230"))
+            user_ids.append(user.id)
+            pans.append(pan)
+        db.session.commit()
+    return Fixture(user_ids, pans)
+
+
+def _pair(fx, rng):
+    if len(fx.user_ids) == 1:
+        return fx.user_ids[0], fx.user_ids[0]
+    a, b = rng.sample(fx.user_ids, 2)
+    return a, b
+
+
+def topup(fx):
+    def call(client, worker, i):
+        rng = random.Random(worker * 1_000_003 + i)
+        return client.post("/api/auth/topup", json={
+            "user_id": rng.choice(fx.user_ids), "currency": "USD", "amount": "1.00",
+        })
+    return call
+
+
+def transfer(fx):
+    def call(client, worker, i):
+        rng = random.Random(worker * 1_000_003 + i)
+        a, b = _pair(fx, rng)
+        return client.post("/api/transfer/transfer", json={
+            "from_user_id": a, "to_user_id": b, "currency": "USD", "amount": "0.01",
+        })
+    return call
+
+
+def payment(fx):
+    def call(client, worker, i):
+        rng = random.Random(worker * 1_000_003 + i)
+        a, b = _pair(fx, rng)
+        return client.post("/api/payments/payments", json={
+            "from_user_id": a, "to_user_id": b, "currency": "USD", "amount": "0.01",
+            "description": "bench",
+        })
+    return call
+
+
+def wallets(fx):
+    # app polling: mostly reads, with a topup every 20th request
+    def call(client, worker, i):
+        rng = random.Random(worker * 1_000_003 + i)
+        user_id = rng.choice(fx.user_ids)
+        if i % 20 == 19:
+            return client.post("/api/auth/topup", json={"user_id": user_id, "currency": "USD", "amount": "1.00"})
+        return client.get(f"/api/payments/wallets/{user_id}")
+    return call
+
+
+def authorization_payload(pan, idem, amount="0.01"):
+    return {
+        "messageType": "2100",
+        "processingCode": "000000",
+        "primaryAccountNumber": pan,
+        "amountTransaction": amount,
+        "amountCardholderBilling": amount,
+        "dateAndTimeTransmission": "2025-10-26T13:04:15Z",
+        "conversionRateCardholderBilling": "1.000000",
+        "systemsTraceAuditNumber": "847392",
+        "dateCapture": "2025-10-26",
+        "merchantCategoryCode": "5411",
+        "acquiringInstitutionIdentificationCode": "ACQ001",
+        "retrievalReferenceNumber": "012345678901",
+        "cardAcceptorTerminalIdentification": "T98765",
+        "cardAcceptorIdentificationCode": "MRC123",
+        "cardAcceptorName": "SuperMart Downtown",
+        "cardAcceptorCity": "Beirut",
+        "cardAcceptorCountryCode": "422",
+        "entry_mode": "chip",
+        "currencyCode": "840",
+        "txn_ref": "BENCH",
+        "idempotency_key": idem,
+    }
+
+
+def authorize(fx):
+    def call(client, worker, i):
+        rng = random.Random(worker * 1_000_003 + i)
+        payload = authorization_payload(rng.choice(fx.pans), str(uuid.uuid4()))
+        return client.post("/api/webhook/webhook/authorize", json=payload)
+    return call
+
+
+SCENARIOS = {
+    "topup": topup,
+    "transfer": transfer,
+    "payment": payment,
+    "authorize": authorize,
+    "wallets": wallets,
+}
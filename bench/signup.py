@@ -0,0 +1,62 @@
+"""
+Signup throughput: signups per second, and per core, for a hashing setup.
+
+    python -m bench.signup --clients 8 --requests 50
+    python -m bench.signup --scheme pbkdf2_sha256 --rounds 100000 --workers 2
+
+--scheme/--rounds/--workers set PASSWORD_SCHEME, PASSWORD_ROUNDS and
+PASSWORD_HASH_WORKERS for the run. "per core" divides by the cores this
+process may use.
+"""
+
+import argparse
+import os
+import sys
+import uuid
+
+from . import harness
+from .run import make_app, print_table
+
+
+def signup(client, worker, i):
+    return client.post("/api/auth/signup", json={"email": f"{uuid.uuid4().hex}@example.com", "password": "correct horse"})
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--db", default="sqlite")
+    p.add_argument("--clients", type=int, default=8)
+    p.add_argument("--requests", type=int, default=50)
+    p.add_argument("--scheme")
+    p.add_argument("--rounds", type=int)
+    p.add_argument("--workers", type=int)
+    args = p.parse_args(argv)
+
+    for name, value in (("PASSWORD_SCHEME", args.scheme), ("PASSWORD_ROUNDS", args.rounds), ("PASSWORD_HASH_WORKERS", args.workers)):
+        if value is not None:
+            os.environ[name] = str(value)
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+    url = harness.database_url(args.db)
+    app = make_app(url)
+    try:
+        from app import db
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        r = harness.run_concurrent(app, "signup", signup, args.clients, args.requests)
+        r.update(lock_waits=0, lock_timeouts=0, deadlocks=0)
+    finally:
+        if args.db == "sqlite":
+            os.unlink(url[len("sqlite:///"):])
+    print_table({"signup": r})
+    hasher = app.extensions["password_hasher"]
+    scheme = hasher.context.default_scheme()
+    print(f"\n{scheme} rounds={hasher.context.to_dict().get(scheme + '__rounds', 'default')} "
+          f"hash workers={hasher.workers} cores={cores}: "
+          f"{r['throughput_rps']} signups/s, {round(r['throughput_rps'] / cores, 1)} signups/s/core")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,130 @@
 #!/usr/bin/env python3
-from app import create_app, db
+from app import create_app, db, ledger, journal, bulk_import, archive, statements, fx, idempotency, serving
 from flask_migrate import Migrate
+import click
 import os
 
 app = create_app(os.getenv("FLASK_ENV") or "development")
 migrate = Migrate(app, db)
 
+
+@app.cli.command("set-balance-slots")
+@click.argument("user_id")
+@click.argument("currency")
+@click.argument("slots", type=int)
+def set_balance_slots(user_id, currency, slots):
+    """Mark a balance as hot by splitting it over SLOTS rows (1 = normal)."""
+    try:
+        ledger.set_slots(user_id, currency, slots)
+    except (LookupError, ValueError) as e:
+        db.session.rollback()
+        raise click.ClickException(str(e))
+    db.session.commit()
+    click.echo(f"{user_id} {currency}: {slots} slot(s), balance {ledger.balance_of(user_id, currency)}")
+
+
+@app.cli.command("compact-journal")
+@click.option("--lag", type=float, default=60.0, help="skip entries younger than this many seconds")
+def compact_journal(lag):
+    """Fold the journal tail into balance snapshots."""
+    from datetime import timedelta
+    advanced, cutoff = journal.compact(lag=timedelta(seconds=lag))
+    click.echo(f"advanced {advanced} snapshot(s) to entry {cutoff}")
+
+
+@app.cli.command("import-users")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]), help="default: from the file extension")
+@click.option("--chunk-size", type=int, default=5000, show_default=True)
+@click.option("--state", "state_path", help="progress file (default: PATH.import-state.json)")
+@click.option("--rejects", "rejects_path", help="rejected records (default: PATH.rejects.ndjson)")
+@click.option("--restart", is_flag=True, help="ignore earlier progress and start from the first record")
+def import_users(path, fmt, chunk_size, state_path, rejects_path, restart):
+    """Bulk-insert users, balances and cards from a CSV or NDJSON file."""
+    result = bulk_import.import_file(
+        path, fmt=fmt, chunk_size=chunk_size, state_path=state_path, rejects_path=rejects_path, restart=restart,
+        progress=lambda r: click.echo(f"record {r.records}: {r.users} users, {sum(r.rejected.values())} rejected", err=True),
+    )
+    click.echo(result.summary())
+
+
+@app.cli.command("set-rate")
+@click.argument("base")
+@click.argument("quote")
+@click.argument("rate")
+def set_rate(base, quote, rate):
+    """Publish a new BASE/QUOTE exchange rate (units of QUOTE per BASE)."""
+    try:
+        row = fx.set_rate(base.upper(), quote.upper(), rate)
+    except ValueError as e:
+        db.session.rollback()
+        raise click.ClickException(str(e))
+    click.echo(f"{row.base}/{row.quote} = {row.rate} (version {row.id})")
+
+
+@app.cli.command("purge-idempotency")
+@click.option("--hours", type=float, help="retention; default: IDEMPOTENCY_RETENTION_HOURS")
+@click.option("--batch-size", type=int, default=idempotency.PURGE_BATCH, show_default=True)
+def purge_idempotency(hours, batch_size):
+    """Delete card_auth_requests older than the retention window."""
+    hours = app.config["IDEMPOTENCY_RETENTION_HOURS"] if hours is None else hours
+    if not hours:
+        raise click.ClickException("retention is 0 (keep everything)")
+    n = idempotency.purge(idempotency.cutoff(hours), batch_size, app.config["IDEMPOTENCY_PURGE_PAUSE"])
+    click.echo(f"purged {n} idempotency claim(s) older than {hours:g}h")
+
+
+@app.cli.command("rebuild-statements")
+@click.option("--user", "user_id", help="only this user")
+@click.option("--since", help="YYYY-MM; default: the oldest month still in transactions")
+@click.option("--verify", is_flag=True, help="report differences without rewriting")
+def rebuild_statements(user_id, since, verify):
+    """Recompute monthly statement rollups from transactions."""
+    diff = statements.rebuild(user_id=user_id, since=since, verify=verify)
+    for key, (have, want) in sorted(diff.items()):
+        click.echo(f"{' '.join(key)}: stored {have}, computed {want}")
+    click.echo(f"{len(diff)} rollup(s) {'differ' if verify else 'rewritten'}")
+    if verify and diff:
+        raise SystemExit(1)
+
+
+@app.cli.command("ensure-partitions")
+@click.option("--months-ahead", type=int, default=archive.MONTHS_AHEAD, show_default=True)
+def ensure_partitions(months_ahead):
+    """Create the coming monthly transactions partitions (Postgres)."""
+    created = archive.ensure_partitions(months_ahead)
+    click.echo("created: " + (", ".join(created) or "none"))
+
+
+@app.cli.command("archive")
+@click.option("--before", required=True, help="YYYY-MM-DD; whole months before this one are archived")
+@click.option("--dir", "directory", help="default: ARCHIVE_DIR")
+@click.option("--table", "tables", multiple=True, type=click.Choice(list(archive.TABLES)), help="default: all")
+def archive_months(before, directory, tables):
+    """Export old months to compressed files, then detach/delete them."""
+    from datetime import datetime
+    done = archive.archive(datetime.fromisoformat(before), directory, tables or tuple(archive.TABLES))
+    for table, month, rows in done:
+        click.echo(f"{table} {month}: {rows} rows")
+    click.echo(f"{len(done)} month(s) archived")
+
+
+@app.cli.command("serve")
+@click.option("--bind", default=lambda: f"0.0.0.0:{os.getenv('PORT', 5000)}", show_default="0.0.0.0:$PORT")
+@click.option("--workers", type=int, default=serving.default_workers, show_default="$WEB_CONCURRENCY or 2 x CPUs + 1")
+@click.option("--threads", type=int, default=lambda: int(os.getenv("WEB_THREADS", 8)), show_default="$WEB_THREADS or 8")
+@click.option("--timeout", type=int, default=30, show_default=True)
+@click.option("--warm-cards", type=int, default=serving.WARM_CARDS, show_default=True, help="newest cards to preload, 0 = none")
+def serve(bind, workers, threads, timeout, warm_cards):
+    """Serve with gunicorn: preloaded, warmed up, engines disposed after fork."""
+    if workers > 1 and not app.config["METRICS_DIR"]:
+        click.echo("warning: METRICS_DIR is unset, so /metrics only covers the worker that answers", err=True)
+    try:
+        serving.run(app, bind, workers, threads, timeout, warm_cards)
+    except RuntimeError as e:  # gunicorn missing, or SchemaNotMigrated
+        raise click.ClickException(str(e))
+
+
 if __name__ == "__main__":
+    # development server; `flask --app manage.py serve` in production
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)))
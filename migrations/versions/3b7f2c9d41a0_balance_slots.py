@@ -0,0 +1,42 @@
+"""Split hot balances into slots
+
+Revision ID: 3b7f2c9d41a0
+Revises: c565561056a1
+Create Date: 2025-11-03 10:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b7f2c9d41a0'
+down_revision = 'c565561056a1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # existing rows all become slot 0, so the new constraint holds immediately
+    with op.batch_alter_table('currency_balances', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('slot', sa.Integer(), server_default='0', nullable=False))
+        batch_op.drop_constraint('uq_user_currency', type_='unique')
+        batch_op.create_unique_constraint('uq_user_currency_slot', ['user_id', 'currency', 'slot'])
+
+
+def downgrade():
+    # fold extra slots back into slot 0 before restoring one row per (user, currency)
+    op.execute(
+        """
+        UPDATE currency_balances SET amount = (
+            SELECT SUM(cb.amount) FROM currency_balances cb
+            WHERE cb.user_id = currency_balances.user_id AND cb.currency = currency_balances.currency
+        )
+        WHERE slot = 0
+        """
+    )
+    op.execute("DELETE FROM currency_balances WHERE slot > 0")
+    with op.batch_alter_table('currency_balances', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_user_currency_slot', type_='unique')
+        batch_op.create_unique_constraint('uq_user_currency', ['user_id', 'currency'])
+        batch_op.drop_column('slot')
@@ -0,0 +1,25 @@
+"""Index card_auth_requests by processed_at for the retention purge
+
+Revision ID: 4f6a2c8e1b93
+Revises: b19f3d6a8e27
+Create Date: 2025-12-02 10:22:41.630914
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '4f6a2c8e1b93'
+down_revision = 'b19f3d6a8e27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('card_auth_requests', schema=None) as batch_op:
+        batch_op.create_index('ix_card_auth_requests_processed_at', ['processed_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('card_auth_requests', schema=None) as batch_op:
+        batch_op.drop_index('ix_card_auth_requests_processed_at')
@@ -0,0 +1,57 @@
+"""Append-only journal and balance snapshots
+
+Revision ID: 5a9c0e7b3d14
+Revises: 8d1e6a2f5c3b
+Create Date: 2025-11-10 15:22:48.630944
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a9c0e7b3d14'
+down_revision = '8d1e6a2f5c3b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('journal_entries',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), autoincrement=True, nullable=False),
+    sa.Column('transaction_id', sa.UUID(as_uuid=False), nullable=False),
+    sa.Column('account', sa.String(length=64), nullable=False),
+    sa.Column('currency', sa.String(length=3), nullable=False),
+    sa.Column('amount', sa.BigInteger(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('journal_entries', schema=None) as batch_op:
+        batch_op.create_index('ix_journal_account_currency_id', ['account', 'currency', 'id'], unique=False)
+
+    op.create_table('balance_snapshots',
+    sa.Column('account', sa.String(length=64), nullable=False),
+    sa.Column('currency', sa.String(length=3), nullable=False),
+    sa.Column('amount', sa.BigInteger(), nullable=False),
+    sa.Column('last_entry_id', sa.BigInteger(), nullable=False),
+    sa.Column('taken_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('account', 'currency')
+    )
+
+    # opening balances: today's balances become the snapshot the journal starts from
+    op.execute(
+        """
+        INSERT INTO balance_snapshots (account, currency, amount, last_entry_id, taken_at)
+        SELECT CAST(user_id AS VARCHAR(64)), currency, SUM(amount), 0, CURRENT_TIMESTAMP
+        FROM currency_balances
+        GROUP BY user_id, currency
+        """
+    )
+
+
+def downgrade():
+    op.drop_table('balance_snapshots')
+    with op.batch_alter_table('journal_entries', schema=None) as batch_op:
+        batch_op.drop_index('ix_journal_account_currency_id')
+
+    op.drop_table('journal_entries')
@@ -0,0 +1,50 @@
+"""Monthly statement rollups
+
+Revision ID: 7c2d9e4f1a65
+Revises: e4b8a1c7f902
+Create Date: 2025-11-24 10:12:31.559870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2d9e4f1a65'
+down_revision = 'e4b8a1c7f902'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('monthly_statements',
+    sa.Column('user_id', sa.UUID(as_uuid=False), nullable=False),
+    sa.Column('month', sa.String(length=7), nullable=False),
+    sa.Column('currency', sa.String(length=3), nullable=False),
+    sa.Column('type', sa.String(length=32), nullable=False),
+    sa.Column('direction', sa.String(length=3), nullable=False),
+    sa.Column('shard', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('amount', sa.BigInteger(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('user_id', 'month', 'currency', 'type', 'direction', 'shard')
+    )
+
+    # backfill from the transactions already there
+    if op.get_bind().dialect.name == 'postgresql':
+        month = "to_char(created_at, 'YYYY-MM')"
+    else:
+        month = "strftime('%Y-%m', created_at)"
+    for column, direction in (('from_user_id', 'out'), ('to_user_id', 'in')):
+        op.execute(
+            """
+            INSERT INTO monthly_statements (user_id, month, currency, type, direction, shard, amount, count)
+            SELECT {col}, {month}, currency, type, '{dir}', 0, SUM(amount), COUNT(*)
+            FROM transactions
+            WHERE {col} IS NOT NULL AND created_at IS NOT NULL
+            GROUP BY {col}, {month}, currency, type
+            """.format(col=column, month=month, dir=direction)
+        )
+
+
+def downgrade():
+    op.drop_table('monthly_statements')
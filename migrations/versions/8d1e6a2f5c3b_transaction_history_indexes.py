@@ -0,0 +1,27 @@
+"""Index transactions for per-user history
+
+Revision ID: 8d1e6a2f5c3b
+Revises: 3b7f2c9d41a0
+Create Date: 2025-11-05 09:41:07.118532
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8d1e6a2f5c3b'
+down_revision = '3b7f2c9d41a0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('transactions', schema=None) as batch_op:
+        batch_op.create_index('ix_transactions_from_user_created', ['from_user_id', 'created_at'], unique=False)
+        batch_op.create_index('ix_transactions_to_user_created', ['to_user_id', 'created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('transactions', schema=None) as batch_op:
+        batch_op.drop_index('ix_transactions_to_user_created')
+        batch_op.drop_index('ix_transactions_from_user_created')
@@ -0,0 +1,31 @@
+"""Exchange rates
+
+Revision ID: b19f3d6a8e27
+Revises: 7c2d9e4f1a65
+Create Date: 2025-12-01 16:45:02.774019
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b19f3d6a8e27'
+down_revision = '7c2d9e4f1a65'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('exchange_rates',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('base', sa.String(length=3), nullable=False),
+    sa.Column('quote', sa.String(length=3), nullable=False),
+    sa.Column('rate', sa.String(length=40), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('exchange_rates')
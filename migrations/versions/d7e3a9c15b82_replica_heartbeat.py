@@ -0,0 +1,28 @@
+"""Replica heartbeat
+
+Revision ID: d7e3a9c15b82
+Revises: 4f6a2c8e1b93
+Create Date: 2025-12-03 11:08:17.402561
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7e3a9c15b82'
+down_revision = '4f6a2c8e1b93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('replica_heartbeat',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('beat_ms', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('replica_heartbeat')
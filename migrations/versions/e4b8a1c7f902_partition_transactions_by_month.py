@@ -0,0 +1,104 @@
+"""Partition transactions by month (Postgres)
+
+Revision ID: e4b8a1c7f902
+Revises: 5a9c0e7b3d14
+Create Date: 2025-11-18 11:07:53.402117
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b8a1c7f902'
+down_revision = '5a9c0e7b3d14'
+branch_labels = None
+depends_on = None
+
+COLUMNS = "id, from_user_id, to_user_id, currency, amount, type, status, details, created_at"
+MONTHS_AHEAD = 2
+
+
+def _next_month(d):
+    return d.replace(year=d.year + 1, month=1) if d.month == 12 else d.replace(month=d.month + 1)
+
+
+def upgrade():
+    # SQLite (tests, local dev) keeps the plain table; app.archive deletes
+    # exported rows there instead of detaching partitions
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    op.execute("ALTER TABLE transactions RENAME TO transactions_unpartitioned")
+    op.execute("ALTER TABLE transactions_unpartitioned RENAME CONSTRAINT transactions_pkey TO transactions_unpartitioned_pkey")
+    op.execute("DROP INDEX ix_transactions_from_user_created")
+    op.execute("DROP INDEX ix_transactions_to_user_created")
+
+    # the partition key has to be part of the primary key, and may not be NULL
+    op.execute(
+        """
+        CREATE TABLE transactions (
+            id UUID NOT NULL,
+            from_user_id UUID,
+            to_user_id UUID,
+            currency VARCHAR(3) NOT NULL,
+            amount BIGINT NOT NULL,
+            type VARCHAR(32) NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            details JSON,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        """
+    )
+    op.execute("CREATE TABLE transactions_default PARTITION OF transactions DEFAULT")
+
+    oldest = bind.execute(sa.text("SELECT min(created_at) FROM transactions_unpartitioned")).scalar()
+    month = (oldest or datetime.utcnow()).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    last = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    for _ in range(MONTHS_AHEAD):
+        last = _next_month(last)
+    while month <= last:
+        upper = _next_month(month)
+        op.execute(
+            "CREATE TABLE transactions_p%s PARTITION OF transactions FOR VALUES FROM ('%s') TO ('%s')"
+            % (month.strftime("%Y%m"), month.isoformat(), upper.isoformat())
+        )
+        month = upper
+
+    op.execute(
+        "INSERT INTO transactions (%s) SELECT %s FROM transactions_unpartitioned"
+        % (COLUMNS, COLUMNS.replace("created_at", "COALESCE(created_at, now() AT TIME ZONE 'utc')"))
+    )
+    op.execute("DROP TABLE transactions_unpartitioned")
+
+    op.create_index('ix_transactions_from_user_created', 'transactions', ['from_user_id', 'created_at'], unique=False)
+    op.create_index('ix_transactions_to_user_created', 'transactions', ['to_user_id', 'created_at'], unique=False)
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    op.create_table('transactions_unpartitioned',
+    sa.Column('id', sa.UUID(as_uuid=False), nullable=False),
+    sa.Column('from_user_id', sa.UUID(as_uuid=False), nullable=True),
+    sa.Column('to_user_id', sa.UUID(as_uuid=False), nullable=True),
+    sa.Column('currency', sa.String(length=3), nullable=False),
+    sa.Column('amount', sa.BigInteger(), nullable=False),
+    sa.Column('type', sa.String(length=32), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('details', sa.JSON(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id', name='transactions_unpartitioned_pkey')
+    )
+    op.execute("INSERT INTO transactions_unpartitioned (%s) SELECT %s FROM transactions" % (COLUMNS, COLUMNS))
+    op.execute("DROP TABLE transactions")  # and every partition still attached
+    op.execute("ALTER TABLE transactions_unpartitioned RENAME TO transactions")
+    op.execute("ALTER TABLE transactions RENAME CONSTRAINT transactions_unpartitioned_pkey TO transactions_pkey")
+    op.create_index('ix_transactions_from_user_created', 'transactions', ['from_user_id', 'created_at'], unique=False)
+    op.create_index('ix_transactions_to_user_created', 'transactions', ['to_user_id', 'created_at'], unique=False)
@@ -12,8 +12,8 @@ or:
 """
 
 import os
-from app import create_app, db
-from app.models import User, CurrencyBalance, Card
+from app import create_app, db, ledger
+from app.models import User, CurrencyBalance, Card, JournalEntry, BalanceSnapshot, Transaction
 
 app = create_app(os.getenv("FLASK_ENV") or "development")
 
@@ -21,6 +21,9 @@ def run():
     with app.app_context():
         try:
             # Clean old data for a fresh demo
+            db.session.query(JournalEntry).delete()
+            db.session.query(BalanceSnapshot).delete()
+            db.session.query(Transaction).delete()
             db.session.query(Card).delete()
             db.session.query(CurrencyBalance).delete()
             db.session.query(User).delete()
@@ -42,9 +45,9 @@ def run():
                 db.session.add(CurrencyBalance(user_id=user.id, currency="LBP", amount=0))
             db.session.flush()
 
-            # Top up Kamel $200 (in minor units = 20000)
-            usd_balance = CurrencyBalance.query.filter_by(user_id=kamel.id, currency="USD").one()
-            usd_balance.amount = 20000
+            # Top up Kamel $200 (in minor units = 20000), booked like a real topup
+            usd_balance = ledger.credit(kamel.id, "USD", 20000)
+            ledger.post("topup", "USD", 20000, to_user_id=kamel.id)
 
             # Create Kamel's card
             card = Card(
@@ -59,7 +62,7 @@ def run():
 
             print("✅ Demo seed completed successfully.")
             print(f"Kamel ID: {kamel.id}, Ali ID: {ali.id}")
-            print(f"Kamel USD balance (minor units): {usd_balance.amount}")
+            print(f"Kamel USD balance (minor units): {usd_balance}")
             print(f"Kamel Card: {card.pan_masked}, status: {card.status}")
 
         except Exception as e:
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+from app import create_app, db
+from app.admission import Limiter, upstream_wait
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "sqlite:///:memory:")
+    monkeypatch.setenv("ADMISSION_LIMIT", "4")
+    monkeypatch.setenv("ADMISSION_QUEUE_MS", "critical:300,normal:0,low:0")
+    app = create_app("testing")
+    app.config["TESTING"] = True
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def test_limiter_reserves_slots_for_higher_classes():
+    limiter = Limiter(4, 1)
+    assert limiter.caps == {"critical": 4, "normal": 3, "low": 1}
+    assert limiter.acquire("low", 0) == 0.0
+    assert limiter.acquire("low", 0) is None
+    assert limiter.acquire("normal", 0) == 0.0 and limiter.acquire("normal", 0) == 0.0
+    assert limiter.acquire("normal", 0) is None
+    assert limiter.acquire("critical", 0) == 0.0
+    assert limiter.acquire("critical", 0.01) is None
+
+    # a queued authorization takes the next free slot ahead of a queued read
+    got = {}
+    def wait(cls):
+        got[cls] = limiter.acquire(cls, 1.0)
+    threads = [threading.Thread(target=wait, args=(cls,)) for cls in ("critical", "normal")]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    limiter.release()
+    threads[0].join()
+    assert got["critical"] is not None and "normal" not in got
+    limiter.release()
+    limiter.release()  # normal stops short of the reserved slot
+    threads[1].join()
+    assert got["normal"] is not None
+
+    assert 4.9 < upstream_wait("t=%.3f" % (time.time() - 5)) < 6
+    assert 4.9 < upstream_wait("t=%d" % ((time.time() - 5) * 1e6)) < 6
+    assert upstream_wait("garbage") == 0.0
+
+
+def test_reads_shed_first_and_authorize_keeps_its_slots(app):
+    client = app.test_client()
+    limiter = app.extensions["admission"]
+    for _ in range(3):
+        limiter.acquire("normal", 0)
+
+    r = client.get("/api/payments/wallets/someone")
+    assert r.status_code == 503 and r.headers["Retry-After"] == "2"
+    assert client.post("/api/transfer/transfer", json={}).status_code == 503
+    # the reserved slot: admitted, and the view answers
+    assert client.post("/api/webhook/webhook/authorize", json={}).status_code == 400
+    assert limiter.in_flight == 3
+
+    # all four taken: authorize waits its 300 ms budget for a slot
+    limiter.acquire("critical", 0)
+    started = time.monotonic()
+    assert client.post("/api/webhook/webhook/authorize", json={}).status_code == 503
+    assert time.monotonic() - started >= 0.25
+
+    statuses = []
+    t = threading.Thread(target=lambda: statuses.append(
+        app.test_client().post("/api/webhook/webhook/authorize", json={}).status_code))
+    t.start()
+    time.sleep(0.05)
+    limiter.release()
+    t.join()
+    assert statuses == [400]
+
+    # time already spent queued at the proxy counts against the budget
+    limiter.release()
+    r = client.post("/api/webhook/webhook/authorize", json={}, headers={"X-Request-Start": "t=%.3f" % (time.time() - 1)})
+    assert r.status_code == 503
+
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'admission_rejected_total{class="low",reason="capacity"} 1' in body
+    assert 'admission_rejected_total{class="critical",reason="queue_timeout"} 1' in body
+    assert 'admission_rejected_total{class="critical",reason="queue_time"} 1' in body
+    assert "admission_in_flight{pid=" in body
+    assert limiter.in_flight == 2
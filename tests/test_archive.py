@@ -0,0 +1,121 @@
+import os
+from datetime import datetime
+
+import pytest
+from app import archive, create_app, db
+from app.models import CardAuthRequest, Transaction
+
+
+@pytest.fixture
+def client(tmp_path):
+    os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+    app = create_app("testing")
+    app.config["TESTING"] = True
+    app.config["ARCHIVE_DIR"] = str(tmp_path / "archive")
+    with app.app_context():
+        db.create_all()
+        yield app.test_client()
+        db.session.remove()
+        db.drop_all()
+
+
+def test_archive_months_and_read_history_through_them(client, tmp_path):
+    ua = client.post("/api/auth/signup", json={"email": "a@example.com", "password": "pw"}).get_json()["user_id"]
+    ub = client.post("/api/auth/signup", json={"email": "b@example.com", "password": "pw"}).get_json()["user_id"]
+    client.post("/api/auth/topup", json={"user_id": ua, "currency": "USD", "amount": 100.00})
+    for _ in range(4):
+        client.post("/api/transfer/transfer", json={"from_user_id": ua, "to_user_id": ub, "currency": "USD", "amount": 1.00})
+    # spread the rows over Aug..Nov 2025
+    txs = Transaction.query.order_by(Transaction.created_at).all()
+    for n, tx in enumerate(txs):
+        tx.created_at = datetime(2025, 8 + min(n, 3), 10, 12, 0, n)
+    db.session.add(CardAuthRequest(idempotency_key="old", request_payload={"a": 1}, response_payload={"actionCode": "00"},
+                                   processed_at=datetime(2025, 9, 1)))
+    db.session.commit()
+
+    done = archive.archive(datetime(2025, 10, 15))
+    assert done == [("transactions", "2025-08", 1), ("transactions", "2025-09", 1), ("card_auth_requests", "2025-09", 1)]
+    assert Transaction.query.count() == 3
+    assert CardAuthRequest.query.count() == 0
+    manifest = archive.load_manifest(str(tmp_path / "archive"))
+    assert [e["month"] for e in manifest["transactions"]] == ["2025-08", "2025-09"]
+    [auth] = archive.read_file(str(tmp_path / "archive" / manifest["card_auth_requests"][0]["file"]))
+    assert auth["response_payload"] == {"actionCode": "00"}
+
+    # live only by default
+    assert len(client.get(f"/api/payments/payments/history/{ua}").get_json()) == 3
+
+    seen, cursor = [], None
+    while True:
+        url = f"/api/payments/payments/history/{ua}?limit=2&archive=1" + (f"&cursor={cursor}" if cursor else "")
+        r = client.get(url)
+        assert r.status_code == 200
+        seen.extend(r.get_json())
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert len(seen) == 5
+    assert [tx["created_at"][:7] for tx in seen] == ["2025-11", "2025-11", "2025-10", "2025-09", "2025-08"]
+    assert seen[-1]["type"] == "topup" and seen[-1]["amount"] == "100.00"
+
+
+def test_history_reads_only_the_users_blocks(client, tmp_path, monkeypatch):
+    import json
+
+    monkeypatch.setattr(archive, "EXPORT_BATCH", 3)
+    signup = lambda email: client.post("/api/auth/signup", json={"email": email, "password": "pw"}).get_json()["user_id"]
+    ua, ub, uc = signup("a@example.com"), signup("b@example.com"), signup("c@example.com")
+    client.post("/api/auth/topup", json={"user_id": ua, "currency": "USD", "amount": 100.00})
+    for n in range(12):
+        to = uc if n == 4 else ub
+        client.post("/api/transfer/transfer", json={"from_user_id": ua, "to_user_id": to, "currency": "USD", "amount": 1.00})
+    # 13 rows: Aug gets the topup and 5 transfers (c's is the last), Sep the other 7
+    for n, tx in enumerate(Transaction.query.order_by(Transaction.created_at).all()):
+        tx.created_at = datetime(2025, 8 if n < 6 else 9, 1 + n, 12)
+    db.session.commit()
+    archive.archive(datetime(2025, 10, 1))
+    directory = str(tmp_path / "archive")
+    manifest = archive.load_manifest(directory)
+    assert all("index" in e for e in manifest["transactions"])
+
+    full = {}
+    for user in (ua, ub, uc):
+        rows = [r for e in manifest["transactions"] for r in archive.read_file(os.path.join(directory, e["file"]))
+                if user in (r["from_user_id"], r["to_user_id"])]
+        full[user] = sorted(rows, key=lambda r: (r["created_at"], r["id"]), reverse=True)
+
+    reads = []
+    read_rows = archive._read_rows
+    def counting(path, block, number, offsets):
+        reads.append((os.path.basename(path), number))
+        return read_rows(path, block, number, offsets)
+    monkeypatch.setattr(archive, "_read_rows", counting)
+    monkeypatch.setattr(archive, "read_file", None)  # no full scans
+
+    # c has one row, in the last block of August: one block read, September skipped
+    assert archive.history(uc, limit=5) == full[uc]
+    assert reads == [(manifest["transactions"][0]["file"], 1)]
+
+    # a full page stops in the newest block that completes it
+    reads.clear()
+    assert archive.history(ub, limit=1) == full[ub][:1]
+    assert len(reads) == 1
+
+    # paging with a cursor walks the same rows as a full scan
+    for user in (ua, ub):
+        seen, before = [], None
+        while True:
+            page = archive.history(user, before=before, limit=2)
+            seen += page
+            if len(page) < 2:
+                break
+            before = (page[-1]["created_at"], page[-1]["id"])
+        assert seen == full[user]
+
+    # archives written before the index still read, by scanning
+    monkeypatch.undo()
+    for entry in manifest["transactions"]:
+        del entry["index"]
+    with open(os.path.join(directory, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+    assert archive.history(ua, limit=100) == full[ua]
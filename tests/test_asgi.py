@@ -0,0 +1,67 @@
+import asyncio
+import json
+import os
+
+import pytest
+from app import create_app, db
+
+pytest.importorskip("aiosqlite")
+
+from app.asgi import create_asgi_app
+
+
+@pytest.fixture
+def apps(tmp_path):
+    # a file database, so the sync and async engines see the same rows
+    os.environ["DATABASE_URL"] = "sqlite:///" + str(tmp_path / "asgi.db")
+    app = create_app("testing")
+    app.config["TESTING"] = True
+    with app.app_context():
+        db.create_all()
+    asgi = create_asgi_app(app)
+    yield app.test_client(), asgi
+    asyncio.run(asgi.aclose())
+    with app.app_context():
+        db.drop_all()
+
+
+def call(asgi, path, payload):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": json.dumps(payload).encode(), "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi({"type": "http", "method": "POST", "path": path}, receive, send))
+    return sent[0]["status"], json.loads(sent[1]["body"])
+
+
+def test_async_authorize_matches_sync_flow(apps):
+    client, asgi = apps
+    uid = client.post("/api/auth/signup", json={"email": "shopper@example.com", "password": "pw"}).get_json()["user_id"]
+    client.post("/api/auth/topup", json={"user_id": uid, "currency": "USD", "amount": 20.00})
+    client.post("/api/payments/create-card", json={"user_id": uid, "pan_masked": "545454******5454"})
+
+    payload = {
+        "messageType": "2100",
+        "primaryAccountNumber": "545454******5454",
+        "amountTransaction": "12.00",
+        "currencyCode": "840",
+        "idempotency_key": "idem-async-1",
+    }
+    status, body = call(asgi, "/api/webhook/webhook/authorize", payload)
+    assert status == 200
+    assert body["actionCode"] == "00"
+    assert body["additionalAmounts"][0]["value"] == "000000000800"
+
+    # the sync endpoint sees the stored response for the same key
+    r = client.post("/api/webhook/webhook/authorize", json=payload)
+    assert r.get_json() == body
+
+    status, body = call(asgi, "/api/webhook/webhook/authorize", dict(payload, idempotency_key="idem-async-2"))
+    assert body["actionCode"] == "51"
+
+    status, _ = call(asgi, "/api/webhook/nope", {})
+    assert status == 404
@@ -41,9 +41,76 @@ def test_topup_and_validation(client):
     r_bad2 = client.post("/api/auth/topup", json={"user_id": uid, "currency": "USD", "amount": "abc"})
     assert r_bad2.status_code == 400
 
+    # zero and negative amounts
+    for amount in (0, -500, "-1.00"):
+        r_neg = client.post("/api/auth/topup", json={"user_id": uid, "currency": "USD", "amount": amount})
+        assert r_neg.status_code == 400
+
     # success
     r_ok = client.post("/api/auth/topup", json={"user_id": uid, "currency": "USD", "amount": 50.25})
     assert r_ok.status_code == 200
     body = r_ok.get_json()
     assert body["balance_minor"] == 5025
     assert body["balance_decimal"] == "50.25"
+
+
+def test_login_upgrades_old_hashes(client):
+    from werkzeug.security import generate_password_hash
+    from app.models import User
+    from app.passwords import Hasher, HashingBusy
+
+    uid = client.post("/api/auth/signup", json={"email": "old@example.com", "password": "pw"}).get_json()["user_id"]
+    user = db.session.get(User, uid)
+    assert user.password_hash.startswith("$pbkdf2-sha256$")
+
+    # a hash from before the passlib switch
+    user.password_hash = generate_password_hash("pw")
+    db.session.commit()
+    assert client.post("/api/auth/login", json={"email": "old@example.com", "password": "nope"}).status_code == 401
+    r = client.post("/api/auth/login", json={"email": "old@example.com", "password": "pw"})
+    assert r.status_code == 200
+    assert r.get_json()["user_id"] == uid
+    db.session.expire_all()
+    assert db.session.get(User, uid).password_hash.startswith("$pbkdf2-sha256$")
+
+    # a cheaper cost than the configured one is rehashed too
+    cheap = Hasher(rounds=1000)
+    user = db.session.get(User, uid)
+    user.password_hash = cheap.hash("pw")
+    db.session.commit()
+    client.application.extensions["password_hasher"] = Hasher(rounds=2000)
+    assert client.post("/api/auth/login", json={"email": "old@example.com", "password": "pw"}).status_code == 200
+    db.session.expire_all()
+    assert "$2000$" in db.session.get(User, uid).password_hash
+
+    # the legacy upgrade is skipped, not the login, when the pool is busy
+    legacy = generate_password_hash("pw")
+    user = db.session.get(User, uid)
+    user.password_hash = legacy
+    db.session.commit()
+    hasher = client.application.extensions["password_hasher"]
+    calls = []
+    def busy(password):
+        calls.append(password)
+        raise HashingBusy()
+    hasher.hash = busy
+    assert client.post("/api/auth/login", json={"email": "old@example.com", "password": "pw"}).status_code == 200
+    assert calls == ["pw"]
+    db.session.expire_all()
+    assert db.session.get(User, uid).password_hash == legacy
+
+
+def test_verify_only_treats_unknown_hashes_as_a_mismatch():
+    from app.passwords import Hasher
+
+    hasher = Hasher(rounds=1000)
+    stored = hasher.hash("pw")
+    assert hasher.verify("pw", "not a hash") == (False, None)
+    assert hasher.verify("nope", stored) == (False, None)
+
+    # a failing backend or rehash is an error, not a wrong password
+    def broken(password, hash):
+        raise ValueError("backend failed")
+    hasher.context.verify_and_update = broken
+    with pytest.raises(ValueError, match="backend failed"):
+        hasher.verify("pw", stored)
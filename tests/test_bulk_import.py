@@ -0,0 +1,98 @@
+import json
+import os
+
+import pytest
+from app import create_app, db, ledger
+from app.bulk_import import import_file
+from app.models import Card, JournalEntry, User
+
+
+@pytest.fixture
+def app():
+    os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+    app = create_app("testing")
+    app.config["TESTING"] = True
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def test_ndjson_import_rejects_and_resumes(app, tmp_path):
+    rows = [
+        {"email": "a@bank.example", "first_name": "A", "usd": "12.50", "pan_masked": "411111******0001"},
+        {"email": "b@bank.example", "lbp": 300000},
+        {"email": "not-an-email"},
+        {"email": "a@bank.example"},
+        {"email": "c@bank.example", "usd": "1.005"},
+        {"email": "d@bank.example", "pan_masked": "411111******0004", "card_type": "plastic"},
+        {"email": "e@bank.example", "password": "pw"},
+    ]
+    path = tmp_path / "users.ndjson"
+    path.write_text("\n".join(json.dumps(r) for r in rows) + "\n{oops\n")
+
+    result = import_file(str(path), chunk_size=2)
+    assert result.users == 3
+    assert result.cards == 1
+    assert result.records == 8
+    assert result.rejected == {
+        "invalid email": 1, "email exists": 1, "amount has more than 2 decimals": 1,
+        "invalid card_type": 1, "malformed JSON": 1,
+    }
+    assert "rejected: 5" in result.summary()
+    rejects = [json.loads(l) for l in (tmp_path / "users.ndjson.rejects.ndjson").read_text().splitlines()]
+    assert sorted(r["record"] for r in rejects) == [3, 4, 5, 6, 8]
+
+    a = User.query.filter_by(email="a@bank.example").one()
+    assert ledger.balance_of(a.id, "USD") == 1250
+    assert ledger.balance_of(a.id, "LBP") == 0
+    assert Card.query.filter_by(user_id=a.id).one().pan_masked == "411111******0001"
+    b = User.query.filter_by(email="b@bank.example").one()
+    assert ledger.balance_of(b.id, "LBP") == 30000000
+    assert db.session.query(db.func.sum(JournalEntry.amount)).scalar() == 0
+    assert User.query.filter_by(email="e@bank.example").one().check_password("pw")
+
+    # a second run resumes after the last committed record
+    with open(path, "a") as f:
+        f.write(json.dumps({"email": "f@bank.example"}) + "\n" + json.dumps({"email": "b@bank.example"}) + "\n")
+    result = import_file(str(path), chunk_size=2)
+    assert result.resumed_from == 8
+    assert result.users == 4
+    assert result.rejected["email exists"] == 2
+    assert User.query.count() == 4
+
+
+def test_csv_import(app, tmp_path):
+    path = tmp_path / "users.csv"
+    path.write_text("email,first_name,usd,lbp\nx@bank.example,X,5,\ny@bank.example,,,7.25\n")
+    result = import_file(str(path))
+    assert result.users == 2
+    y = User.query.filter_by(email="y@bank.example").one()
+    assert ledger.balances_of(y.id) == {"LBP": 725, "USD": 0}
+
+
+def test_badly_typed_records_are_rejected_not_fatal(app, tmp_path):
+    rows = [
+        {"email": "ok1@bank.example", "usd": "1.00"},
+        {"email": "p@bank.example", "password": 123},
+        {"email": "n@bank.example", "first_name": {"x": 1}},
+        {"email": "l@bank.example", "last_name": "x" * 121},
+        {"email": "o@bank.example", "usd": "99999999999999999999999999.00"},
+        {"email": "e@bank.example", "pan_masked": "411111******0009", "expiry": "1226123"},
+        {"email": "c@bank.example", "pan_masked": 4111110009},
+        {"email": "ok2@bank.example", "first_name": "Ok", "lbp": "92233720368547758.07"},
+    ]
+    path = tmp_path / "typed.ndjson"
+    path.write_text("\n".join(json.dumps(r) for r in rows) + "\n")
+
+    result = import_file(str(path), chunk_size=3)
+    assert result.users == 2
+    assert result.rejected == {
+        "invalid password": 1, "invalid first_name": 1, "invalid last_name": 1,
+        "amount out of range": 1, "invalid expiry": 1, "invalid pan_masked": 1,
+    }
+    rejects = [json.loads(l) for l in (tmp_path / "typed.ndjson.rejects.ndjson").read_text().splitlines()]
+    assert sorted(r["record"] for r in rejects) == [2, 3, 4, 5, 6, 7]
+    ok2 = User.query.filter_by(email="ok2@bank.example").one()
+    assert ledger.balance_of(ok2.id, "LBP") == 2 ** 63 - 1
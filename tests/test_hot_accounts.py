@@ -0,0 +1,54 @@
+import os
+import pytest
+from app import create_app, db, ledger
+from app.models import CurrencyBalance
+
+
+@pytest.fixture
+def client():
+    os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+    app = create_app("testing")
+    app.config["TESTING"] = True
+    with app.app_context():
+        db.create_all()
+        yield app.test_client()
+        db.session.remove()
+        db.drop_all()
+
+
+def signup(client, email):
+    r = client.post("/api/auth/signup", json={"email": email, "password": "pw"})
+    assert r.status_code == 201
+    return r.get_json()["user_id"]
+
+
+def test_hot_account_slots_aggregate_and_drain(client):
+    merchant = signup(client, "merchant@example.com")
+    payer = signup(client, "payer@example.com")
+
+    with client.application.app_context():
+        ledger.set_slots(merchant, "USD", 3)
+        rows = db.session.query(CurrencyBalance).filter_by(user_id=merchant, currency="USD").order_by(CurrencyBalance.slot).all()
+        assert [r.slot for r in rows] == [0, 1, 2]
+        rows[0].amount, rows[1].amount, rows[2].amount = 1000, 2000, 3000
+        db.session.commit()
+
+    r = client.get(f"/api/payments/wallets/{merchant}")
+    usd = [b for b in r.get_json() if b["currency"] == "USD"][0]
+    assert usd["balance_minor"] == 6000
+
+    # a debit larger than any single slot drains them in slot order
+    r = client.post("/api/transfer/transfer", json={"from_user_id": merchant, "to_user_id": payer, "currency": "USD", "amount": 45.00})
+    assert r.status_code == 200
+    assert r.get_json()["from_new_balance"] == 1500
+    assert r.get_json()["to_new_balance"] == 4500
+
+    r = client.post("/api/auth/topup", json={"user_id": merchant, "currency": "USD", "amount": 1.00})
+    assert r.get_json()["balance_minor"] == 1600
+
+    # folding back to one slot keeps the total
+    with client.application.app_context():
+        ledger.set_slots(merchant, "USD", 1)
+        db.session.commit()
+        rows = db.session.query(CurrencyBalance).filter_by(user_id=merchant, currency="USD").all()
+        assert [(r.slot, r.amount) for r in rows] == [(0, 1600)]
@@ -0,0 +1,67 @@
+import os
+from datetime import timedelta
+
+import pytest
+from app import create_app, db, journal
+from app.models import CurrencyBalance, JournalEntry, BalanceSnapshot
+
+
+@pytest.fixture
+def client():
+    os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+    os.environ["LEDGER_MODE"] = "journal"
+    app = create_app("testing")
+    del os.environ["LEDGER_MODE"]
+    app.config["TESTING"] = True
+    with app.app_context():
+        db.create_all()
+        yield app.test_client()
+        db.session.remove()
+        db.drop_all()
+
+
+def signup(client, email):
+    r = client.post("/api/auth/signup", json={"email": email, "password": "pw"})
+    assert r.status_code == 201
+    return r.get_json()["user_id"]
+
+
+def usd(client, uid):
+    wallets = client.get(f"/api/payments/wallets/{uid}").get_json()
+    return [w for w in wallets if w["currency"] == "USD"][0]["balance_minor"]
+
+
+def test_journal_mode_appends_and_compacts(client):
+    ua = signup(client, "a@example.com")
+    ub = signup(client, "b@example.com")
+
+    r = client.post("/api/auth/topup", json={"user_id": ua, "currency": "USD", "amount": 100.00})
+    assert r.get_json()["balance_minor"] == 10000
+    r = client.post("/api/transfer/transfer", json={"from_user_id": ua, "to_user_id": ub, "currency": "USD", "amount": 25.50})
+    assert r.get_json()["from_new_balance"] == 7450
+    r = client.post("/api/transfer/transfer", json={"from_user_id": ub, "to_user_id": ua, "currency": "USD", "amount": 30.00})
+    assert r.status_code == 402
+    r = client.post("/api/transfer/batch", json={"legs": [
+        {"from_user_id": ub, "to_user_id": ua, "currency": "USD", "amount": 5.00},
+    ]})
+    assert r.status_code == 200
+
+    assert usd(client, ua) == 7950
+    assert usd(client, ub) == 2050
+
+    with client.application.app_context():
+        # balance rows are never written in journal mode
+        assert {b.amount for b in db.session.query(CurrencyBalance)} == {0}
+        entries = db.session.query(JournalEntry).all()
+        assert len(entries) == 6
+        assert sum(e.amount for e in entries) == 0
+
+        advanced, cutoff = journal.compact(lag=timedelta(0))
+        assert advanced == 3  # a, b and external:topup
+        snap = db.session.get(BalanceSnapshot, (ua, "USD"))
+        assert (snap.amount, snap.last_entry_id) == (7950, cutoff)
+
+    # reads are unchanged by compaction and the tail keeps growing after it
+    assert usd(client, ua) == 7950
+    client.post("/api/auth/topup", json={"user_id": ua, "currency": "USD", "amount": 1.00})
+    assert usd(client, ua) == 8050
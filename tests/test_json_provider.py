@@ -0,0 +1,26 @@
+import json
+import os
+from datetime import datetime
+from decimal import Decimal
+
+from flask.json.provider import DefaultJSONProvider
+
+from app import create_app
+from app.json_provider import FastJSONProvider
+
+
+def test_fast_provider_matches_flask_output():
+    os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+    app = create_app("testing")
+    assert isinstance(app.json, FastJSONProvider)
+    stdlib = DefaultJSONProvider(app)
+
+    obj = {"b": [1, 2.5, None], "a": "x", "when": datetime(2025, 10, 26, 13, 4, 15), "amount": Decimal("10.50")}
+    with app.app_context():
+        fast_body = app.json.response(obj).get_data()
+        std_body = stdlib.response(obj).get_data()
+    assert fast_body == std_body
+    assert app.json.loads(fast_body) == json.loads(std_body)
+
+    # past 64 bits orjson gives up and the stdlib encodes it
+    assert app.json.dumps({"n": 2 ** 70}) == '{"n":%d}' % 2 ** 70
@@ -0,0 +1,55 @@
+import json
+import os
+
+import pytest
+from app import create_app, db
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+    monkeypatch.setenv("METRICS_DIR", str(tmp_path / "metrics"))
+    app = create_app("testing")
+    app.config["TESTING"] = True
+    with app.app_context():
+        db.create_all()
+        yield app.test_client()
+        db.session.remove()
+        db.drop_all()
+
+
+def sample(text, line_prefix):
+    for line in text.splitlines():
+        if line.startswith(line_prefix):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_metrics_exposition(client, tmp_path):
+    r = client.post("/api/auth/signup", json={"email": "m@example.com", "password": "pw"})
+    uid = r.get_json()["user_id"]
+    client.post("/api/auth/topup", json={"user_id": uid, "currency": "USD", "amount": 5.00})
+    client.post("/api/payments/create-card", json={"user_id": uid, "pan_masked": "411111******1111"})
+    before = sample(client.get("/metrics").get_data(as_text=True), 'authorization_outcomes_total{action_code="51"}')
+    client.post("/api/webhook/webhook/authorize", json={
+        "messageType": "2100", "primaryAccountNumber": "411111******1111",
+        "amountTransaction": "9.00", "currencyCode": "840", "idempotency_key": "metrics-1",
+    })
+
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.mimetype == "text/plain"
+    text = r.get_data(as_text=True)
+    assert "# TYPE http_request_duration_seconds histogram" in text
+    assert sample(text, 'http_request_duration_seconds_count{route="/api/auth/signup",method="POST",status="201"}') >= 1
+    assert 'http_request_duration_seconds_bucket{route="/api/auth/topup",method="POST",status="200",le="+Inf"}' in text
+    assert sample(text, 'db_statements_per_request_sum{route="/api/auth/signup"}') >= 1
+    assert sample(text, 'authorization_outcomes_total{action_code="51"}') == before + 1
+
+    # another worker's dump is merged in
+    other = {"counters": [["authorization_outcomes_total", [["action_code", "57"]], 3]], "hists": []}
+    with open(tmp_path / "metrics" / "99999-1.json", "w") as f:
+        json.dump(other, f)
+    text = client.get("/metrics").get_data(as_text=True)
+    assert sample(text, 'authorization_outcomes_total{action_code="57"}') >= 3
+    assert any(name.startswith("%d-" % os.getpid()) for name in os.listdir(tmp_path / "metrics"))
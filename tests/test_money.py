@@ -0,0 +1,52 @@
+from decimal import Decimal
+
+import pytest
+
+from app.money import InvalidAmount, Money, format_minor, to_minor, to_minor_many
+
+
+def test_to_minor_is_exact():
+    assert to_minor("10.50") == 1050
+    assert to_minor(25.5) == 2550
+    assert to_minor(7) == 700
+    assert to_minor(Decimal("0.07")) == 7
+    assert to_minor(" 1.230 ") == 123
+    assert to_minor("1e2") == 10000
+    # beyond float precision
+    assert to_minor("12345678901234567.89", "LBP") == 1234567890123456789
+
+    for bad in ("1.234", 0.1 + 0.2, "abc", "", "-", "1.2.3", "1_0.00", "٣.00", True, None, "9" * 40, float("nan")):
+        with pytest.raises(InvalidAmount):
+            to_minor(bad)
+
+
+def test_to_minor_many_reports_index():
+    assert to_minor_many([("1.00", "USD"), (2, "LBP"), (" .5", "USD")]) == [100, 200, 50]
+    with pytest.raises(InvalidAmount) as e:
+        to_minor_many([("1.00", "USD"), ("1.001", "USD")])
+    assert e.value.index == 1
+
+
+def test_whitespace_never_takes_the_fast_path():
+    # int() ignores surrounding whitespace, so "1.0 " must not be read as "10"
+    for text in ("1.0 ", " 1.0", "1.5 ", "1.5\n", "\t2.5"):
+        assert to_minor(text) == to_minor(text.strip()), text
+    assert to_minor("1.0 ") == 100 and to_minor("1.5 ") == 150
+    assert to_minor(" 1.00") == 100 and to_minor("1.00 ") == 100
+    assert to_minor_many([("1.0 ", "USD"), (" 1.5", "LBP"), ("2.50", "USD")]) == [100, 150, 250]
+
+
+def test_format_and_money():
+    assert format_minor(123456) == "1234.56"
+    assert format_minor(5) == "0.05"
+    assert format_minor(-5) == "-0.05"
+    assert format_minor(1234567890123456789, "LBP") == "12345678901234567.89"
+
+    a = Money.parse("1.50", "USD")
+    assert a + Money(25, "USD") == Money(175, "USD")
+    assert str(a - Money(200, "USD")) == "-0.50"
+    assert {a: 1}[Money(150, "USD")] == 1
+    with pytest.raises(ValueError):
+        a + Money(1, "LBP")
+    with pytest.raises(AttributeError):
+        a.minor = 1
@@ -0,0 +1,252 @@
+import os
+import pytest
+from app import create_app, db
+
+
+@pytest.fixture
+def client():
+    os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+    app = create_app("testing")
+    app.config["TESTING"] = True
+    with app.app_context():
+        db.create_all()
+        yield app.test_client()
+        db.session.remove()
+        db.drop_all()
+
+
+def signup(client, email):
+    r = client.post("/api/auth/signup", json={"email": email, "password": "pw"})
+    assert r.status_code == 201
+    return r.get_json()["user_id"]
+
+
+def test_history_keyset_pagination(client):
+    ua = signup(client, "a@example.com")
+    ub = signup(client, "b@example.com")
+    client.post("/api/auth/topup", json={"user_id": ua, "currency": "USD", "amount": 100.00})
+    for _ in range(3):
+        client.post("/api/transfer/transfer", json={"from_user_id": ua, "to_user_id": ub, "currency": "USD", "amount": 1.00})
+    client.post("/api/transfer/transfer", json={"from_user_id": ub, "to_user_id": ua, "currency": "USD", "amount": 0.50})
+    # a self-transfer matches both sides but must be listed once
+    client.post("/api/transfer/transfer", json={"from_user_id": ua, "to_user_id": ua, "currency": "USD", "amount": 0.25})
+
+    seen = []
+    cursor = None
+    pages = 0
+    while True:
+        url = f"/api/payments/payments/history/{ua}?limit=2"
+        if cursor:
+            url += f"&cursor={cursor}"
+        r = client.get(url)
+        assert r.status_code == 200
+        page = r.get_json()
+        assert len(page) <= 2
+        seen.extend(page)
+        pages += 1
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    assert pages == 3
+    assert len(seen) == 6
+    assert len({tx["id"] for tx in seen}) == 6
+    stamps = [(tx["created_at"], tx["id"]) for tx in seen]
+    assert stamps == sorted(stamps, reverse=True)
+    assert seen[-1]["type"] == "topup"
+
+    assert client.get(f"/api/payments/payments/history/{ua}?cursor=bogus").status_code == 400
+
+
+def test_wallet_summary_rollups(client):
+    from app import statements
+    from app.models import MonthlyStatement
+
+    ua = signup(client, "sa@example.com")
+    ub = signup(client, "sb@example.com")
+    client.post("/api/auth/topup", json={"user_id": ua, "currency": "USD", "amount": 100.00})
+    client.post("/api/transfer/transfer", json={"from_user_id": ua, "to_user_id": ub, "currency": "USD", "amount": 10.00})
+    client.post("/api/transfer/transfer", json={"from_user_id": ua, "to_user_id": ub, "currency": "USD", "amount": 5.00})
+    client.post("/api/payments/payments", json={"from_user_id": ua, "currency": "USD", "amount": 2.50})
+    client.post("/api/payments/create-card", json={"user_id": ua, "pan_masked": "411111******2222"})
+    client.post("/api/webhook/webhook/authorize", json={
+        "messageType": "2100", "primaryAccountNumber": "411111******2222", "amountTransaction": "1.00",
+        "currencyCode": "840", "idempotency_key": "summary-1",
+    })
+
+    r = client.get(f"/api/payments/wallets/{ua}/summary")
+    assert r.status_code == 200
+    [month] = r.get_json()["months"]
+    assert month["currency"] == "USD"
+    assert month["in"] == 10000
+    assert month["out"] == 1000 + 500 + 250 + 100
+    assert month["by_type"]["p2p"] == {"in": 0, "out": 1500, "count": 2}
+    assert month["by_type"]["card_payment"] == {"in": 0, "out": 100, "count": 1}
+    [month] = client.get(f"/api/payments/wallets/{ub}/summary").get_json()["months"]
+    assert month["in"] == 1500 and month["out"] == 0
+    assert client.get(f"/api/payments/wallets/{ua}/summary?from=2999-01").get_json()["months"] == []
+    assert client.get(f"/api/payments/wallets/{ua}/summary?from=jan").status_code == 400
+
+    assert statements.rebuild(verify=True) == {}
+    row = MonthlyStatement.query.filter_by(user_id=ub, type="p2p").one()
+    row.amount = 1
+    db.session.commit()
+    assert len(statements.rebuild(verify=True)) == 1
+    statements.rebuild()
+    assert statements.rebuild(verify=True) == {}
+    assert client.get(f"/api/payments/wallets/{ub}/summary").get_json()["months"][0]["in"] == 1500
+
+
+def test_reads_routed_to_replica_unless_lagging_or_just_written(tmp_path, monkeypatch):
+    from app.models import CurrencyBalance, ReplicaHeartbeat, Transaction
+    from app.replica import now_ms
+    from sqlalchemy.orm import Session
+
+    # two local databases stand in for a primary and its replica
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'primary.db'}")
+    monkeypatch.setenv("REPLICA_DATABASE_URL", f"sqlite:///{tmp_path / 'replica.db'}")
+    monkeypatch.setenv("REPLICA_CHECK_INTERVAL", "0")
+    monkeypatch.setenv("BALANCE_CACHE_SIZE", "0")  # routing only
+    app = create_app("testing")
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        replica = app.extensions["replica"]
+        db.metadata.create_all(replica.engine)
+        ua = signup(client, "a@example.com")
+        client.post("/api/auth/topup", json={"user_id": ua, "currency": "USD", "amount": 100.00})
+        balance_id = CurrencyBalance.query.filter_by(user_id=ua, currency="USD").one().id
+
+        def replicate(beat_ms, amount):
+            with Session(replica.engine) as s:
+                s.merge(ReplicaHeartbeat(id=1, beat_ms=beat_ms))
+                s.merge(CurrencyBalance(id=balance_id, user_id=ua, currency="USD", amount=amount))
+                s.commit()
+            replica.check()
+
+        def balance(**headers):
+            wallets = client.get(f"/api/payments/wallets/{ua}", headers=headers).get_json()
+            return {w["currency"]: w["balance_minor"] for w in wallets}["USD"]
+
+        # no heartbeat on the replica yet: lag unknown, read the primary
+        assert replica.check() is None
+        assert balance() == 10000
+
+        replicate(now_ms() - 1000, 4000)
+        assert 0.9 <= replica.lag() < 5
+        assert balance() == 4000
+        assert client.get(f"/api/payments/payments/history/{ua}").get_json() == []
+        assert balance(**{"X-Read-After": "primary"}) == 10000
+
+        # a write newer than the replica's heartbeat is read from the primary
+        r = client.post("/api/auth/topup", json={"user_id": ua, "currency": "USD", "amount": 1.00})
+        written = r.headers["X-Write-Time"]
+        assert balance(**{"X-Read-After": written}) == 10100
+        replicate(int(written) + 1, 10100)
+        assert balance(**{"X-Read-After": written}) == 10100
+        assert "X-Write-Time" not in client.get(f"/api/payments/wallets/{ua}").headers
+
+        replicate(now_ms() - 60000, 4000)
+        assert balance() == 10100
+        assert client.get("/internal/replica").get_json()["serving"] is False
+        assert Transaction.query.count() == 2
+        db.session.remove()
+
+
+def test_balance_cache_invalidated_by_every_mutation(client):
+    from app import balance_cache, ledger
+    from app.models import CurrencyBalance
+
+    app = client.application
+    ua = signup(client, "a@example.com")
+    ub = signup(client, "b@example.com")
+    client.post("/api/auth/topup", json={"user_id": ua, "currency": "USD", "amount": 100.00})
+    cache = app.extensions["balance_cache"]
+
+    def usd(user_id):
+        wallets = client.get(f"/api/payments/wallets/{user_id}").get_json()
+        return {w["currency"]: w["balance_minor"] for w in wallets}["USD"]
+
+    assert usd(ua) == 10000
+    # a change that bypasses the ledger isn't seen: the value is served from memory
+    db.session.execute(db.update(CurrencyBalance).where(CurrencyBalance.user_id == ua, CurrencyBalance.currency == "USD")
+                       .values(amount=CurrencyBalance.amount + 1))
+    db.session.commit()
+    assert usd(ua) == 10000
+    assert cache.stats()["hits"] >= 1
+
+    # a second worker on the same host shares the version stamps
+    other = balance_cache.BalanceCache(100, 60, balance_cache.default_version_file(app.config["SQLALCHEMY_DATABASE_URI"]))
+    assert other.get_many([ua], ledger.balances_of_many)[ua]["USD"] == 10001
+
+    client.post("/api/auth/topup", json={"user_id": ua, "currency": "USD", "amount": 1.00})
+    assert usd(ua) == 10101
+    client.post("/api/transfer/transfer", json={"from_user_id": ua, "to_user_id": ub, "currency": "USD", "amount": 1.00})
+    assert usd(ua) == 10001 and usd(ub) == 100
+    client.post("/api/payments/payments", json={"from_user_id": ua, "to_user_id": ub, "currency": "USD", "amount": 1.00})
+    assert usd(ua) == 9901 and usd(ub) == 200
+    client.post("/api/payments/create-card", json={"user_id": ua, "pan_masked": "411111******3333"})
+    r = client.post("/api/webhook/webhook/authorize", json={
+        "messageType": "2100", "primaryAccountNumber": "411111******3333", "amountTransaction": "1.00",
+        "currencyCode": "840", "idempotency_key": "cache-1",
+    })
+    assert r.get_json()["actionCode"] == "00"
+    assert usd(ua) == 9801
+    assert other.get_many([ua], ledger.balances_of_many)[ua]["USD"] == 9801
+
+    # a value loaded before a commit is not stored over it
+    def load_then_commit(user_ids):
+        loaded = ledger.balances_of_many(user_ids)
+        cache.invalidate(user_ids)
+        return loaded
+    cache.invalidate([ub])
+    cache.get_many([ub], load_then_commit)
+    assert cache._cache.get(ub) is None
+
+    r = client.post("/api/payments/wallets/bulk", json={"user_ids": [ua, ub, "nobody"]})
+    body = r.get_json()
+    assert {w["currency"]: w["balance_minor"] for w in body[ua]}["USD"] == 9801
+    assert {w["currency"]: w["balance_minor"] for w in body[ub]}["USD"] == 200
+    assert body["nobody"] == []
+    assert client.post("/api/payments/wallets/bulk", json={"user_ids": "x"}).status_code == 400
+
+
+def test_wallets_of_unknown_users_with_cache_off(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "sqlite:///:memory:")
+    monkeypatch.setenv("BALANCE_CACHE_SIZE", "0")
+    app = create_app("testing")
+    assert app.extensions["balance_cache"] is None
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        ua = signup(client, "a@example.com")
+
+        r = client.get("/api/payments/wallets/nobody")
+        assert r.status_code == 200 and r.get_json() == []
+
+        r = client.post("/api/payments/wallets/bulk", json={"user_ids": [ua, "nobody"]})
+        assert r.status_code == 200
+        body = r.get_json()
+        assert {w["currency"] for w in body[ua]} == {"USD", "LBP"}
+        assert body["nobody"] == []
+        db.session.remove()
+        db.drop_all()
+
+
+def test_non_positive_amounts_are_rejected(client):
+    from app import ledger
+    from app.money import InvalidAmount
+
+    ua = signup(client, "a@example.com")
+    ub = signup(client, "b@example.com")
+    for amount in (-50, 0, "-0.50"):
+        r = client.post("/api/payments/payments", json={"from_user_id": ua, "to_user_id": ub, "currency": "USD", "amount": amount})
+        assert r.status_code == 400
+    wallets = client.get(f"/api/payments/wallets/{ub}").get_json()
+    assert {w["currency"]: w["balance_minor"] for w in wallets}["USD"] == 0
+
+    # the ledger primitives refuse them too, whoever calls them
+    for call in (ledger.debit, ledger.try_debit, ledger.credit):
+        for minor in (0, -50):
+            with pytest.raises(InvalidAmount):
+                call(ua, "USD", minor)
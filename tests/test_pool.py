@@ -0,0 +1,48 @@
+import pytest
+from app import create_app, db
+from app.pool import TimedQueuePool
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # a file database, so the app gets a real queue pool
+    monkeypatch.setenv("DATABASE_URL", "sqlite:///" + str(tmp_path / "pool.db"))
+    monkeypatch.setenv("DB_POOL_SIZE", "2")
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "1")
+    monkeypatch.setenv("DB_POOL_TIMEOUT", "5")
+    monkeypatch.setenv("DB_POOL_PRE_PING", "1")
+    app = create_app("testing")
+    app.config["TESTING"] = True
+    with app.app_context():
+        db.create_all()
+        yield app.test_client()
+        db.session.remove()
+        db.drop_all()
+
+
+def test_pool_options_and_timing(client):
+    with client.application.app_context():
+        pool = db.engine.pool
+    assert isinstance(pool, TimedQueuePool)
+    assert pool.size() == 2
+    assert pool.max_overflow == 1
+    assert pool._timeout == 5
+
+    r = client.post("/api/auth/signup", json={"email": "pool@example.com", "password": "pw"})
+    assert r.status_code == 201
+    assert r.headers["Server-Timing"].startswith("db-wait;dur=")
+    assert "db-hold;dur=" in r.headers["Server-Timing"]
+
+    status = client.get("/internal/pool").get_json()
+    assert status["pool"]["size"] == 2
+    assert 0 <= status["pool"]["saturation"] <= 1
+    assert status["stats"]["checkouts"] >= 1
+    assert status["stats"]["timeouts"] == 0
+    assert status["pool"]["max_overflow"] == 1
+
+    # a read-only request hands its connection back before the header is built
+    uid = r.get_json()["user_id"]
+    r = client.get(f"/api/payments/wallets/{uid}")
+    hold = float(r.headers["Server-Timing"].split("db-hold;dur=")[1])
+    assert hold > 0
+    assert pool.checkedout() == 0
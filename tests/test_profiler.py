@@ -0,0 +1,77 @@
+import os
+
+import pytest
+from app import create_app, db
+from app.models import User
+from app.profiler import QueryBudgetExceeded, query_budget
+
+
+@pytest.fixture
+def client():
+    os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+    app = create_app("testing")
+    app.config["TESTING"] = True
+    with app.app_context():
+        db.create_all()
+        yield app.test_client()
+        db.session.remove()
+        db.drop_all()
+
+
+def signup(client, email):
+    return client.post("/api/auth/signup", json={"email": email, "password": "pw"}).get_json()["user_id"]
+
+
+def test_endpoint_query_budgets(client):
+    ua = signup(client, "a@example.com")
+    ub = signup(client, "b@example.com")
+    with query_budget(5, max_repeats=1):
+        assert client.post("/api/auth/topup", json={"user_id": ua, "currency": "USD", "amount": 50.00}).status_code == 200
+    with query_budget(7, max_repeats=2):
+        assert client.post("/api/transfer/transfer", json={"from_user_id": ua, "to_user_id": ub, "currency": "USD", "amount": 1.00}).status_code == 200
+    with query_budget(7, max_repeats=2):
+        assert client.post("/api/payments/payments", json={"from_user_id": ua, "to_user_id": ub, "currency": "USD", "amount": 1.00}).status_code == 201
+    with query_budget(1):
+        assert client.get(f"/api/payments/payments/history/{ua}").status_code == 200
+    with query_budget(1):
+        assert client.get(f"/api/payments/wallets/{ua}").status_code == 200
+
+    client.post("/api/payments/create-card", json={"user_id": ua, "pan_masked": "411111******1111"})
+    payload = {"messageType": "2100", "primaryAccountNumber": "411111******1111", "amountTransaction": "1.00",
+               "currencyCode": "840", "idempotency_key": "budget-1"}
+    with query_budget(8, max_repeats=1):
+        assert client.post("/api/webhook/webhook/authorize", json=payload).get_json()["actionCode"] == "00"
+    with query_budget(0):
+        client.post("/api/webhook/webhook/authorize", json=payload)  # replayed from the idempotency cache
+
+
+def test_budget_catches_lazy_load_n_plus_one(client):
+    for n in range(3):
+        signup(client, f"n{n}@example.com")
+    db.session.expunge_all()
+    with pytest.raises(QueryBudgetExceeded, match="repeated 3 times"):
+        with query_budget(max_repeats=1):
+            for user in User.query.all():
+                list(user.balances)
+
+
+def test_profile_mode_logs_slow_queries_and_repeats(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "sqlite:///:memory:")
+    monkeypatch.setenv("SQL_PROFILE", "1")
+    monkeypatch.setenv("SQL_SLOW_QUERY_MS", "0")
+    monkeypatch.setenv("SQL_PROFILE_LOG", str(tmp_path / "sql.log"))
+    app = create_app("testing")
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        uid = signup(client, "p@example.com")
+        client.get(f"/api/payments/wallets/{uid}")
+        recent = client.get("/internal/sql-profile").get_json()
+        db.drop_all()
+
+    assert recent[-1]["endpoint"] == "/api/payments/wallets/<user_id>"
+    assert recent[-1]["statements"] == 1
+    text = (tmp_path / "sql.log").read_text()
+    assert "slow query" in text
+    assert "SCAN" in text or "SEARCH" in text  # the EXPLAIN QUERY PLAN rows
+
@@ -0,0 +1,60 @@
+import pytest
+from app import create_app, db, serving
+from app.models import ReplicaHeartbeat
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # a file database: disposing an in-memory one would drop it
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'serve.db'}")
+    app = create_app("testing")
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def test_prepare_after_fork_and_worker_warm_up(app):
+    client = app.test_client()
+    user_id = client.post("/api/auth/signup", json={"email": "a@example.com", "password": "pw"}).get_json()["user_id"]
+    client.post("/api/payments/create-card", json={"user_id": user_id, "pan_masked": "411111******4444"})
+    cache = app.extensions["card_cache"]
+    cache.invalidate(["411111******4444"])
+
+    assert serving.prepare(app) == {"cards": 1}
+    assert cache.peek("411111******4444")[0].user_id == user_id
+    with app.app_context():
+        engine = db.engine
+    assert engine.pool.checkedin() == 0  # nothing for a forked worker to inherit
+
+    serving.after_fork(app)
+    assert serving.warm_worker(app, 3) == 3
+    assert engine.pool.checkedin() == 3 and engine.pool.checkedout() == 0
+    assert serving.warm_worker(app, 50) == engine.pool.size()
+
+
+def test_prepare_refuses_an_unmigrated_schema(app):
+    with app.app_context():
+        ReplicaHeartbeat.__table__.drop(db.engine)
+    with pytest.raises(serving.SchemaNotMigrated, match="replica_heartbeat"):
+        serving.prepare(app)
+
+
+def test_prepare_with_the_balance_cache_off(tmp_path, monkeypatch, caplog):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'serve.db'}")
+    monkeypatch.setenv("BALANCE_CACHE_SIZE", "0")
+    app = create_app("testing")
+    with app.app_context():
+        db.create_all()
+    assert serving.prepare(app) == {"cards": 0}
+
+    # a sample read that fails is logged, the rest of the warm-up still runs
+    def broken(user_id):
+        raise RuntimeError("boom")
+    monkeypatch.setitem(app.view_functions, "payments.get_wallets", broken)
+    assert serving.prepare(app) == {"cards": 0}
+    assert "warm-up read payments.get_wallets failed" in caplog.text
+    with app.app_context():
+        db.drop_all()
@@ -53,3 +53,86 @@ def test_transfer_success_and_insufficient(client):
     )
     assert r2.status_code == 402
     assert r2.get_json().get("error") == "insufficient_funds"
+
+
+def test_transfer_batch_all_or_nothing(client):
+    ua = signup(client, "a@example.com")
+    ub = signup(client, "b@example.com")
+    uc = signup(client, "c@example.com")
+    topup(client, ua, 100.00)
+
+    legs = [
+        {"from_user_id": ua, "to_user_id": ub, "currency": "USD", "amount": 10.00},
+        {"from_user_id": ua, "to_user_id": uc, "currency": "USD", "amount": 5.00},
+        {"from_user_id": ub, "to_user_id": uc, "currency": "USD", "amount": 2.50},
+    ]
+    r = client.post("/api/transfer/batch", json={"legs": legs})
+    assert r.status_code == 200
+    assert len(r.get_json()["tx_ids"]) == 3
+
+    with client.application.app_context():
+        amounts = {
+            uid: db.session.query(CurrencyBalance).filter_by(user_id=uid, currency="USD").one().amount
+            for uid in (ua, ub, uc)
+        }
+    assert amounts == {ua: 8500, ub: 750, uc: 750}
+
+    # the last leg overdraws, so nothing in the batch is applied
+    bad = legs[:1] + [{"from_user_id": uc, "to_user_id": ua, "currency": "USD", "amount": 50.00}]
+    r2 = client.post("/api/transfer/batch", json={"legs": bad})
+    assert r2.status_code == 402
+    assert r2.get_json() == {"error": "insufficient_funds", "leg": 1}
+
+    with client.application.app_context():
+        b_a = db.session.query(CurrencyBalance).filter_by(user_id=ua, currency="USD").one()
+        assert b_a.amount == 8500
+
+
+def test_exchange_converts_exactly_and_checks_rate_version(client):
+    from app import fx
+
+    ua = signup(client, "fx@example.com")
+    topup(client, ua, 10.00)
+    fx.set_rate("USD", "LBP", "89500.5")
+    client.application.extensions["rates"].refresh_interval = 0
+
+    rates = client.get("/api/transfer/rates").get_json()
+    assert rates["rates"] == {"USD/LBP": "89500.5"}
+    version = rates["version"]
+
+    # 3.33 USD -> 298036.665 LBP, rounded down to whole minor units
+    r = client.post("/api/transfer/exchange", json={
+        "user_id": ua, "from_currency": "USD", "to_currency": "LBP", "amount": 3.33, "rate_version": version,
+    })
+    assert r.status_code == 200
+    body = r.get_json()
+    assert body["debited"] == {"currency": "USD", "amount_minor": 333, "balance_minor": 667}
+    assert body["credited"] == {"currency": "LBP", "amount_minor": 29803666, "balance_minor": 29803666}
+
+    # a newer rate invalidates the quoted version until the snapshot is reloaded
+    fx.set_rate("USD", "LBP", "90000")
+    client.application.extensions["rates"].reload()
+    r = client.post("/api/transfer/exchange", json={
+        "user_id": ua, "from_currency": "USD", "to_currency": "LBP", "amount": 1, "rate_version": version,
+    })
+    assert r.status_code == 409
+    assert r.get_json()["rate"] == "90000"
+
+    # the current version sent as a string is still current
+    current = r.get_json()["rate_version"]
+    r = client.post("/api/transfer/exchange", json={
+        "user_id": ua, "from_currency": "USD", "to_currency": "LBP", "amount": 0.01, "rate_version": str(current),
+    })
+    assert r.status_code == 200
+    for bad in ("abc", 1.5, True, [current]):
+        r = client.post("/api/transfer/exchange", json={
+            "user_id": ua, "from_currency": "USD", "to_currency": "LBP", "amount": 0.01, "rate_version": bad,
+        })
+        assert r.status_code == 400
+
+    r = client.post("/api/transfer/exchange", json={
+        "user_id": ua, "from_currency": "USD", "to_currency": "LBP", "amount": 7.00,
+    })
+    assert r.status_code == 402
+    bal = db.session.query(CurrencyBalance).filter_by(user_id=ua, currency="USD").one()
+    assert bal.amount == 666
@@ -1,5 +1,9 @@
 import os
+import threading
+
 import pytest
+from sqlalchemy import event
+
 from app import create_app, db
 
 
@@ -101,3 +105,239 @@ def test_webhook_authorize_and_idempotency(client):
     r_repeat = client.post("/api/webhook/webhook/authorize", json=retail_payload)
     assert r_repeat.status_code == 200
     assert r_repeat.get_json() == jr
+
+
+def test_idempotency_cache_and_stored_claim(client):
+    from app.models import CardAuthRequest
+
+    uid, pan = setup_user_card_and_topup(client)
+    payload = {
+        "messageType": "2100",
+        "primaryAccountNumber": pan,
+        "amountTransaction": "5.00",
+        "currencyCode": "840",
+        "idempotency_key": "idem-cache-1",
+    }
+    first = client.post("/api/webhook/webhook/authorize", json=payload).get_json()
+    assert first["actionCode"] == "00"
+
+    # served from the in-process cache, no second debit
+    again = client.post("/api/webhook/webhook/authorize", json=payload).get_json()
+    assert again == first
+    stats = client.get("/api/webhook/webhook/stats").get_json()["idempotency_cache"]
+    assert stats["hits"] == 1
+
+    # another worker (empty cache) replays the stored response after its claim fails
+    client.application.extensions["idempotency_cache"].clear()
+    replay = client.post("/api/webhook/webhook/authorize", json=payload).get_json()
+    assert replay == first
+    with client.application.app_context():
+        assert db.session.query(CardAuthRequest).filter_by(idempotency_key="idem-cache-1").count() == 1
+
+    wallets = client.get(f"/api/payments/wallets/{uid}").get_json()
+    usd = [w for w in wallets if w["currency"] == "USD"][0]
+    assert usd["balance_minor"] == 10000 - 500
+
+
+def test_card_cache_invalidated_on_status_change(client):
+    uid, pan = setup_user_card_and_topup(client)
+    payload = {"primaryAccountNumber": pan, "amountTransaction": "1.00", "currencyCode": "840"}
+
+    r = client.post("/api/webhook/webhook/authorize", json=dict(payload, idempotency_key="idem-card-1"))
+    assert r.get_json()["actionCode"] == "00"
+    r = client.post("/api/webhook/webhook/authorize", json=dict(payload, idempotency_key="idem-card-2"))
+    assert r.get_json()["actionCode"] == "00"
+    assert client.get("/api/webhook/webhook/stats").get_json()["card_cache"]["hits"] == 1
+
+    with client.application.app_context():
+        from app.models import Card
+        card_id = db.session.query(Card).filter_by(pan_masked=pan).one().id
+    r = client.post(f"/api/payments/cards/{card_id}/status", json={"status": "frozen"})
+    assert r.status_code == 200
+
+    r = client.post("/api/webhook/webhook/authorize", json=dict(payload, idempotency_key="idem-card-3"))
+    assert r.get_json()["actionCode"] == "57"
+
+
+
+def test_card_cache_sees_a_bump_right_after_its_own(tmp_path, monkeypatch):
+    from types import SimpleNamespace
+    from app import card_cache
+
+    path = str(tmp_path / "cards.gen")
+    ours = card_cache.CardCache(100, 60, path)
+    theirs = card_cache.CardCache(100, 60, path)
+    card = SimpleNamespace(id="c1", user_id="u1", status="active", expiry="1226")
+    ours.store("pan-1", card, ours.peek("pan-1")[1])
+
+    # another worker bumps between our rename and anything we do after it
+    replace = os.replace
+    def racing_replace(src, dst):
+        replace(src, dst)
+        monkeypatch.setattr(card_cache.os, "replace", replace)
+        theirs.invalidate(["pan-1"])
+    monkeypatch.setattr(card_cache.os, "replace", racing_replace)
+    ours.invalidate(["pan-2"])
+
+    ours.store("pan-1", card, ours._local_gen)  # a stale read racing their bump
+    info, gen = ours.peek("pan-1")
+    assert info is None and gen == ours._local_gen
+
+def test_cross_currency_fallback(client):
+    from app import fx
+
+    uid, pan = setup_user_card_and_topup(client)
+    fx.set_rate("USD", "LBP", "89500")
+    client.application.extensions["rates"].refresh_interval = 0
+    payload = {
+        "messageType": "0100",
+        "processingCode": "000000",
+        "primaryAccountNumber": pan,
+        "amountTransaction": "100000.00",
+        "currencyCode": "422",
+        "entry_mode": "chip",
+        "idempotency_key": "idem-fx-1",
+    }
+
+    # off by default: no LBP funds, declined
+    r = client.post("/api/webhook/webhook/authorize", json=payload)
+    assert r.get_json()["actionCode"] == "51"
+
+    # 100000.00 LBP at 89500 costs ceil(111.73...) = 112 USD cents
+    client.application.config["AUTH_CROSS_CURRENCY"] = True
+    r = client.post("/api/webhook/webhook/authorize", json=dict(payload, idempotency_key="idem-fx-2"))
+    body = r.get_json()
+    assert body["actionCode"] == "00"
+    assert body["additionalAmounts"][0]["currencyCode"] == "840"
+    assert body["additionalAmounts"][0]["value"] == "000000009888"
+
+
+def test_compact_responses_and_retention_purge(client):
+    from datetime import datetime, timedelta
+    from app import idempotency
+    from app.models import CardAuthRequest
+
+    uid, pan = setup_user_card_and_topup(client)
+    client.application.config["IDEMPOTENCY_COMPACT_RESPONSES"] = True
+    payload = {
+        "messageType": "2100",
+        "primaryAccountNumber": pan,
+        "amountTransaction": "5.00",
+        "currencyCode": "840",
+        "cardAcceptorName": "SuperMart Downtown",
+        "idempotency_key": "idem-compact-1",
+    }
+    first = client.post("/api/webhook/webhook/authorize", json=payload).get_json()
+    assert first["actionCode"] == "00"
+
+    stored = db.session.query(CardAuthRequest).filter_by(idempotency_key="idem-compact-1").one()
+    assert "cardAcceptorName" not in stored.response_payload
+    assert stored.response_payload["actionCode"] == "00"
+
+    client.application.extensions["idempotency_cache"].clear()
+    replay = client.post("/api/webhook/webhook/authorize", json=payload).get_json()
+    assert replay == first
+
+    # only claims older than the cutoff go, in batches
+    stored.processed_at = datetime.utcnow() - timedelta(days=40)
+    db.session.commit()
+    client.post("/api/webhook/webhook/authorize", json=dict(payload, idempotency_key="idem-compact-2"))
+    assert idempotency.purge(idempotency.cutoff(24 * 30), batch_size=1) == 1
+    keys = [r.idempotency_key for r in db.session.query(CardAuthRequest)]
+    assert keys == ["idem-compact-2"]
+
+
+def test_group_commit_applies_batch_in_arrival_order(client):
+    from app import group_commit
+    from app.models import CardAuthRequest, Transaction
+
+    uid, pan = setup_user_card_and_topup(client)
+
+    def auth(key, amount):
+        return {"primaryAccountNumber": pan, "amountTransaction": amount, "currencyCode": "840", "idempotency_key": key}
+
+    # 100.00 available: 60 approved, 50 declined (51), 40 approved, then a repeat of the first
+    statements = []
+    record = lambda conn, cursor, sql, params, context, many: statements.append(sql)
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        results = group_commit.run_batch([auth("g-1", "60.00"), auth("g-2", "50.00"), auth("g-3", "40.00"), auth("g-1", "60.00")])
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    # keys are claimed before any balance is locked, as in the unbatched path
+    first_claim = next(i for i, sql in enumerate(statements) if sql.startswith("INSERT INTO card_auth_requests"))
+    first_lock = next(i for i, sql in enumerate(statements) if "FROM currency_balances" in sql)
+    assert first_claim < first_lock
+    codes = [body["actionCode"] for body, status in results]
+    assert codes == ["00", "51", "00", "00"]
+    assert results[3] == results[0]
+    assert db.session.query(CardAuthRequest).count() == 3
+    assert db.session.query(Transaction).filter_by(type="card_payment").count() == 2
+
+    # a later batch replays committed keys instead of authorizing again
+    again = group_commit.run_batch([auth("g-3", "40.00")])
+    assert again[0] == results[2]
+
+    # through the view, with the coalescing stage switched on
+    client.application.extensions["auth_group_commit"] = group_commit.GroupCommitter(0.001, 8)
+    r = client.post("/api/webhook/webhook/authorize", json=auth("g-4", "1.00"))
+    assert r.get_json()["actionCode"] == "51"
+    wallets = client.get(f"/api/payments/wallets/{uid}").get_json()
+    assert [w["balance_minor"] for w in wallets if w["currency"] == "USD"] == [0]
+
+
+def test_group_commit_followers_survive_their_leader(client, monkeypatch):
+    from app import group_commit
+
+    app = client.application
+    alone = lambda req: ({"alone": req["idempotency_key"]}, 200)
+    monkeypatch.setattr(group_commit, "process_authorization", alone)
+
+    class WorkerKilled(BaseException):
+        pass
+
+    def submit_all(committer, keys, results, stagger=0.0):
+        def one(key):
+            with app.app_context():
+                try:
+                    results[key] = committer.submit({"idempotency_key": key})
+                except WorkerKilled:
+                    results[key] = "killed"
+        threads = []
+        for key in keys:
+            threads.append(threading.Thread(target=one, args=(key,)))
+            threads[-1].start()
+            threading.Event().wait(stagger)
+        for t in threads:
+            t.join(5)
+            assert not t.is_alive()
+
+    # the leader dies mid-batch: the follower is released and runs alone
+    def killed(reqs):
+        raise WorkerKilled()
+    monkeypatch.setattr(group_commit, "run_batch", killed)
+    results = {}
+    submit_all(group_commit.GroupCommitter(5.0, 2, timeout=60), ["k-1", "k-2"], results, stagger=0.05)
+    assert results == {"k-1": "killed", "k-2": ({"alone": "k-2"}, 200)}
+
+    # a batch stuck past the timeout: the follower doesn't wait for it
+    release = threading.Event()
+    def stuck(reqs):
+        release.wait(5)
+        return [({"batched": r["idempotency_key"]}, 200) for r in reqs]
+    monkeypatch.setattr(group_commit, "run_batch", stuck)
+    results = {}
+    submit_all(group_commit.GroupCommitter(5.0, 2, timeout=0.1), ["s-1", "s-2"], results, stagger=0.05)
+    release.set()
+    assert results["s-2"] == ({"alone": "s-2"}, 200)
+
+    # a follower that times out while still queued leaves the queue
+    batches = []
+    def record(reqs):
+        batches.append([r["idempotency_key"] for r in reqs])
+        return [({"batched": r["idempotency_key"]}, 200) for r in reqs]
+    monkeypatch.setattr(group_commit, "run_batch", record)
+    results = {}
+    submit_all(group_commit.GroupCommitter(0.5, 8, timeout=0.05), ["q-1", "q-2"], results, stagger=0.05)
+    assert batches == [["q-1"]]
+    assert results == {"q-1": ({"batched": "q-1"}, 200), "q-2": ({"alone": "q-2"}, 200)}